@@ -0,0 +1,79 @@
+from binascii import hexlify
+
+# trace levels
+TRACE_NONE = 'none' # no script at all
+TRACE_PCOM = 'pcom' # replayable script: APDUs sent with out2Pcom
+TRACE_DEBUG = 'debug' # pcom, plus every other APDU as comment line
+TRACE_LEVELS = [TRACE_NONE, TRACE_PCOM, TRACE_DEBUG]
+
+# flags of traced APDU
+PCOM = 0x01 # part of pcom script
+
+
+def toPcomHex(data):
+    return hexlify(bytearray(data)).upper()
+
+
+def formatApdu(header, data, response, sw1, sw2):
+    # HEADER DATA [RESPONSE] (SWSW)
+    line = toPcomHex(header)
+    if data:
+        line += ' ' + toPcomHex(data)
+    if response:
+        line += ' [' + toPcomHex(response) + ']'
+    return line + ' (%.2X%.2X)' % (sw1, sw2)
+
+
+class ApduTrace:
+    # APDUs are recorded as raw tuples and text lines as they are; both are only
+    # formatted and written to pcom file once buffer is full, on flush() and on
+    # close(). nothing is kept for APDUs not written at current trace level.
+
+    CAPACITY = 1024 # entries formatted and written at once
+
+    def __init__(self, fileName, level=TRACE_PCOM, append=False):
+        self.level = level
+        self.file = None
+        if level != TRACE_NONE:
+            self.file = open(fileName, 'a' if append else 'w')
+        self.entries = []
+
+    def apdu(self, header, data, response, sw1, sw2, flags):
+        if self.file is None or (not flags & PCOM and self.level != TRACE_DEBUG):
+            return
+        # copies, callers may reuse their command buffers
+        self.entries.append((bytearray(header), data and bytearray(data), response, sw1, sw2, flags))
+        if len(self.entries) >= self.CAPACITY:
+            self.flush()
+
+    def write(self, text):
+        # comment, file header, .POWER_ON...
+        if self.file is None:
+            return
+        self.entries.append(text)
+        if len(self.entries) >= self.CAPACITY:
+            self.flush()
+
+    def flush(self):
+        if self.file is None:
+            return
+        lines = []
+        for entry in self.entries:
+            if isinstance(entry, basestring):
+                lines.append(entry)
+                continue
+            header, data, response, sw1, sw2, flags = entry
+            if flags & PCOM:
+                lines.append(formatApdu(header, data, response, sw1, sw2) + '\n')
+            else:
+                lines.append('; ' + formatApdu(header, data, response, sw1, sw2) + '\n')
+        self.file.write(''.join(lines))
+        self.file.flush()
+        self.entries = []
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
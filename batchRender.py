@@ -0,0 +1,112 @@
+from __future__ import print_function
+import os
+import sys
+import multiprocessing
+from timeit import default_timer
+
+from scanReport import getIccid, writeHtmlReport, writeJsonReport
+from scanStore import getScanInfo, loadScan, listScanFiles
+
+# report formats, also extension of report files
+FORMATS = ['html', 'json']
+
+
+def getOutputFileName(fileName, outputFolder, fileFormat):
+    # report next to dump, unless output folder is given
+    baseName = os.path.splitext(os.path.basename(fileName))[0]
+    return os.path.join(outputFolder or os.path.dirname(fileName), baseName + '.' + fileFormat)
+
+
+def isUpToDate(fileName, outputFileName):
+    return os.path.exists(outputFileName) and os.path.getmtime(outputFileName) >= os.path.getmtime(fileName)
+
+
+def getJobs(fileNames, outputFolder, formats, force=False):
+    # (dump, [(format, report)]) for dumps having a report missing or older
+    # than dump; a json dump is never written over by its own json report
+    jobs = []
+    for fileName in fileNames:
+        outputs = []
+        for fileFormat in formats:
+            outputFileName = getOutputFileName(fileName, outputFolder, fileFormat)
+            if os.path.abspath(outputFileName) == os.path.abspath(fileName):
+                continue
+            if force or not isUpToDate(fileName, outputFileName):
+                outputs.append((fileFormat, outputFileName))
+        if outputs:
+            jobs.append((fileName, outputs))
+    return jobs
+
+
+def renderScan(job):
+    # run in worker process; returns (dump, error message or None). report
+    # being written when failing is removed, so that it is rendered next time
+    fileName, outputs = job
+    outputFileName = None
+    try:
+        # rendered from dicts as loaded, faster than file records
+        fileDetails = loadScan(fileName)
+        for fileFormat, outputFileName in outputs:
+            if fileFormat == 'html':
+                iccid = getIccid(fileDetails)
+                if iccid is None:
+                    return fileName, 'EF ICCID not read'
+                # same generation date as report written by scanner
+                iccidDigits, scanTime = getScanInfo(fileName, fileDetails)
+                writeHtmlReport(outputFileName, fileDetails, iccid, scanTime)
+            else:
+                writeJsonReport(outputFileName, fileDetails)
+        return fileName, None
+    except Exception, e:
+        if outputFileName is not None and os.path.exists(outputFileName):
+            os.remove(outputFileName)
+        return fileName, '%s: %s' % (type(e).__name__, e)
+
+
+def renderScans(jobs, processes=None):
+    # reports of all jobs rendered by a pool of processes (one per core by
+    # default); yields (dump, error message or None) as jobs complete
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield renderScan(job)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        # a few chunks per process: less pickling than one job at a time,
+        # and processes kept busy until the end
+        chunkSize = max(1, len(jobs) // (processes * 4))
+        for result in pool.imap_unordered(renderScan, jobs, chunkSize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('batchRender')
+    parser.add_argument("paths", nargs='+', help="json dumps (or ndjson streams), or folders holding them")
+    parser.add_argument("-o", "--output", help="folder where reports are written (default: next to dumps)")
+    parser.add_argument("-f", "--format", action='append', choices=FORMATS, help="report format, may be repeated (default: html)")
+    parser.add_argument("-j", "--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="render reports even if newer than dumps")
+    args = parser.parse_args()
+
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    fileNames = listScanFiles(args.paths)
+    jobs = getJobs(fileNames, args.output, args.format or ['html'], args.force)
+    start = default_timer()
+    failed = 0
+    for fileName, errorMsg in renderScans(jobs, args.processes):
+        if errorMsg is not None:
+            failed += 1
+            print('%s: %s' % (fileName, errorMsg))
+    print('%d dump(s) rendered, %d up to date, %d failed (%.1f s)' % (len(jobs) - failed, len(fileNames) - len(jobs), failed,
+                                                                  default_timer() - start))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,235 @@
+from __future__ import print_function
+import sys
+import json
+import random
+import shutil
+import logging
+import platform
+import tempfile
+from datetime import datetime
+from timeit import default_timer
+from xml.dom.minidom import parse
+from xml.sax.saxutils import escape
+
+from cardSimulator import SimulatedCard, SimulatedReader
+from scanner import CardScanner
+
+FILES_PER_DF = 100
+DEFAULT_SIZES = [50, 500, 5000]
+DEFAULT_PARSE_SIZES = [1000, 10000, 50000]
+NUMBER_OF_OS_LOCKS = 32
+
+
+def randomHex(rng, length):
+    return ' '.join(['%0.2X' % rng.randint(0, 255) for i in range(length)])
+
+
+def generateProfile(numberOfFiles, seed=0):
+    # synthetic card in the format dumped by CardScanner.proceed()
+    rng = random.Random(seed)
+    profile = [
+        {'filePath': '3F00', 'fileName': 'MF', 'fileType': 'MF'},
+        {'filePath': '3F002FE2', 'fileName': 'ICCID', 'fileType': 'EF', 'fileStructure': 'transparent',
+         'fileSize': 10, '2gAcc': '0F FF 44', 'fileContent': '98 10 %0.2X %0.2X 00 00 00 00 00 F1' % (seed % 100, numberOfFiles % 100)}
+    ]
+    dfList = ['3F007F10', '3F007F20', '3F007FFF']
+    numberOfDf = max(len(dfList), numberOfFiles // FILES_PER_DF)
+    while len(dfList) < numberOfDf:
+        parent = dfList[len(dfList) % 3]
+        dfList.append(parent + '5F%0.2X' % (len(dfList) - 2))
+    dfList = dfList[:max(1, min(numberOfDf, numberOfFiles - len(profile)))]
+    for df in dfList:
+        profile.append({'filePath': df, 'fileName': 'DF_' + df[-4:], 'fileType': 'DF'})
+
+    efCount = {}
+    efPrefix = {4: '2F', 8: '6F', 12: '4F'}
+    while len(profile) < numberOfFiles:
+        df = dfList[len(profile) % len(dfList)]
+        index = efCount.get(df, 0)
+        efCount[df] = index + 1
+        path = df + efPrefix[len(df)] + '%0.2X' % index
+        ef = {'filePath': path, 'fileName': 'EF_' + path[-4:], 'fileType': 'EF', '2gAcc': '11 F1 44'}
+        if df.startswith('3F007FFF') and index < 30:
+            ef['sfi'] = '%0.2X' % (index + 1)
+        kind = rng.random()
+        if kind < 0.60:
+            size = rng.randint(1000, 4000) if rng.random() < 0.05 else rng.randint(1, 300)
+            ef['fileStructure'] = 'transparent'
+            ef['fileSize'] = size
+            ef['fileContent'] = randomHex(rng, size)
+        else:
+            recordSize = rng.randint(10, 40)
+            numberOfRecord = rng.randint(1, 20)
+            ef['fileStructure'] = 'linear fixed' if kind < 0.95 else 'cyclic'
+            ef['fileRecordSize'] = recordSize
+            ef['numberOfRecord'] = numberOfRecord
+            ef['fileSize'] = recordSize * numberOfRecord
+            ef['fileContent'] = [randomHex(rng, recordSize) for i in range(numberOfRecord)]
+        profile.append(ef)
+    return profile
+
+
+def writeFileSystemXml(profile, fileName):
+    # same layout as SaveFS export parsed by CardScanner.parseFileSystemXml()
+    with open(fileName, 'w') as xml_file:
+        xml_file.write('<?xml version="1.0" encoding="utf-8"?>\n<ArrayOfDBFile>\n')
+        for entry in profile:
+            path = entry['filePath']
+            parents = [path[i:i + 4] for i in range(0, len(path) - 4, 4)]
+            xml_file.write('  <DBFile>\n')
+            xml_file.write('    <NAME>%s</NAME>\n' % escape(entry['fileName']))
+            xml_file.write('    <FILEID>%s</FILEID>\n' % path[-4:])
+            if parents:
+                xml_file.write('    <PATH>%s|</PATH>\n' % '|'.join(parents))
+            xml_file.write('  </DBFile>\n')
+        xml_file.write('</ArrayOfDBFile>\n')
+
+
+def runScan(profile, workDir, latency=0.0, readHeader=True, seed=0):
+    fileSystemXml = workDir + '/profile.xml'
+    writeFileSystemXml(profile, fileSystemXml)
+
+    card = SimulatedCard()
+    card.loadJsonDump(profile)
+    card.osLocks = [random.Random(seed).randint(0, 255) for i in range(NUMBER_OF_OS_LOCKS)]
+    card.latency = latency
+
+    scanner = CardScanner(runAsModule=False, fullScript=True)
+    scanner.cardBackend = SimulatedReader(card)
+    scanner.fileSystemXml = fileSystemXml
+    scanner.allowReadHeader = readHeader
+    scanner.auditOsLocks = True
+    scanner.destinationFolder = workDir
+    scanner.pcomOutFileName = 'benchmark.pcom'
+    scanner.proceed()
+    return scanner.metrics.summary()
+
+
+def runBenchmark(sizes, latency=0.0, readHeader=True, repeat=1):
+    results = []
+    for size in sizes:
+        profile = generateProfile(size)
+        best = None
+        for run in range(repeat):
+            workDir = tempfile.mkdtemp(prefix='scan-benchmark-')
+            try:
+                summary = runScan(profile, workDir, latency, readHeader)
+            finally:
+                shutil.rmtree(workDir, ignore_errors=True)
+            if best is None or summary['total']['wallTime'] < best['total']['wallTime']:
+                best = summary
+        best['profileFiles'] = size
+        results.append(best)
+    return {
+        'benchmark': 'scan',
+        'date': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'latencyMs': latency * 1000,
+        'readHeader': readHeader,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def formerParseFileSystemXml(fileSystemXml):
+    # DOM parsing and list of dicts, as done before iterparse
+    fileSystemList = []
+    for dbFile in parse(fileSystemXml).documentElement.getElementsByTagName('DBFile'):
+        name = dbFile.getElementsByTagName('NAME')[0].childNodes[0].data
+        fileId = dbFile.getElementsByTagName('FILEID')[0].childNodes[0].data
+        try:
+            path = dbFile.getElementsByTagName('PATH')[0].childNodes[0].data
+        except IndexError:
+            path = ''
+        fileSystemList.append({'name': name.encode('ascii', 'ignore'), 'absolutePath': (path.replace('|', '') + fileId).encode('ascii', 'ignore')})
+    return fileSystemList
+
+
+def formerGetNameByPath(fileSystemList, path):
+    for fsDict in fileSystemList:
+        if fsDict['absolutePath'] == path:
+            return fsDict['name']
+    return ''
+
+
+def runParseBenchmark(sizes, repeat=1):
+    # parsing of file system xml and name look-up of every file, as in 2G pass
+    scanner = CardScanner(runAsModule=False, fullScript=False)
+    results = []
+    for size in sizes:
+        profile = generateProfile(size)
+        paths = [entry['filePath'] for entry in profile]
+        workDir = tempfile.mkdtemp(prefix='parse-benchmark-')
+        try:
+            fileSystemXml = workDir + '/profile.xml'
+            writeFileSystemXml(profile, fileSystemXml)
+            result = {'profileFiles': size}
+            for name, parseXml, getName in (
+                    ('minidom', formerParseFileSystemXml, formerGetNameByPath),
+                    ('iterparse', lambda fileName: scanner.parseFileSystemXml(fileName)[2], scanner.getNameByPath)):
+                best = None
+                for run in range(repeat):
+                    start = default_timer()
+                    fileSystemList = parseXml(fileSystemXml)
+                    parsed = default_timer()
+                    for path in paths:
+                        getName(fileSystemList, path)
+                    end = default_timer()
+                    if best is None or end - start < best['parse'] + best['lookup']:
+                        best = {'parse': parsed - start, 'lookup': end - parsed}
+                result[name] = best
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+        results.append(result)
+    return {
+        'benchmark': 'parse',
+        'date': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def printParseTable(report):
+    print('%-8s %-10s %10s %10s %10s' % ('files', 'parser', 'parse (s)', 'lookup (s)', 'total (s)'))
+    for result in report['results']:
+        for name in ('minidom', 'iterparse'):
+            timing = result[name]
+            print('%-8s %-10s %10.3f %10.3f %10.3f' % (result['profileFiles'], name, timing['parse'], timing['lookup'],
+                timing['parse'] + timing['lookup']))
+
+
+def printTable(report):
+    print('%-8s %-12s %10s %10s %8s %10s %10s' % ('files', 'phase', 'wall (s)', 'cpu (s)', 'apdus', 'sent', 'received'))
+    for result in report['results']:
+        for phase in result['phases'] + [dict(result['total'], phase='total')]:
+            print('%-8s %-12s %10.3f %10.3f %8d %10d %10d' % (result['profileFiles'], phase['phase'], phase['wallTime'],
+                phase['cpuTime'], phase['apdus'], phase['bytesSent'], phase['bytesReceived']))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('benchmark')
+    parser.add_argument("--sizes", type=int, nargs='+', help="number of files of synthetic profiles")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated card latency per APDU (ms)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per profile; fastest run is reported")
+    parser.add_argument("--no-read-header", action="store_true", help="populate file list from xml instead of read header")
+    parser.add_argument("--parse", action="store_true", help="file system xml parsing and name look-up only")
+    parser.add_argument("-o", "--output", help="json result file (default: print to screen)")
+    args = parser.parse_args()
+
+    logging.getLogger('scanner').setLevel(logging.WARNING)
+    if args.parse:
+        report = runParseBenchmark(args.sizes or DEFAULT_PARSE_SIZES, args.repeat)
+    else:
+        report = runBenchmark(args.sizes or DEFAULT_SIZES, args.latency / 1000.0, not args.no_read_header, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+        if args.parse:
+            printParseTable(report)
+        else:
+            printTable(report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
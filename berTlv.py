@@ -0,0 +1,230 @@
+from __future__ import print_function
+
+# BER-TLV (ISO 7816-4 / TS 102 221) decoding in a single pass; values are not
+# copied but located by their offsets in the decoded data
+
+# templates decoded further on request
+FCP_TEMPLATE = 0x62
+PROPRIETARY_INFORMATION = 0xA5
+PIN_STATUS_TEMPLATE = 0xC6
+
+
+class TlvError(ValueError):
+    pass
+
+
+def parseTag(data, index):
+    # returns tag (multi-byte tags as one integer, e.g. 0x7F66) and index after it
+    tag = data[index]
+    index += 1
+    if (tag & 0x1F) == 0x1F:
+        # subsequent bytes follow as long as b8 is set
+        while True:
+            if index >= len(data):
+                raise TlvError('Truncated tag')
+            tag = (tag << 8) + data[index]
+            index += 1
+            if not data[index - 1] & 0x80:
+                break
+    return tag, index
+
+
+def parseLength(data, index):
+    # short form up to '7F', long form '81 xx', '82 xx xx', '83 xx xx xx'
+    if index >= len(data):
+        raise TlvError('Missing length')
+    length = data[index]
+    index += 1
+    if length & 0x80:
+        numberOfBytes = length & 0x7F
+        if numberOfBytes == 0 or numberOfBytes > 3 or index + numberOfBytes > len(data):
+            raise TlvError('Invalid length')
+        length = 0
+        for byte in data[index:index + numberOfBytes]:
+            length = (length << 8) + byte
+        index += numberOfBytes
+    return length, index
+
+
+def decode(data, start=0, end=None):
+    # list of (tag, valueStart, valueEnd) for objects between start and end
+    if end is None:
+        end = len(data)
+    objects = []
+    index = start
+    while index < end:
+        tag = data[index]
+        if tag == 0x00 or tag == 0xFF:
+            index += 1 # padding between objects
+            continue
+        if (tag & 0x1F) == 0x1F:
+            tag, index = parseTag(data, index)
+        else:
+            index += 1
+        if index >= end:
+            raise TlvError('Missing length')
+        length = data[index]
+        if length & 0x80:
+            length, index = parseLength(data, index)
+        else:
+            index += 1
+        if index + length > end:
+            raise TlvError('Value of tag %X exceeds data' % tag)
+        objects.append((tag, index, index + length))
+        index += length
+    return objects
+
+
+class TlvIndex:
+    # tag -> offsets of first object with this tag; value() slices data on demand
+
+    def __init__(self, data, start=0, end=None):
+        self.data = data
+        self.objects = decode(data, start, end)
+        self.index = {}
+        for tag, valueStart, valueEnd in self.objects:
+            if not tag in self.index:
+                self.index[tag] = (valueStart, valueEnd)
+
+    def __contains__(self, tag):
+        return tag in self.index
+
+    def tags(self):
+        return [tag for tag, valueStart, valueEnd in self.objects]
+
+    def value(self, tag, default=None):
+        if not tag in self.index:
+            return default
+        valueStart, valueEnd = self.index[tag]
+        return self.data[valueStart:valueEnd]
+
+    def length(self, tag):
+        valueStart, valueEnd = self.index[tag]
+        return valueEnd - valueStart
+
+    def byte(self, tag, offset=0, default=None):
+        # single byte of value, without slicing
+        if not tag in self.index:
+            return default
+        valueStart, valueEnd = self.index[tag]
+        if valueStart + offset >= valueEnd:
+            return default
+        return self.data[valueStart + offset]
+
+    def integer(self, tag, default=None):
+        if not tag in self.index:
+            return default
+        valueStart, valueEnd = self.index[tag]
+        value = 0
+        for i in range(valueStart, valueEnd):
+            value = (value << 8) + self.data[i]
+        return value
+
+    def child(self, tag):
+        # nested template (e.g. 'A5', 'C6') decoded within the same data
+        if not tag in self.index:
+            return None
+        valueStart, valueEnd = self.index[tag]
+        return TlvIndex(self.data, valueStart, valueEnd)
+
+
+def parseFcp(response):
+    # FCP template of SELECT/GET RESPONSE; None if response is no FCP
+    if not response or response[0] != FCP_TEMPLATE:
+        return None
+    try:
+        length, index = parseLength(response, 1)
+        if index + length > len(response):
+            return None
+        return TlvIndex(response, index, index + length)
+    except TlvError:
+        return None
+
+
+def getTlvObjects(data):
+    # objects as [tag, length, value...] lists, as expected by former callers
+    objects = []
+    for tag, valueStart, valueEnd in decode(data):
+        objects.append([tag, valueEnd - valueStart] + list(data[valueStart:valueEnd]))
+    return objects
+
+
+def getValueByTag(tag, data):
+    return TlvIndex(data).value(tag, [])
+
+
+# typical FCP objects of EF, DF, MF and ADF; template '62' is added by runBenchmark()
+FCP_CORPUS = [
+    '82 02 41 21 83 02 2F E2 A5 03 C0 01 00 8A 01 05 8B 03 2F 06 04 80 02 00 0A 88 01 10',
+    '82 02 78 21 83 02 7F 4F A5 04 83 02 E2 AC 8A 01 05 8B 03 2F 06 02 C6 09 90 01 40 83 01 01 83 01 81',
+    '82 02 78 21 83 02 3F 00 A5 09 80 01 71 83 04 00 01 8A 3C 8A 01 05 8B 03 2F 06 02 C6 0C 90 01 60 83 01 01 83 01 0A 83 01 81',
+    '82 05 42 21 00 26 0A 83 02 6F 3A 8A 01 05 8B 03 6F 06 04 80 02 01 7C 88 00',
+    '82 05 46 21 00 2B 64 83 02 6F 81 8A 01 05 8B 03 6F 06 0D 80 02 10 CC 88 01 A8',
+    '82 02 78 21 84 10 A0 00 00 00 87 10 02 FF 44 FF 12 89 00 00 01 00 83 02 7F FF A5 06 83 04 00 01 86 A0 8A 01 05 8B 03 2F 06 02 C6 0C 90 01 60 83 01 01 83 01 0A 83 01 81',
+    '82 02 41 21 83 02 6F 07 8A 01 05 8B 03 6F 06 03 80 02 00 09 88 01 38',
+]
+
+
+def runBenchmark(repeat=2000):
+    # compares with the former parsing (tag lookup via list.index() and copied objects)
+    from timeit import default_timer
+    corpus = []
+    for objects in FCP_CORPUS:
+        objects = list(bytearray.fromhex(objects.replace(' ', '')))
+        corpus.append([FCP_TEMPLATE, len(objects)] + objects)
+
+    def formerValueByTag(tag, tlvObject):
+        value = []
+        for byte in tlvObject:
+            index = tlvObject.index(byte)
+            if byte == tag:
+                index += 1
+                length = tlvObject[index]
+                index += 1
+                value = tlvObject[index:index + length]
+                break
+        return value
+
+    def formerTlvObjects(tlvBytes):
+        tlvList = []
+        tracker = 0
+        for idx, byte in enumerate(tlvBytes):
+            if idx < tracker:
+                continue
+            length = tlvBytes[idx + 1]
+            tlvList.append([byte, length] + [i for i in tlvBytes[idx + 2:idx + 2 + length]])
+            tracker = idx + 2 + length
+        return tlvList
+
+    def formerParse(response):
+        fcpObjects = formerTlvObjects(formerValueByTag(0x62, response))
+        found = {}
+        for tag in (0xA5, 0xC6, 0x82, 0x80, 0x88):
+            for i in fcpObjects:
+                if i[0] == tag:
+                    found[tag] = formerValueByTag(tag, i)
+                    break
+        return found
+
+    def newParse(response):
+        fcp = parseFcp(response)
+        found = {}
+        for tag in (0xA5, 0xC6, 0x82, 0x80, 0x88):
+            if tag in fcp:
+                found[tag] = fcp.value(tag)
+        return found
+
+    results = {}
+    for name, parse in (('former', formerParse), ('berTlv', newParse)):
+        start = default_timer()
+        for i in range(repeat):
+            for response in corpus:
+                parse(response)
+        results[name] = (default_timer() - start) / (repeat * len(corpus)) * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    results = runBenchmark()
+    for name in ('former', 'berTlv'):
+        print('%-8s %8.2f us per FCP' % (name, results[name]))
@@ -0,0 +1,681 @@
+from __future__ import print_function
+import json
+import re
+import time
+
+try:
+    from smartcard.Exceptions import CardConnectionException
+except ImportError:
+    # no pyscard installed; simulated card can still be used
+    class CardConnectionException(Exception):
+        pass
+
+DEFAULT_ATR = '3B 9F 96 80 1F C7 80 31 E0 73 FE 21 1B 63 3A 20 4E 83 00 90 00 31'
+# same card, with 'extended Lc and Le fields' set in card capabilities
+EXTENDED_LENGTH_ATR = '3B 9F 96 80 1F C7 80 31 E0 73 FE 21 5B 63 3A 20 4E 83 00 90 00 71'
+
+# file types as in byte 7 of 2G response
+TYPE_MF = 0x01
+TYPE_DF = 0x02
+TYPE_EF = 0x04
+
+# file structures as in byte 14 of 2G response
+STRUCTURE_TRANSPARENT = 0x00
+STRUCTURE_LINEAR_FIXED = 0x01
+STRUCTURE_CYCLIC = 0x03
+
+structureByName = {
+    'transparent': STRUCTURE_TRANSPARENT,
+    'linear fixed': STRUCTURE_LINEAR_FIXED,
+    'cyclic': STRUCTURE_CYCLIC
+}
+
+typeByName = {'MF': TYPE_MF, 'DF': TYPE_DF, 'EF': TYPE_EF}
+
+pcomLinePattern = re.compile(r'^([0-9A-F]{10}(?:[0-9A-F]{4})?)(?: ([0-9A-F]+))?(?: \[([0-9A-F]*)\])? \(([0-9A-F]{4})\)')
+
+
+def hexToBytes(hexString):
+    hexString = hexString.replace(' ', '')
+    return [int(hexString[i:i + 2], 16) for i in range(0, len(hexString), 2)]
+
+
+def bytesToHex(data):
+    return ''.join(['%0.2X' % b for b in data])
+
+
+def parseSimpleTlv(data):
+    # tag -> value for single-byte tags (enough for FCP top level)
+    objects = {}
+    index = 0
+    while index + 1 < len(data):
+        tag = data[index]
+        length = data[index + 1]
+        index += 2
+        if length == 0x81:
+            length = data[index]
+            index += 1
+        objects[tag] = data[index:index + length]
+        index += length
+    return objects
+
+
+class SimFile:
+    def __init__(self, path, fileType):
+        self.path = path
+        self.fileId = path[-4:]
+        self.fileType = fileType
+        self.structure = STRUCTURE_TRANSPARENT
+        self.size = 0
+        self.recordSize = 0
+        self.content = bytearray()
+        self.records = []
+        self.acc2g = [0x00, 0x00, 0x00]
+        self.status = 0x01 # not invalidated
+        self.sfi = None
+        self.response2g = None # recorded 2G GET RESPONSE, if any
+        self.fcp = None # recorded 3G GET RESPONSE, if any
+        self.children = []
+
+    def isDf(self):
+        return self.fileType != TYPE_EF
+
+    def numberOfRecord(self):
+        if self.recordSize:
+            return self.size // self.recordSize
+        return 0
+
+    def isReadable(self):
+        # invalidated file is only readable if flagged so in file status
+        return (self.status & 0x01) == 0x01 or (self.status & 0x04) == 0x04
+
+    def getResponse2g(self):
+        if self.response2g:
+            return list(self.response2g)
+        fid = hexToBytes(self.fileId)
+        if self.isDf():
+            response = [0x00, 0x00, 0xFF, 0xFF, fid[0], fid[1], self.fileType, 0x00, 0x00, 0x00, 0x00, 0x00, 0x09, 0x13]
+            numberOfDf = len([child for child in self.children if child.isDf()])
+            response += [numberOfDf, len(self.children) - numberOfDf, 0x04, 0x00, 0x83, 0x83, 0x83, 0x83, 0x00, 0x00]
+            return response
+        return [0x00, 0x00, (self.size >> 8) & 0xFF, self.size & 0xFF, fid[0], fid[1], TYPE_EF, 0x00] + \
+            list(self.acc2g) + [self.status, 0x02, self.structure, self.recordSize & 0xFF]
+
+    def getFcp(self):
+        if self.fcp:
+            return list(self.fcp)
+        fid = hexToBytes(self.fileId)
+        if self.isDf():
+            objects = [0x82, 0x02, 0x78, 0x21, 0x83, 0x02, fid[0], fid[1]]
+            if self.fileType == TYPE_MF:
+                objects += [0xA5, 0x03, 0x80, 0x01, 0x71]
+            objects += [0x8A, 0x01, 0x05, 0x8B, 0x03, 0x2F, 0x06, 0x02]
+            objects += [0xC6, 0x09, 0x90, 0x01, 0x40, 0x83, 0x01, 0x01, 0x83, 0x01, 0x81]
+        else:
+            if self.structure == STRUCTURE_TRANSPARENT:
+                objects = [0x82, 0x02, 0x41, 0x21]
+            else:
+                descriptor = 0x42 if self.structure == STRUCTURE_LINEAR_FIXED else 0x46
+                objects = [0x82, 0x05, descriptor, 0x21, (self.recordSize >> 8) & 0xFF, self.recordSize & 0xFF,
+                           self.numberOfRecord() & 0xFF]
+            objects += [0x83, 0x02, fid[0], fid[1], 0x8A, 0x01, 0x05 if self.status & 0x01 else 0x04]
+            objects += [0x8B, 0x03, 0x6F, 0x06, 0x01]
+            if self.size > 0xFFFF:
+                objects += [0x80, 0x03, (self.size >> 16) & 0xFF, (self.size >> 8) & 0xFF, self.size & 0xFF]
+            else:
+                objects += [0x80, 0x02, (self.size >> 8) & 0xFF, self.size & 0xFF]
+            if self.sfi is not None:
+                objects += [0x88, 0x01, (self.sfi << 3) & 0xFF]
+            else:
+                objects += [0x88, 0x00]
+        return [0x62, len(objects)] + objects
+
+    def getReadHeader(self, length, withFileInfo):
+        # proprietary ex-OT header: file ID, type of file, file size
+        header = hexToBytes(self.fileId)
+        if withFileInfo:
+            header += [self.fileType, (self.size >> 8) & 0xFF, self.size & 0xFF]
+        header += [0x00] * (length - len(header))
+        return header[:length]
+
+
+class SimulatedCard:
+    # emulates a UICC/SIM answering 2G (CLA 'A0') and 3G (CLA '00') commands
+
+    def __init__(self, atr=DEFAULT_ATR):
+        self.atr = hexToBytes(atr)
+        self.files = {}
+        self.osLocks = []
+        self.codes = {} # (cla, P2) -> code; codes not listed are always accepted
+        self.support2g = True
+        self.support3g = True
+        self.mixedClasses = True # if False, first command after ATR fixes the command class
+        self.readHeaderFileInfo = True # read header also gives type and size of file
+        self.extendedLength = False # 3G commands with extended Le accepted
+        self.shortLe256 = True # Le '00' means 256 bytes
+
+        # timing and fault injection
+        self.latency = 0.0 # seconds per APDU
+        self.insLatency = {} # INS -> seconds, overrides latency
+        self.faults = [] # see injectFault()
+
+        # statistics
+        self.apduCount = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.insCount = {}
+
+        self.connected = False
+        self.addFile('3F00', TYPE_MF)
+        self.powerOn()
+
+    def addFile(self, path, fileType):
+        path = path.upper()
+        if path in self.files:
+            simFile = self.files[path]
+            simFile.fileType = fileType
+            return simFile
+        simFile = SimFile(path, fileType)
+        self.files[path] = simFile
+        if len(path) > 4:
+            parent = self.files.get(path[:-4])
+            if parent is None:
+                parent = self.addFile(path[:-4], TYPE_DF)
+            parent.children.append(simFile)
+        return simFile
+
+    def injectFault(self, atApdu=None, ins=None, occurrence=1, sw='6F00', disconnect=False, repeat=False):
+        # fault fires at the Nth APDU sent to the card (atApdu) or at the Nth
+        # occurrence of an INS; it either answers with sw or drops the connection
+        self.faults.append({
+            'atApdu': atApdu, 'ins': ins, 'occurrence': occurrence, 'sw': hexToBytes(sw),
+            'disconnect': disconnect, 'repeat': repeat, 'fired': False
+        })
+
+    def powerOn(self):
+        self.connected = True
+        self.currentDf = self.files['3F00']
+        self.currentEf = None
+        self.pendingResponse = None
+        self.sessionClass = None
+        self.verified = set()
+        return self.atr
+
+    def checkFaults(self, ins):
+        for fault in self.faults:
+            if fault['fired'] and not fault['repeat']:
+                continue
+            if fault['atApdu'] is not None:
+                triggered = self.apduCount == fault['atApdu']
+            else:
+                triggered = fault['ins'] == ins and self.insCount[ins] >= fault['occurrence']
+            if triggered:
+                fault['fired'] = True
+                if fault['disconnect']:
+                    self.connected = False
+                    raise CardConnectionException('Simulated card connection lost')
+                return fault['sw']
+        return None
+
+    def transmit(self, apdu):
+        if not self.connected:
+            raise CardConnectionException('Simulated card not connected')
+        apdu = list(apdu)
+        ins = apdu[1]
+        self.apduCount += 1
+        self.insCount[ins] = self.insCount.get(ins, 0) + 1
+        self.bytesSent += len(apdu)
+
+        delay = self.insLatency.get(ins, self.latency)
+        if delay:
+            time.sleep(delay)
+
+        faultSw = self.checkFaults(ins)
+        if faultSw:
+            response, sw1, sw2 = [], faultSw[0], faultSw[1]
+        else:
+            response, sw1, sw2 = self.process(apdu)
+        self.bytesReceived += len(response) + 2
+        return response, sw1, sw2
+
+    def process(self, apdu):
+        cla, ins, p1, p2 = apdu[0:4]
+        p3 = apdu[4] if len(apdu) > 4 else 0
+        data = apdu[5:5 + p3] if len(apdu) > 5 else []
+        le = p3
+        extended = len(apdu) > 6 and p3 == 0x00 and cla != 0xA0
+        if extended:
+            # extended length: Lc and Le on 2 bytes, Lc field omitted if no data
+            if not self.extendedLength:
+                return [], 0x67, 0x00
+            if len(apdu) == 7:
+                data = []
+                le = (apdu[5] << 8) + apdu[6]
+            else:
+                lc = (apdu[5] << 8) + apdu[6]
+                data = apdu[7:7 + lc]
+                le = (apdu[7 + lc] << 8) + apdu[8 + lc] if len(apdu) > 8 + lc else 0
+            if le == 0:
+                le = 65536
+        elif len(apdu) > 5 + p3:
+            le = apdu[5 + p3] # Le following command data
+
+        if cla == 0xA0:
+            is3g = False
+            if not self.support2g:
+                return [], 0x6E, 0x00
+        elif (cla & 0xF0) in (0x00, 0x80):
+            is3g = True
+            if not self.support3g:
+                return [], 0x6E, 0x00
+        else:
+            return [], 0x6E, 0x00
+
+        if not self.mixedClasses:
+            if self.sessionClass is None:
+                self.sessionClass = is3g
+            elif self.sessionClass != is3g:
+                return [], 0x6E, 0x00
+
+        if ins == 0xA4:
+            return self.select(bytesToHex(data), is3g)
+        if ins == 0xC0:
+            return self.getResponse(p3, is3g)
+        if ins == 0xB0:
+            if le == 0 and not self.shortLe256:
+                return [], 0x67, 0x00
+            return self.readBinary(p1, p2, le, is3g)
+        if ins == 0xB1 and is3g:
+            return self.readBinaryOdd(data, le)
+        if ins == 0xB2:
+            return self.readRecord(p1, p2, p3, is3g)
+        if ins == 0x20:
+            return self.verify(cla, p2, data, is3g)
+        if ins == 0xE8 and not is3g:
+            return self.readHeader(p1, p3)
+        if ins == 0xBC and not is3g:
+            return self.readOsLock(p2)
+        return [], 0x6D, 0x00
+
+    def resolve(self, fileId):
+        # file IDs selectable from current DF, see TS 102 221 8.4.1
+        if fileId == '3F00':
+            return self.files['3F00']
+        current = self.currentDf
+        if fileId == current.fileId:
+            return current
+        parent = self.files.get(current.path[:-4]) if len(current.path) > 4 else None
+        if parent is not None and fileId == parent.fileId:
+            return parent
+        for child in current.children:
+            if child.fileId == fileId:
+                return child
+        if parent is not None:
+            for sibling in parent.children:
+                if sibling.isDf() and sibling.fileId == fileId:
+                    return sibling
+        if fileId == '7FFF':
+            # current application
+            return self.files.get('3F007FFF')
+        return None
+
+    def select(self, fileId, is3g):
+        simFile = self.resolve(fileId.upper())
+        self.pendingResponse = None
+        if simFile is None:
+            if is3g:
+                return [], 0x6A, 0x82
+            return [], 0x94, 0x04
+        if simFile.isDf():
+            self.currentDf = simFile
+            self.currentEf = None
+        else:
+            self.currentEf = simFile
+        if is3g:
+            self.pendingResponse = simFile.getFcp()
+            if not simFile.isReadable():
+                return [], 0x62, 0x83
+            return [], 0x61, len(self.pendingResponse)
+        self.pendingResponse = simFile.getResponse2g()
+        return [], 0x9F, len(self.pendingResponse)
+
+    def getResponse(self, length, is3g):
+        if self.pendingResponse is None:
+            if is3g:
+                return [], 0x69, 0x85
+            return [], 0x94, 0x00 # no EF selected
+        if length == 0 and is3g:
+            length = len(self.pendingResponse)
+        if length > len(self.pendingResponse):
+            if is3g:
+                return [], 0x6C, len(self.pendingResponse)
+            return [], 0x67, 0x00
+        response = self.pendingResponse[:length]
+        self.pendingResponse = None
+        return response, 0x90, 0x00
+
+    def errorNoEf(self, is3g):
+        if is3g:
+            return [], 0x69, 0x86
+        return [], 0x94, 0x00
+
+    def errorStructure(self, is3g):
+        if is3g:
+            return [], 0x69, 0x81
+        return [], 0x94, 0x08
+
+    def errorAccess(self, is3g):
+        if is3g:
+            return [], 0x69, 0x82
+        return [], 0x98, 0x04
+
+    def selectBySfi(self, sfi):
+        for child in self.currentDf.children:
+            if child.sfi == sfi and not child.isDf():
+                self.currentEf = child
+                return child
+        return None
+
+    def readBinary(self, p1, p2, length, is3g):
+        if is3g and (p1 & 0x80):
+            # short file identifier in P1, offset in P2
+            simFile = self.selectBySfi(p1 & 0x1F)
+            offset = p2
+        else:
+            simFile = self.currentEf
+            if is3g:
+                offset = ((p1 & 0x7F) << 8) + p2
+            else:
+                offset = (p1 << 8) + p2
+        if simFile is None:
+            return self.errorNoEf(is3g)
+        if simFile.structure != STRUCTURE_TRANSPARENT:
+            return self.errorStructure(is3g)
+        if not simFile.isReadable():
+            return self.errorAccess(is3g)
+        if length == 0:
+            length = 256
+        if offset >= simFile.size:
+            if is3g:
+                return [], 0x6B, 0x00
+            return [], 0x94, 0x02
+        if offset + length > simFile.size:
+            if is3g:
+                return list(simFile.content[offset:simFile.size]), 0x62, 0x82
+            return [], 0x67, 0x00
+        return list(simFile.content[offset:offset + length]), 0x90, 0x00
+
+    def readBinaryOdd(self, data, length):
+        # offset data object '54' in command data; content returned in '53' via GET RESPONSE
+        tlv = parseSimpleTlv(data)
+        if not 0x54 in tlv:
+            return [], 0x6A, 0x80
+        offset = 0
+        for byte in tlv[0x54]:
+            offset = (offset << 8) + byte
+        simFile = self.currentEf
+        if simFile is None:
+            return self.errorNoEf(True)
+        if simFile.structure != STRUCTURE_TRANSPARENT:
+            return self.errorStructure(True)
+        if not simFile.isReadable():
+            return self.errorAccess(True)
+        if offset >= simFile.size:
+            return [], 0x6B, 0x00
+        if length == 0:
+            length = 256
+        content = list(simFile.content[offset:min(simFile.size, offset + length - 4)])
+        if len(content) > 0xFF:
+            response = [0x53, 0x82, len(content) >> 8, len(content) & 0xFF] + content
+        elif len(content) > 0x7F:
+            response = [0x53, 0x81, len(content)] + content
+        else:
+            response = [0x53, len(content)] + content
+        if length > 256:
+            # extended length implies a transport returning the whole response
+            return response, 0x90, 0x00
+        self.pendingResponse = response
+        return [], 0x61, len(response) & 0xFF
+
+    def readRecord(self, p1, p2, length, is3g):
+        if is3g and (p2 >> 3):
+            simFile = self.selectBySfi(p2 >> 3)
+        else:
+            simFile = self.currentEf
+        if simFile is None:
+            return self.errorNoEf(is3g)
+        if simFile.structure == STRUCTURE_TRANSPARENT:
+            return self.errorStructure(is3g)
+        if not simFile.isReadable():
+            return self.errorAccess(is3g)
+        if (p2 & 0x07) != 0x04 or p1 < 1 or p1 > len(simFile.records):
+            if is3g:
+                return [], 0x6A, 0x83
+            return [], 0x94, 0x02
+        if length != simFile.recordSize:
+            if is3g:
+                return [], 0x6C, simFile.recordSize
+            return [], 0x67, 0x00
+        return list(simFile.records[p1 - 1]), 0x90, 0x00
+
+    def verify(self, cla, reference, data, is3g):
+        code = self.codes.get((cla, reference))
+        if code is not None and bytesToHex(data) != code.replace(' ', '').upper():
+            if is3g:
+                return [], 0x63, 0xC2
+            return [], 0x98, 0x04
+        self.verified.add(reference)
+        return [], 0x90, 0x00
+
+    def readHeader(self, index, length):
+        children = self.currentDf.children
+        if index < 1 or index > len(children):
+            return [], 0x94, 0x02
+        if length == 0:
+            length = 256
+        return children[index - 1].getReadHeader(length, self.readHeaderFileInfo), 0x90, 0x00
+
+    def readOsLock(self, offset):
+        if offset >= len(self.osLocks):
+            return [], 0x94, 0x02
+        return [self.osLocks[offset]], 0x90, 0x00
+
+    def loadJsonDump(self, fileDetails):
+        # fileDetails as dumped by CardScanner.proceed()
+        for entry in fileDetails:
+            path = entry['filePath'].upper()
+            if 'fileType' in entry:
+                fileType = typeByName[entry['fileType']]
+            elif len(path) == 4:
+                fileType = TYPE_MF
+            elif path[-4:-2] in ('7F', '5F'):
+                fileType = TYPE_DF
+            else:
+                fileType = TYPE_EF
+            simFile = self.addFile(path, fileType)
+            if '3gGetResponse' in entry:
+                simFile.fcp = hexToBytes(entry['3gGetResponse'])
+            if fileType != TYPE_EF:
+                continue
+            simFile.structure = structureByName.get(entry.get('fileStructure'), STRUCTURE_TRANSPARENT)
+            if isinstance(entry.get('fileSize'), int):
+                simFile.size = entry['fileSize']
+            simFile.recordSize = entry.get('fileRecordSize', 0)
+            if '2gAcc' in entry:
+                simFile.acc2g = hexToBytes(entry['2gAcc'])
+            fileStatus = entry.get('fileStatus', '')
+            if 'invalidated' in fileStatus:
+                simFile.status = 0x04 if 'readable or updatable when invalidated' in fileStatus else 0x00
+            if 'sfi' in entry:
+                simFile.sfi = int(entry['sfi'], 16)
+            if simFile.structure == STRUCTURE_TRANSPARENT:
+                if 'fileContent' in entry:
+                    simFile.content = bytearray(hexToBytes(entry['fileContent']))
+                simFile.content += bytearray([0xFF] * (simFile.size - len(simFile.content)))
+            else:
+                if 'fileContent' in entry:
+                    simFile.records = [bytearray(hexToBytes(record)) for record in entry['fileContent']]
+                while len(simFile.records) < simFile.numberOfRecord():
+                    simFile.records.append(bytearray([0xFF] * simFile.recordSize))
+
+    def loadPcom(self, pcomLines):
+        # rebuild the card from a trace recorded by CardScanner; files are
+        # located by replaying the SELECTs against the tree built so far
+        self.powerOn()
+        lastSelected = None
+        oddReadOffset = None
+        for line in pcomLines:
+            line = line.strip()
+            if line == '.POWER_ON':
+                self.powerOn()
+                continue
+            match = pcomLinePattern.match(line)
+            if not match:
+                continue
+            header = hexToBytes(match.group(1))
+            data = hexToBytes(match.group(2) or '')
+            response = hexToBytes(match.group(3) or '')
+            sw1, sw2 = hexToBytes(match.group(4))
+            ins = header[1]
+            is3g = header[0] != 0xA0
+
+            if ins == 0xA4:
+                lastSelected = None
+                oddReadOffset = None
+                if sw1 not in (0x9F, 0x61, 0x90, 0x62):
+                    continue
+                fileId = bytesToHex(data)
+                simFile = self.resolve(fileId)
+                if simFile is None:
+                    fileType = TYPE_DF if fileId[:2] in ('7F', '5F') else TYPE_EF
+                    simFile = self.addFile(self.currentDf.path + fileId, fileType)
+                if simFile.isDf():
+                    self.currentDf = simFile
+                else:
+                    self.currentEf = simFile
+                lastSelected = simFile
+            elif ins == 0xC0 and lastSelected is not None and sw1 == 0x90:
+                self.recordGetResponse(lastSelected, response, is3g)
+                lastSelected = None
+            elif ins == 0xB1 and self.currentEf is not None:
+                oddReadOffset = 0
+                for byte in parseSimpleTlv(data).get(0x54, []):
+                    oddReadOffset = (oddReadOffset << 8) + byte
+                if sw1 == 0x90 and response:
+                    self.recordOddRead(oddReadOffset, response)
+                    oddReadOffset = None
+            elif ins == 0xC0 and oddReadOffset is not None and sw1 == 0x90:
+                self.recordOddRead(oddReadOffset, response)
+                oddReadOffset = None
+            elif ins == 0xB0 and is3g and (header[2] & 0x80) and sw1 == 0x90:
+                # EF addressed by SFI, known if its FCP has been recorded before
+                if self.selectBySfi(header[2] & 0x1F) is not None:
+                    self.writeContent(self.currentEf, header[3], response)
+            elif ins == 0xB0 and sw1 == 0x90 and self.currentEf is not None:
+                offset = ((header[2] & 0x7F) << 8) + header[3] if is3g else (header[2] << 8) + header[3]
+                self.writeContent(self.currentEf, offset, response)
+            elif ins == 0xB2 and is3g and (header[3] >> 3) and sw1 == 0x90:
+                if self.selectBySfi(header[3] >> 3) is not None:
+                    self.writeRecord(self.currentEf, header[2], response)
+            elif ins == 0xB2 and sw1 == 0x90 and self.currentEf is not None:
+                self.writeRecord(self.currentEf, header[2], response)
+            elif ins == 0xBC and sw1 == 0x90 and response:
+                while len(self.osLocks) <= header[3]:
+                    self.osLocks.append(0x00)
+                self.osLocks[header[3]] = response[0]
+        self.powerOn()
+
+    def recordOddRead(self, offset, response):
+        # content read with odd INS is returned in '53' discretionary data object
+        if response[1] & 0x80:
+            response = response[2 + (response[1] & 0x7F):]
+        else:
+            response = response[2:2 + response[1]]
+        self.writeContent(self.currentEf, offset, response)
+
+    def writeContent(self, simFile, offset, response):
+        content = simFile.content
+        if len(content) < offset + len(response):
+            content += bytearray([0xFF] * (offset + len(response) - len(content)))
+        content[offset:offset + len(response)] = bytearray(response)
+
+    def writeRecord(self, simFile, recordNumber, response):
+        records = simFile.records
+        while len(records) < recordNumber:
+            records.append(bytearray([0xFF] * simFile.recordSize))
+        records[recordNumber - 1] = bytearray(response)
+
+    def recordGetResponse(self, simFile, response, is3g):
+        if is3g:
+            simFile.fcp = response
+            if not response or response[0] != 0x62:
+                return
+            objects = parseSimpleTlv(response[2:])
+            simFile.fileType = TYPE_DF if 0xC6 in objects else TYPE_EF
+            if not simFile.isDf():
+                descriptor = objects.get(0x82, [0x41])
+                if (descriptor[0] & 0x06) == 0x06:
+                    simFile.structure = STRUCTURE_CYCLIC
+                elif descriptor[0] & 0x02:
+                    simFile.structure = STRUCTURE_LINEAR_FIXED
+                if len(descriptor) >= 5:
+                    simFile.recordSize = (descriptor[2] << 8) + descriptor[3]
+                if 0x80 in objects:
+                    simFile.size = int(bytesToHex(objects[0x80]), 16)
+                if objects.get(0x88):
+                    simFile.sfi = objects[0x88][0] >> 3
+        else:
+            simFile.response2g = response
+            if len(response) < 15:
+                return
+            simFile.fileType = response[6]
+            if not simFile.isDf():
+                simFile.size = (response[2] << 8) + response[3]
+                simFile.acc2g = response[8:11]
+                simFile.status = response[11]
+                simFile.structure = response[13]
+                simFile.recordSize = response[14]
+        if not simFile.isDf() and simFile.structure == STRUCTURE_TRANSPARENT and len(simFile.content) < simFile.size:
+            simFile.content += bytearray([0xFF] * (simFile.size - len(simFile.content)))
+
+    @classmethod
+    def fromFile(cls, fileName, atr=DEFAULT_ATR):
+        card = cls(atr)
+        if fileName.lower().endswith('.json'):
+            with open(fileName, 'r') as json_file:
+                card.loadJsonDump(json.load(json_file))
+        else:
+            with open(fileName, 'r') as pcom_file:
+                card.loadPcom(pcom_file.readlines())
+        return card
+
+
+class SimulatedConnection:
+    def __init__(self, card):
+        self.card = card
+
+    def connect(self):
+        self.card.powerOn()
+
+    def disconnect(self):
+        self.card.connected = False
+
+    def getATR(self):
+        return list(self.card.atr)
+
+    def transmit(self, apdu):
+        return self.card.transmit(apdu)
+
+
+class SimulatedReader:
+    # stands in for a pyscard reader in CardScanner.cardBackend
+
+    def __init__(self, card, name='Simulated Reader 0'):
+        self.card = card
+        self.name = name
+
+    def createConnection(self):
+        return SimulatedConnection(self.card)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,227 @@
+from __future__ import print_function
+import sys
+import json
+import re
+from bisect import bisect_right
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+
+from fileRecord import toHex, fromHex
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# expected content is written as in non-regression results: hex bytes, 'X' for
+# any nibble, '<' after a byte (instead of space) marks it as different
+WILDCARD = 'X'
+DIFFERENT = '<'
+
+NON_ZERO = re.compile('[^\x00]')
+
+
+def splitPattern(pattern):
+    # 'XX 6F<X7 ' -> ['XX', '6F', 'X7']; spacing is optional
+    digits = pattern.replace(DIFFERENT, '').replace(' ', '').upper()
+    return [digits[i:i + 2] for i in range(0, len(digits), 2)]
+
+
+def compilePattern(pattern):
+    # value and mask bytes; a byte matches when (byte ^ value) & mask == 0
+    value = bytearray()
+    mask = bytearray()
+    for token in splitPattern(pattern):
+        byteValue = 0
+        byteMask = 0
+        for nibble in token:
+            byteValue <<= 4
+            byteMask <<= 4
+            if nibble != WILDCARD:
+                byteValue |= int(nibble, 16)
+                byteMask |= 0x0F
+        value.append(byteValue)
+        mask.append(byteMask)
+    return value, mask
+
+
+def toLong(data):
+    return long(hexlify(data) or '0', 16)
+
+
+def getContent(fileProperties):
+    # raw content (bytes, or list of records) of scanned file; None if not read
+    if hasattr(fileProperties, 'getRawContent'):
+        return fileProperties.getRawContent()
+    content = fileProperties.get('fileContent')
+    if content is None:
+        return None
+    if isinstance(content, list):
+        return [fromHex(record) for record in content]
+    return fromHex(content)
+
+
+def getError(fileId, fileName, recNum, expected, output, operation, errMsg):
+    return {'recNum': recNum, 'severity': 1, 'linkedFile': '', 'expected': expected, 'output': output,
+            'operation': operation, 'fileName': fileName, 'errMsg': errMsg, 'fileId': fileId}
+
+
+class ContentComparator:
+    # content of a reference profile compiled once into one value and one mask
+    # buffer (all files and records end to end); a scan is laid out the same
+    # way, so that it is checked with a few operations on whole buffers, with
+    # numpy when available and python long integers otherwise. only
+    # differences are formatted, as org_errors of non-regression results.
+
+    def __init__(self, referenceDetails):
+        self.files = [] # (fileId, fileName)
+        self.entries = [] # (fileId, fileName, recNum, tokens, start, end)
+        value = bytearray()
+        mask = bytearray()
+        for fileProperties in referenceDetails:
+            fileId = str(fileProperties['filePath'])
+            fileName = fileProperties.get('fileName', '')
+            self.files.append((fileId, fileName))
+            content = fileProperties.get('fileContent')
+            if content is None:
+                continue
+            if isinstance(content, list):
+                patterns = [(recNum + 1, record) for recNum, record in enumerate(content)]
+            else:
+                patterns = [(0, content)] # transparent
+            for recNum, pattern in patterns:
+                patternValue, patternMask = compilePattern(pattern)
+                self.entries.append((fileId, fileName, recNum, splitPattern(pattern), len(value), len(value) + len(patternValue)))
+                value += patternValue
+                mask += patternMask
+        self.value = value
+        self.mask = mask
+        self.starts = [entry[4] for entry in self.entries]
+        if numpy is not None:
+            self.valueArray = numpy.frombuffer(bytes(value), dtype=numpy.uint8)
+            self.maskArray = numpy.frombuffer(bytes(mask), dtype=numpy.uint8)
+        else:
+            self.valueLong = toLong(value)
+            self.maskLong = toLong(mask)
+
+    def layoutScan(self, fileDetails):
+        # buffer of scanned content in reference layout, and errors found while
+        # laying it out: missing files, and index of entries of other length
+        # (compared one by one; their slot holds expected value)
+        byPath = {}
+        for fileProperties in fileDetails:
+            byPath[fileProperties['filePath']] = fileProperties
+        errors = []
+        for fileId, fileName in self.files:
+            fileProperties = byPath.get(fileId)
+            if fileProperties is None or not 'fileType' in fileProperties:
+                errors.append(getError(fileId, fileName, 0, '', '', 'Test 3G Status', 'File Not found in the Card'))
+
+        buffer = bytearray(self.value)
+        outputs = {} # entry index -> scanned bytes, for entries compared one by one
+        contents = {}
+        for index, (fileId, fileName, recNum, tokens, start, end) in enumerate(self.entries):
+            fileProperties = byPath.get(fileId)
+            if fileProperties is None or not 'fileType' in fileProperties:
+                continue
+            if not fileId in contents:
+                contents[fileId] = getContent(fileProperties)
+            content = contents[fileId]
+            if content is None:
+                continue # content not read, e.g. structure only
+            if recNum:
+                if not isinstance(content, list):
+                    continue
+                output = content[recNum - 1] if recNum <= len(content) else bytearray()
+            else:
+                if isinstance(content, list):
+                    continue
+                output = content
+            if len(output) == end - start:
+                buffer[start:end] = output
+            else:
+                outputs[index] = output
+        return buffer, errors, outputs
+
+    def getDifferentEntries(self, buffers):
+        # for each buffer, indexes of entries having at least one different byte
+        different = [set() for buffer in buffers]
+        if not self.entries:
+            return different
+        if numpy is not None:
+            scans = numpy.frombuffer(b''.join([bytes(buffer) for buffer in buffers]), dtype=numpy.uint8)
+            scans = scans.reshape((len(buffers), len(self.value)))
+            rows, columns = numpy.nonzero((scans ^ self.valueArray) & self.maskArray)
+            indexes = numpy.searchsorted(numpy.array(self.starts), columns, side='right') - 1
+            for row, index in zip(rows.tolist(), indexes.tolist()):
+                different[row].add(index)
+            return different
+        for row, buffer in enumerate(buffers):
+            difference = (toLong(buffer) ^ self.valueLong) & self.maskLong
+            if not difference:
+                continue
+            differentBytes = unhexlify('%0*X' % (2 * len(self.value), difference))
+            for match in NON_ZERO.finditer(differentBytes):
+                different[row].add(bisect_right(self.starts, match.start()) - 1)
+        return different
+
+    def getContentError(self, index, output):
+        # expected pattern with '<' after each byte not matching output
+        fileId, fileName, recNum, tokens, start, end = self.entries[index]
+        expected = ''
+        for i in range(len(tokens)):
+            if i < len(output) and not (output[i] ^ self.value[start + i]) & self.mask[start + i]:
+                expected += tokens[i] + ' '
+            else:
+                expected += tokens[i] + DIFFERENT
+        return getError(fileId, fileName, recNum, expected, toHex(output), 'Test File Content', 'Wrong Expected Response')
+
+    def compareScans(self, scans):
+        # org_errors of each scan (list of file properties, e.g. loaded json dump)
+        layouts = [self.layoutScan(fileDetails) for fileDetails in scans]
+        differentEntries = self.getDifferentEntries([buffer for buffer, errors, outputs in layouts])
+        results = []
+        for (buffer, errors, outputs), different in zip(layouts, differentEntries):
+            different.update(outputs)
+            for index in sorted(different):
+                start, end = self.entries[index][4:6]
+                errors.append(self.getContentError(index, outputs.get(index, buffer[start:end])))
+            results.append(self.groupErrors(errors))
+        return results
+
+    def compareScan(self, fileDetails):
+        return self.compareScans([fileDetails])[0]
+
+    def groupErrors(self, errors):
+        # one entry per file, in order of reference
+        byFile = {}
+        for error in errors:
+            byFile.setdefault(error['fileId'], []).append(error)
+        return [{'errors': byFile[fileId], 'errorFileId': fileId} for fileId, fileName in self.files if fileId in byFile]
+
+
+def loadDetails(fileName):
+    with open(fileName, 'r') as json_file:
+        return json.load(json_file)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('contentComparator')
+    parser.add_argument("reference", help="json dump of reference card; content may hold 'X' nibbles")
+    parser.add_argument("scans", nargs='+', help="json dumps to check against reference")
+    parser.add_argument("--batch", type=int, default=256, help="scans checked at once")
+    parser.add_argument("-o", "--output", help="json file where errors of each scan are written")
+    args = parser.parse_args()
+
+    comparator = ContentComparator(loadDetails(args.reference))
+    report = OrderedDict()
+    for first in range(0, len(args.scans), args.batch):
+        scanFiles = args.scans[first:first + args.batch]
+        for scanFile, orgErrors in zip(scanFiles, comparator.compareScans([loadDetails(scanFile) for scanFile in scanFiles])):
+            report[scanFile] = orgErrors
+            print('%s: %d error(s) in %d file(s)' % (scanFile, sum([len(fileErrors['errors']) for fileErrors in orgErrors]), len(orgErrors)))
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    sys.exit(1 if any(report.values()) else 0)
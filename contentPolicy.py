@@ -0,0 +1,87 @@
+import json
+
+# output files are named after ICCID; its content is always read
+ALWAYS_READ = ['3F002FE2']
+
+
+class ContentRule:
+    # what to read from EFs matched by a rule; None means no limit
+
+    def __init__(self, readContent=True, maxRecords=None, maxBytes=None, stopOnError=False):
+        self.readContent = readContent
+        self.maxRecords = maxRecords
+        self.maxBytes = maxBytes
+        self.stopOnError = stopOnError
+
+    def derive(self, settings):
+        # fields not given in settings are inherited
+        return ContentRule(
+            settings.get('content', self.readContent),
+            settings.get('maxRecords', self.maxRecords),
+            settings.get('maxBytes', self.maxBytes),
+            settings.get('stopOnError', self.stopOnError))
+
+    def getNumberOfRecord(self, numberOfRecord, recordSize):
+        if self.maxRecords is not None:
+            numberOfRecord = min(numberOfRecord, self.maxRecords)
+        if self.maxBytes is not None and recordSize:
+            numberOfRecord = min(numberOfRecord, self.maxBytes // recordSize)
+        return numberOfRecord
+
+    def getReadLength(self, fileSize):
+        if self.maxBytes is not None and isinstance(fileSize, (int, long)):
+            return min(fileSize, self.maxBytes)
+        return fileSize
+
+
+class ContentPolicy:
+    # content read rules per file path; a rule given for a DF applies to its
+    # whole subtree and the most specific rule wins. policy file:
+    # {
+    #   "default": {"content": false},
+    #   "rules": [
+    #     {"path": "3F007F20", "content": true, "maxRecords": 5},
+    #     {"path": "3F007FFF6F07", "content": true, "stopOnError": true}
+    #   ]
+    # }
+
+    def __init__(self, default=None):
+        self.default = default or ContentRule()
+        self.rules = {} # path -> ContentRule
+        self.cache = {}
+
+    def addRule(self, path, settings):
+        # settings override default rule
+        self.rules[str(path).upper()] = self.default.derive(settings)
+        self.cache = {}
+
+    def getRule(self, path):
+        if path in self.cache:
+            return self.cache[path]
+        rule = self.default
+        # longest prefix on file ID boundary
+        for length in range(len(path), 0, -4):
+            if path[:length] in self.rules:
+                rule = self.rules[path[:length]]
+                break
+        if path in ALWAYS_READ and not rule.readContent:
+            rule = ContentRule()
+        self.cache[path] = rule
+        return rule
+
+    @classmethod
+    def fromDict(cls, settings):
+        policy = cls(ContentRule().derive(settings.get('default', {})))
+        for rule in settings.get('rules', []):
+            policy.addRule(rule['path'], rule)
+        return policy
+
+    @classmethod
+    def fromFile(cls, fileName):
+        with open(fileName, 'r') as json_file:
+            return cls.fromDict(json.load(json_file))
+
+    @classmethod
+    def structureOnly(cls):
+        # file list and FCP only, e.g. for incoming inspection
+        return cls(ContentRule(readContent=False))
@@ -0,0 +1,92 @@
+MF = '3F00'
+
+
+def splitPath(path):
+    # split absolute path into 4-digit file IDs, e.g. '3F007F10' -> ['3F00', '7F10']
+    return [path[i:i + 4] for i in range(0, len(path), 4)]
+
+
+def sortDepthFirst(fileList):
+    # order paths so that a DF is followed by its whole subtree; siblings then
+    # share their parent prefix and the card never re-enters a DF it has left
+    return sorted(fileList, key=splitPath)
+
+
+class FileNavigator:
+    # keeps track of the DF currently selected in the card, so that only the
+    # SELECTs diverging from the current position need to be sent.
+    # selection by file ID (TS 51.011 / TS 102 221) allows: MF, current DF,
+    # parent of current DF and any child of current DF; everything else is
+    # reached by going back to MF.
+    # SELECTs not written to the pcom (e.g. during read header) move the card
+    # but not the script; the DF selected when replaying the script is kept
+    # apart, and the full path is used when both differ.
+
+    def __init__(self):
+        self.currentDf = None # unknown; full path will be selected
+        self.scriptDf = None
+
+    def reset(self, currentDf=None):
+        # after power on, in card and in script
+        self.currentDf = currentDf
+        self.scriptDf = currentDf
+
+    def setCurrentDf(self, currentDf, out2Pcom=False):
+        self.currentDf = currentDf
+        if out2Pcom:
+            self.scriptDf = currentDf
+
+    def getSelectSequence(self, path, out2Pcom=True):
+        # return list of file IDs to be selected, last one being the target
+        if out2Pcom and self.scriptDf != self.currentDf:
+            return splitPath(path)
+        return self.getSequenceFrom(self.currentDf, path)
+
+    def getScriptSelectSequence(self, path):
+        # same as above, for SELECTs only written to the script
+        return self.getSequenceFrom(self.scriptDf, path)
+
+    def getSequenceFrom(self, currentDf, path):
+        target = splitPath(path)
+        if currentDf is None or target[0] != MF:
+            return target
+        current = splitPath(currentDf)
+
+        # MF, current DF and parent of current DF can be selected directly
+        if len(target) == 1 or target == current or target == current[:-1]:
+            return target[-1:]
+
+        parent = target[:-1]
+        common = 0
+        while common < min(len(current), len(parent)) and current[common] == parent[common]:
+            common += 1
+
+        if common == len(current):
+            # target is located below current DF
+            return target[common:]
+        if common == len(current) - 1:
+            # common ancestor is parent of current DF
+            return [current[common - 1]] + target[common:]
+        return [MF] + target[1:]
+
+    def selected(self, path, isDf, out2Pcom=True):
+        # target successfully selected
+        if isDf:
+            self.setCurrentDf(path, out2Pcom)
+        else:
+            self.setCurrentDf(path[:-4], out2Pcom)
+
+    def scriptSelected(self, path, isDf):
+        # SELECTs written to the script without being sent; card stays where it is
+        if isDf:
+            self.scriptDf = path
+        else:
+            self.scriptDf = path[:-4]
+
+    def selectFailed(self, path, targetReached, out2Pcom=True):
+        # when only the last SELECT failed, current DF is the parent of target;
+        # otherwise card position is not known anymore
+        if targetReached:
+            self.setCurrentDf(path[:-4], out2Pcom)
+        else:
+            self.setCurrentDf(None, out2Pcom)
@@ -0,0 +1,177 @@
+from array import array
+
+HEX = ['%0.2X' % i for i in range(256)]
+
+
+def toHex(data):
+    # same format as smartcard.util.toHexString()
+    return ' '.join([HEX[byte] for byte in data])
+
+
+def fromHex(hexString):
+    return bytearray.fromhex(hexString)
+
+
+class FileRecord(object):
+    # properties of one scanned file; content is kept as raw bytes (records
+    # packed in one buffer with their offsets) and only rendered as hex when
+    # accessed through the dict-like interface, e.g. for json and html output
+
+    # dict key -> attribute, in order of json output
+    KEYS = [
+        ('filePath', 'filePath'),
+        ('fileName', 'fileName'),
+        ('fileType', 'fileType'),
+        ('fileStructure', 'fileStructure'),
+        ('fileSize', 'fileSize'),
+        ('fileRecordSize', 'fileRecordSize'),
+        ('numberOfRecord', 'numberOfRecord'),
+        ('fileStatus', 'fileStatus'),
+        ('sfi', 'sfi'),
+        ('2gAcc', 'acc2g'),
+        ('contentTruncated', 'contentTruncated')
+    ]
+    ATTRIBUTES = dict(KEYS)
+    MISSING = None # attribute value of missing key
+
+    __slots__ = [attribute for key, attribute in KEYS] + ['fcp', 'content', 'recordOffsets', 'extra']
+
+    def __init__(self, filePath):
+        for key, attribute in self.KEYS:
+            setattr(self, attribute, self.MISSING)
+        self.filePath = filePath
+        self.fcp = None # raw 3G GET RESPONSE
+        self.content = None # bytearray
+        self.recordOffsets = None # array of record start offsets in content, and end of last one
+        self.extra = None # other keys, e.g. digests
+
+    # raw content
+
+    def setContent(self, data):
+        self.content = bytearray(data)
+        self.recordOffsets = None
+
+    def setRecords(self, records):
+        self.content = bytearray()
+        self.recordOffsets = array('I', [0])
+        for record in records:
+            self.content.extend(record)
+            self.recordOffsets.append(len(self.content))
+
+    def getRecord(self, index):
+        return self.content[self.recordOffsets[index]:self.recordOffsets[index + 1]]
+
+    def getRecords(self):
+        return [self.getRecord(i) for i in range(len(self.recordOffsets) - 1)]
+
+    def releaseContent(self):
+        # e.g. once content has been streamed out
+        self.content = None
+        self.recordOffsets = None
+
+    def getRawContent(self):
+        # bytes of transparent EF or list of records; None if not read
+        if self.content is None:
+            return None
+        if self.recordOffsets is not None:
+            return self.getRecords()
+        return self.content
+
+    # dict-like interface, with json dump keys
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self.ATTRIBUTES:
+            value = getattr(self, self.ATTRIBUTES[key])
+            if value is self.MISSING:
+                return default
+            return value
+        if key == 'fileContent':
+            if self.content is None:
+                return default
+            if self.recordOffsets is not None:
+                return [toHex(record) for record in self.getRecords()]
+            return toHex(self.content)
+        if key == '3gGetResponse':
+            if self.fcp is None:
+                return default
+            return toHex(self.fcp)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        return default
+
+    def __setitem__(self, key, value):
+        if key in self.ATTRIBUTES:
+            setattr(self, self.ATTRIBUTES[key], value)
+        elif key == 'fileContent':
+            if isinstance(value, list):
+                self.setRecords([fromHex(record) for record in value])
+            else:
+                self.setContent(fromHex(value))
+        elif key == '3gGetResponse':
+            self.fcp = fromHex(value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def has_key(self, key):
+        return key in self
+
+    def pop(self, key, *default):
+        value = self.get(key, self)
+        if value is self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        if key in self.ATTRIBUTES:
+            setattr(self, self.ATTRIBUTES[key], self.MISSING)
+        elif key == 'fileContent':
+            self.content = None
+            self.recordOffsets = None
+        elif key == '3gGetResponse':
+            self.fcp = None
+        else:
+            del self.extra[key]
+        return value
+
+    def keys(self):
+        keys = [key for key, attribute in self.KEYS if getattr(self, attribute) is not self.MISSING]
+        if self.fcp is not None:
+            keys.append('3gGetResponse')
+        if self.content is not None:
+            keys.append('fileContent')
+        if self.extra is not None:
+            keys += sorted(self.extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def toDict(self):
+        return dict(self.items())
+
+    @classmethod
+    def fromDict(cls, properties):
+        # e.g. file details loaded from json (file path as plain str, json strings are unicode)
+        fileRecord = cls(str(properties['filePath']))
+        for key, value in properties.items():
+            if key != 'filePath':
+                fileRecord[str(key)] = value
+        return fileRecord
+
+
+def toDicts(fileDetails):
+    return [fileRecord.toDict() for fileRecord in fileDetails]
+
+
+def fromDicts(fileDetails):
+    return [FileRecord.fromDict(properties) for properties in fileDetails]
@@ -0,0 +1,56 @@
+from __future__ import print_function
+import sys
+import json
+
+# READ OS LOCK offset is coded in P2
+MAX_OS_LOCKS = 256
+
+
+def loadOsLocks(fileName):
+    # list of lock values (hex) from os locks json written by scanner, or plain json list
+    with open(fileName, 'r') as json_file:
+        data = json.load(json_file)
+    if isinstance(data, dict):
+        data = data['osLocks']
+    return [str(value) for value in data]
+
+
+def diffOsLocks(baseline, osLocks):
+    # list of (offset, baseline value, card value); None where buffer is shorter
+    differences = []
+    for offset in range(max(len(baseline), len(osLocks))):
+        baselineValue = baseline[offset] if offset < len(baseline) else None
+        value = osLocks[offset] if offset < len(osLocks) else None
+        if baselineValue != value:
+            differences.append((offset, baselineValue, value))
+    return differences
+
+
+def formatDifference(difference):
+    offset, baselineValue, value = difference
+    return 'offset %.2X: %s -> %s' % (offset, baselineValue or 'none', value or 'none')
+
+
+def getAuditReport(atr, osLocks, baseline=None, baselineFileName=''):
+    # structured output of audit, as written next to pcom
+    report = {'atr': atr, 'count': len(osLocks), 'osLocks': osLocks}
+    if baseline is not None:
+        report['baseline'] = baselineFileName
+        report['differences'] = [{'offset': offset, 'baseline': baselineValue, 'card': value}
+                                 for offset, baselineValue, value in diffOsLocks(baseline, osLocks)]
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('osLockAudit')
+    parser.add_argument("baseline", help="os locks json of reference card")
+    parser.add_argument("other", help="os locks json to compare with baseline")
+    args = parser.parse_args()
+
+    differences = diffOsLocks(loadOsLocks(args.baseline), loadOsLocks(args.other))
+    for difference in differences:
+        print(formatDifference(difference))
+    if not differences:
+        print('Identical')
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import cPickle as pickle
+
+# bumped when format of cache entries changes
+CACHE_VERSION = 1
+
+
+def hashFile(fileName):
+    sha1 = hashlib.sha1()
+    with open(fileName, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(65536), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def loadJson(fileName):
+    with open(fileName, 'r') as json_file:
+        return json.load(json_file)
+
+
+class ProfileCache:
+    # compiled form of input files (config.xml, script settings, file system xml)
+    # kept as pickle; an entry is valid while size and mtime of its source are
+    # unchanged, or, when they changed, while content hash is the same.
+    # kind names what compile() returns, e.g. 'fileSystem/1'; a new kind (or
+    # CACHE_VERSION) makes former entries unused.
+    # entries of config.xml hold security codes as the source does; they are
+    # written readable by owner only
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.hits = 0
+        self.misses = 0
+
+    def getEntryFileName(self, kind, fileName):
+        return self.getKeyFileName(kind, os.path.abspath(fileName))
+
+    def getKeyFileName(self, kind, key):
+        return os.path.join(self.cacheDir, hashlib.sha1(kind + '\n' + key).hexdigest() + '.pickle')
+
+    def readEntry(self, entryFileName):
+        try:
+            with open(entryFileName, 'rb') as cache_file:
+                return pickle.load(cache_file)
+        except Exception:
+            # missing, truncated or written by another version
+            return None
+
+    def writeEntry(self, entryFileName, entry):
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            tmpFileName = entryFileName + '.%d.tmp' % os.getpid()
+            with os.fdopen(os.open(tmpFileName, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'wb') as cache_file:
+                pickle.dump(entry, cache_file, pickle.HIGHEST_PROTOCOL)
+            if os.name == 'nt' and os.path.exists(entryFileName):
+                os.remove(entryFileName) # rename does not replace on Windows
+            os.rename(tmpFileName, entryFileName)
+        except (IOError, OSError):
+            pass # cache is an optimization only
+
+    def load(self, kind, fileName, compile):
+        # compiled content of fileName; compile(fileName) is called on cache miss
+        # and its result is cached unless it raises
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            return compile(fileName) # let compile() report missing file
+        signature = (stat.st_size, stat.st_mtime)
+
+        entryFileName = self.getEntryFileName(kind, fileName)
+        entry = self.readEntry(entryFileName)
+        if entry is not None and (entry.get('version') != CACHE_VERSION or entry.get('kind') != kind):
+            entry = None
+        if entry is not None and entry['signature'] == signature:
+            self.hits += 1
+            return entry['value']
+
+        contentHash = hashFile(fileName)
+        if entry is not None and entry['hash'] == contentHash:
+            # touched but unchanged, e.g. copied again
+            entry['signature'] = signature
+            self.writeEntry(entryFileName, entry)
+            self.hits += 1
+            return entry['value']
+
+        self.misses += 1
+        value = compile(fileName)
+        self.writeEntry(entryFileName, {
+            'version': CACHE_VERSION,
+            'kind': kind,
+            'source': os.path.abspath(fileName),
+            'signature': signature,
+            'hash': contentHash,
+            'value': value
+        })
+        return value
+
+    # entries not derived from an input file, e.g. file tree of a card, found by key
+
+    def get(self, kind, key):
+        entry = self.readEntry(self.getKeyFileName(kind, key))
+        if entry is None or entry.get('version') != CACHE_VERSION or entry.get('kind') != kind or entry.get('key') != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['value']
+
+    def put(self, kind, key, value):
+        self.writeEntry(self.getKeyFileName(kind, key), {
+            'version': CACHE_VERSION,
+            'kind': kind,
+            'key': key,
+            'value': value
+        })
+
+    def remove(self, kind, key):
+        try:
+            os.remove(self.getKeyFileName(kind, key))
+        except OSError:
+            pass
@@ -0,0 +1,205 @@
+from __future__ import print_function
+import os
+import sys
+import json
+import socket
+import threading
+import Queue
+from datetime import datetime
+
+from scanner import CardScanner, scanReader, readers, logger
+
+try:
+    from smartcard.CardMonitoring import CardMonitor, CardObserver
+except ImportError:
+    CardMonitor = None
+    CardObserver = object
+
+DEFAULT_PORT = 7755
+
+
+class EventBroadcaster:
+    # scan events sent as json lines to every client connected to local socket,
+    # e.g. nc localhost 7755
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(5)
+        self.clients = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.acceptClients, name='events')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def acceptClients(self):
+        while True:
+            try:
+                client, address = self.server.accept()
+            except socket.error:
+                return # closed
+            with self.lock:
+                self.clients.append(client)
+
+    def broadcast(self, event):
+        event = dict(event, time=datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
+        line = json.dumps(event, sort_keys=True) + '\n'
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(line)
+                except socket.error:
+                    # client went away
+                    self.clients.remove(client)
+                    client.close()
+
+    def close(self):
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+
+
+class ScanDaemon(CardObserver):
+    # scans every card inserted in any reader, with settings and parsed file
+    # system of template scanner; cards of one reader are scanned one after the
+    # other, readers are scanned concurrently
+
+    def __init__(self, template, broadcaster, scanPresent=False):
+        self.template = template
+        self.broadcaster = broadcaster
+        self.scanPresent = scanPresent # scan cards already inserted at start
+        self.readerNames = []
+        self.queues = {} # reader number -> Queue of jobs
+        self.workers = []
+        self.lock = threading.Lock()
+        self.monitor = None
+        self.starting = False
+
+    def getReaderNumber(self, readerName):
+        # readers plugged in while running are appended by PC/SC
+        readerName = str(readerName)
+        if not readerName in self.readerNames:
+            self.readerNames = [str(reader) for reader in readers()]
+        if not readerName in self.readerNames:
+            return None
+        return self.readerNames.index(readerName)
+
+    def update(self, observable, actions):
+        # CardObserver interface; called by CardMonitor thread
+        addedCards, removedCards = actions
+        for card in removedCards:
+            self.broadcaster.broadcast({'event': 'removed', 'reader': self.getReaderNumber(card.reader)})
+        for card in addedCards:
+            readerNumber = self.getReaderNumber(card.reader)
+            atr = ' '.join(['%.2X' % byte for byte in card.atr])
+            self.broadcaster.broadcast({'event': 'inserted', 'reader': readerNumber, 'atr': atr})
+            if readerNumber is None:
+                logger.error('%s: unknown reader' % card.reader)
+            elif self.starting and not self.scanPresent:
+                logger.info('reader %d: card present at start is not scanned' % readerNumber)
+            else:
+                self.queueScan(readerNumber, atr)
+
+    def queueScan(self, readerNumber, atr):
+        with self.lock:
+            if not readerNumber in self.queues:
+                self.queues[readerNumber] = Queue.Queue()
+                worker = threading.Thread(target=self.scanCards, args=(readerNumber, self.queues[readerNumber]),
+                    name='reader%d' % readerNumber)
+                worker.daemon = True
+                self.workers.append(worker)
+                worker.start()
+            self.queues[readerNumber].put(atr)
+
+    def scanCards(self, readerNumber, jobs):
+        while True:
+            atr = jobs.get()
+            if atr is None:
+                return # stopped
+            self.scanCard(readerNumber, atr)
+
+    def scanCard(self, readerNumber, atr):
+        scanner = self.template.cloneForReader(readerNumber)
+        # one script per card
+        pcomBaseName, pcomExtension = os.path.splitext(self.template.pcomOutFileName)
+        scanner.pcomOutFileName = '%s_reader%d_%s%s' % (pcomBaseName, readerNumber,
+            datetime.now().strftime('%Y%m%d%H%M%S'), pcomExtension)
+        self.broadcaster.broadcast({'event': 'started', 'reader': readerNumber, 'atr': atr, 'pcom': scanner.pcomOutFileName})
+        summary = {'readerNumber': readerNumber}
+        scanReader(scanner, summary)
+        summary['atr'] = scanner.cardAtr
+        if summary['success']:
+            logger.info('reader %d: %s (%.1f s, %d APDUs)' % (readerNumber, summary['message'], summary['elapsed'], summary['apdus']))
+        else:
+            logger.error('reader %d: %s' % (readerNumber, summary['message']))
+        self.broadcaster.broadcast(dict(summary, event='finished', reader=readerNumber))
+
+    def start(self):
+        self.readerNames = [str(reader) for reader in readers()]
+        logger.info('Watching %d reader(s)' % len(self.readerNames))
+        self.monitor = CardMonitor()
+        # cards already inserted are notified while observer is added
+        self.starting = True
+        self.monitor.addObserver(self)
+        self.starting = False
+
+    def stop(self):
+        if self.monitor is not None:
+            self.monitor.deleteObserver(self)
+            self.monitor = None
+        with self.lock:
+            for jobs in self.queues.values():
+                jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def createTemplate(fullScript):
+    # config.xml and script-settings.json (as with VerifClient) are parsed once
+    template = CardScanner(runAsModule=False, fullScript=fullScript)
+    template.opt_profile_cache = True
+    parseConfigOk, parseConfigMsg = template.parseConfigXml()
+    if not parseConfigOk:
+        return None, parseConfigMsg
+    template.parseScriptSettings()
+    if template.fileSystemXml != '':
+        parseFileSystemOk, parseFileSystemMsg = template.loadFileSystem()
+        if not parseFileSystemOk:
+            return None, parseFileSystemMsg
+    if fullScript:
+        template.pcomOutFileName = template.profileBaseName + '__full.pcom'
+    else:
+        template.pcomOutFileName = template.profileBaseName + '__light.pcom'
+    return template, 'ready'
+
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    parser = argparse.ArgumentParser('scanDaemon')
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="local port where scan events are sent (json lines)")
+    parser.add_argument("--light", action="store_true", help="light script (no security codes verified)")
+    parser.add_argument("--scan-present", action="store_true", help="also scan cards already inserted at start")
+    args = parser.parse_args()
+
+    if CardMonitor is None:
+        sys.exit('pyscard is required to watch readers')
+    template, templateMsg = createTemplate(not args.light)
+    if template is None:
+        logger.error(templateMsg)
+        sys.exit(-1)
+
+    broadcaster = EventBroadcaster(args.port)
+    daemon = ScanDaemon(template, broadcaster, args.scan_present)
+    daemon.start()
+    logger.info('Scan events on localhost:%d; Ctrl+C to stop' % args.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    daemon.stop()
+    broadcaster.close()
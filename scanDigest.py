@@ -0,0 +1,179 @@
+from __future__ import print_function
+import sys
+import json
+import hashlib
+
+MF = '3F00'
+
+# properties describing a file, apart from its content
+METADATA_KEYS = ['fileType', 'fileStructure', 'fileSize', 'fileRecordSize', 'numberOfRecord', 'fileStatus',
+                 '2gAcc', '3gGetResponse', 'sfi']
+
+
+def hashBytes(data):
+    return hashlib.sha1(bytes(data)).hexdigest()
+
+
+def hashHex(hexString):
+    # content is hashed as bytes, whatever the spacing of hex string
+    return hashBytes(bytearray.fromhex(hexString.replace(' ', '')))
+
+
+def hashText(parts):
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def getContentDigest(fileProperties):
+    # returns digest of content and digests of records (None for transparent EF)
+    if hasattr(fileProperties, 'getRawContent'):
+        # FileRecord: no need to render content as hex
+        content = fileProperties.getRawContent()
+        hashContent = hashBytes
+    else:
+        content = fileProperties.get('fileContent')
+        hashContent = hashHex
+    if content is None:
+        return None, None
+    if isinstance(content, list):
+        recordDigests = [hashContent(record) for record in content]
+        return hashText(recordDigests), recordDigests
+    return hashContent(content), None
+
+
+def getFileDigest(fileProperties):
+    parts = [fileProperties['filePath']]
+    for key in METADATA_KEYS:
+        parts.append('%s=%s' % (key, fileProperties.get(key, '')))
+    parts.append('content=%s' % (fileProperties.get('contentDigest') or ''))
+    return hashText(parts)
+
+
+def getParent(path, paths):
+    # nearest ancestor present in scan; files listed without their DF hang below MF
+    parent = path[:-4]
+    while parent and not parent in paths:
+        parent = parent[:-4]
+    return parent or None
+
+
+def buildTree(fileDetails):
+    byPath = {}
+    for fileProperties in fileDetails:
+        byPath[fileProperties['filePath']] = fileProperties
+    children = {}
+    roots = []
+    for path in byPath:
+        parent = getParent(path, byPath)
+        if parent is None:
+            roots.append(path)
+        else:
+            children.setdefault(parent, []).append(path)
+    return byPath, children, sorted(roots)
+
+
+def addFileDigests(fileProperties):
+    # contentDigest (and recordDigests) and fileDigest of one file, in place
+    contentDigest, recordDigests = getContentDigest(fileProperties)
+    fileProperties.pop('contentDigest', None)
+    fileProperties.pop('recordDigests', None)
+    if contentDigest is not None:
+        fileProperties['contentDigest'] = contentDigest
+    if recordDigests is not None:
+        fileProperties['recordDigests'] = recordDigests
+    fileProperties['fileDigest'] = getFileDigest(fileProperties)
+
+
+def addDigests(fileDetails):
+    # adds contentDigest (and recordDigests) and fileDigest to every file, and
+    # subtreeDigest to every DF, in place; subtreeDigest of MF is root digest of card
+    byPath, children, roots = buildTree(fileDetails)
+    for fileProperties in fileDetails:
+        addFileDigests(fileProperties)
+
+    # deepest paths first, so that children are done before their parent
+    for path in sorted(children, key=len, reverse=True):
+        parts = [byPath[path]['fileDigest']]
+        for child in sorted(children[path]):
+            parts.append(byPath[child].get('subtreeDigest', byPath[child]['fileDigest']))
+        byPath[path]['subtreeDigest'] = hashText(parts)
+    return getRootDigest(fileDetails)
+
+
+def getRootDigest(fileDetails):
+    byPath, children, roots = buildTree(fileDetails)
+    if roots == [MF]:
+        return byPath[MF].get('subtreeDigest', byPath[MF].get('fileDigest'))
+    return hashText([byPath[root].get('subtreeDigest', byPath[root].get('fileDigest', '')) for root in roots])
+
+
+def compareDigests(referenceDetails, otherDetails):
+    # list of (path, difference), descending only into subtrees whose digest differs;
+    # both scans shall have been digested with addDigests()
+    refByPath, refChildren, refRoots = buildTree(referenceDetails)
+    othByPath, othChildren, othRoots = buildTree(otherDetails)
+    differences = []
+
+    def compare(paths):
+        for path in sorted(paths):
+            if not path in othByPath:
+                differences.append((path, 'missing'))
+                continue
+            if not path in refByPath:
+                differences.append((path, 'added'))
+                continue
+            ref = refByPath[path]
+            oth = othByPath[path]
+            if ref.get('subtreeDigest') is not None and ref.get('subtreeDigest') == oth.get('subtreeDigest'):
+                continue
+            if ref['fileDigest'] != oth['fileDigest']:
+                differences.append((path, describeDifference(ref, oth)))
+            compare(set(refChildren.get(path, [])) | set(othChildren.get(path, [])))
+
+    compare(set(refRoots) | set(othRoots))
+    return differences
+
+
+def describeDifference(ref, oth):
+    metadata = [key for key in METADATA_KEYS if ref.get(key) != oth.get(key)]
+    if metadata:
+        return 'metadata: ' + ', '.join(metadata)
+    refRecords = ref.get('recordDigests')
+    othRecords = oth.get('recordDigests')
+    if refRecords is not None and othRecords is not None:
+        records = [str(i + 1) for i in range(max(len(refRecords), len(othRecords)))
+                   if i >= len(refRecords) or i >= len(othRecords) or refRecords[i] != othRecords[i]]
+        return 'records: ' + ', '.join(records)
+    return 'content'
+
+
+def loadDigested(fileName):
+    with open(fileName, 'r') as json_file:
+        fileDetails = json.load(json_file)
+    if not fileDetails or not 'fileDigest' in fileDetails[0]:
+        addDigests(fileDetails)
+    return fileDetails
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('scanDigest')
+    parser.add_argument("reference", help="json dump of reference scan")
+    parser.add_argument("other", nargs='?', help="json dump to compare with reference")
+    parser.add_argument("--write", action="store_true", help="store digests into reference json")
+    args = parser.parse_args()
+
+    reference = loadDigested(args.reference)
+    if args.write:
+        with open(args.reference, 'w') as json_file:
+            json.dump(reference, json_file, indent=2)
+    if not args.other:
+        print(getRootDigest(reference))
+        sys.exit(0)
+
+    other = loadDigested(args.other)
+    differences = compareDigests(reference, other)
+    for path, difference in differences:
+        print('%s: %s' % (path, difference))
+    if not differences:
+        print('Identical (%s)' % getRootDigest(reference))
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,160 @@
+import os
+import time
+from collections import OrderedDict
+from timeit import default_timer
+
+# upper bounds (s) of APDU latency histogram buckets, last one is +Inf
+LATENCY_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0]
+
+
+def cpuTime():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class ScanMetrics:
+    # APDU counters, per-phase wall/CPU time and APDU latency histograms
+    # (by INS and phase) of a CardScanner run
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.apduCount = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.replayedApdus = 0 # written to script from responses already known, not sent
+        self.phases = []
+        self.currentPhase = None
+        self.latency = {} # (ins, phase) -> [count per bucket, ..., sum, max]
+
+    def countApdu(self, bytesSent, bytesReceived, ins=None, seconds=None):
+        self.apduCount += 1
+        self.bytesSent += bytesSent
+        self.bytesReceived += bytesReceived
+        if seconds is not None:
+            self.addLatency(ins, seconds)
+
+    def addLatency(self, ins, seconds):
+        if self.currentPhase is None:
+            key = (ins, '')
+        else:
+            key = (ins, self.currentPhase['phase'])
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0.0]
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        histogram[bucket] += 1
+        histogram[-2] += seconds
+        if seconds > histogram[-1]:
+            histogram[-1] = seconds
+
+    def snapshot(self):
+        return {
+            'wallTime': default_timer(),
+            'cpuTime': cpuTime(),
+            'apdus': self.apduCount,
+            'bytesSent': self.bytesSent,
+            'bytesReceived': self.bytesReceived
+        }
+
+    def startPhase(self, name):
+        # a phase lasts until next phase is started or endPhase() is called
+        self.endPhase()
+        self.currentPhase = {'phase': name, 'start': self.snapshot()}
+
+    def endPhase(self):
+        if self.currentPhase is None:
+            return
+        start = self.currentPhase['start']
+        end = self.snapshot()
+        phase = {'phase': self.currentPhase['phase']}
+        for key in ('wallTime', 'cpuTime', 'apdus', 'bytesSent', 'bytesReceived'):
+            phase[key] = end[key] - start[key]
+        self.phases.append(phase)
+        self.currentPhase = None
+
+    def summary(self):
+        total = {'wallTime': 0.0, 'cpuTime': 0.0}
+        for phase in self.phases:
+            total['wallTime'] += phase['wallTime']
+            total['cpuTime'] += phase['cpuTime']
+        total['apdus'] = self.apduCount
+        total['bytesSent'] = self.bytesSent
+        total['bytesReceived'] = self.bytesReceived
+        total['replayedApdus'] = self.replayedApdus
+        return {'total': total, 'phases': list(self.phases)}
+
+    def latencySummary(self):
+        # one entry per INS and phase; buckets are not cumulative
+        latency = []
+        for (ins, phase), histogram in sorted(self.latency.items()):
+            count = sum(histogram[:-2])
+            latency.append({
+                'ins': '%.2X' % ins if ins is not None else '',
+                'phase': phase,
+                'count': count,
+                'sum': histogram[-2],
+                'mean': histogram[-2] / count,
+                'max': histogram[-1],
+                'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram[:-2]))
+            })
+        return latency
+
+    def toJson(self, labels, scanOk):
+        # labels: e.g. reader
+        report = dict(labels)
+        report['success'] = scanOk
+        report.update(self.summary())
+        report['latency'] = self.latencySummary()
+        return report
+
+    def toPrometheus(self, labels, scanOk):
+        # text exposition format, e.g. for node exporter textfile collector
+        lines = []
+
+        def formatLabels(extra):
+            pairs = sorted(labels.items()) + extra
+            return '{' + ','.join(['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs]) + '}'
+
+        lines.append('# HELP cardscanner_apdu_duration_seconds APDU round trip time, by INS and scan phase')
+        lines.append('# TYPE cardscanner_apdu_duration_seconds histogram')
+        for (ins, phase), histogram in sorted(self.latency.items()):
+            extra = [('ins', '%.2X' % ins if ins is not None else ''), ('phase', phase)]
+            cumulative = 0
+            for bound, count in zip([repr(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram[:-2]):
+                cumulative += count
+                lines.append('cardscanner_apdu_duration_seconds_bucket%s %d' % (formatLabels(extra + [('le', bound)]), cumulative))
+            lines.append('cardscanner_apdu_duration_seconds_sum%s %r' % (formatLabels(extra), histogram[-2]))
+            lines.append('cardscanner_apdu_duration_seconds_count%s %d' % (formatLabels(extra), cumulative))
+
+        lines.append('# HELP cardscanner_scan_success 1 if last scan succeeded')
+        lines.append('# TYPE cardscanner_scan_success gauge')
+        lines.append('cardscanner_scan_success%s %d' % (formatLabels([]), 1 if scanOk else 0))
+        lines.append('# HELP cardscanner_scan_end_timestamp_seconds end of last scan')
+        lines.append('# TYPE cardscanner_scan_end_timestamp_seconds gauge')
+        lines.append('cardscanner_scan_end_timestamp_seconds%s %d' % (formatLabels([]), time.time()))
+        lines.append('# HELP cardscanner_replayed_apdus APDUs written to script from responses of the same session, not sent')
+        lines.append('# TYPE cardscanner_replayed_apdus gauge')
+        lines.append('cardscanner_replayed_apdus%s %d' % (formatLabels([]), self.replayedApdus))
+
+        # a phase may occur more than once, e.g. after resume
+        phases = OrderedDict()
+        for phase in self.phases:
+            total = phases.setdefault(phase['phase'], dict.fromkeys(phase, 0))
+            for key in ('wallTime', 'cpuTime', 'apdus', 'bytesSent', 'bytesReceived'):
+                total[key] += phase[key]
+
+        for name, key, help in (
+                ('cardscanner_phase_duration_seconds', 'wallTime', 'wall time of scan phase'),
+                ('cardscanner_phase_cpu_seconds', 'cpuTime', 'CPU time of scan phase'),
+                ('cardscanner_phase_apdus', 'apdus', 'APDUs sent in scan phase'),
+                ('cardscanner_phase_bytes_sent', 'bytesSent', 'bytes sent to card in scan phase'),
+                ('cardscanner_phase_bytes_received', 'bytesReceived', 'bytes received from card in scan phase')):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for phase, total in phases.items():
+                lines.append('%s%s %r' % (name, formatLabels([('phase', phase)]), total[key]))
+        return '\n'.join(lines) + '\n'
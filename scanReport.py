@@ -0,0 +1,150 @@
+import json
+
+EF_ICCID = '3F002FE2'
+
+# rows of file table: property, label
+FILE_ROWS = [
+    ('fileType', 'File type'),
+    ('sfi', 'SFI'),
+    ('fileStructure', 'File structure'),
+    ('2gAcc', '2G access condition'),
+    ('3gGetResponse', 'File control parameter'),
+    ('fileSize', 'File size'),
+    ('fileRecordSize', 'Record size'),
+    ('numberOfRecord', 'Number of record')
+]
+
+DOCUMENT_HEADER = """<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">
+            <html>
+            <head>
+            <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+            <meta http-equiv="X-UA-Compatible" content="IE=edge,chrome=1" />
+            <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0">
+            <title>Card Report</title>
+            <style type="text/css">
+            html,
+            body {
+                height: 100%;
+            }
+            html {
+                font-size: 16px;
+            }
+            body {
+                margin: 0px;
+                padding: 0px;
+                overflow-x: hidden;
+                min-width: 320px;
+                background: #F9F9F9;
+                font-family: Arial, Helvetica, sans-serif;
+                font-size: 13px;
+                line-height: 1.33;
+                color: #212121;
+                font-smoothing: antialiased;
+            }
+            div {
+                margin-top: 10px;
+                margin-left: 40px;
+                margin-right: 40px;
+            }
+            h1,
+            h2,
+            h3,
+            h4,
+            h5 {
+                font-family: Arial, Helvetica, sans-serif;
+                line-height: 1.33em;
+                margin: calc(2rem -  0.165em ) 0em 1rem;
+                font-weight: 400;
+                padding: 0em;
+            }
+            table {
+                border-collapse: collapse;
+            }
+            th,
+            td {
+                border: 2px solid black;
+                padding: 4px;
+            }
+            th.error {
+                background-color: firebrick;
+                color: #F9F9F9;
+            }
+            th.warning {
+                background-color: darkorange;
+                color: #F9F9F9;
+            }
+            td.error {
+                background-color: #FDEDEC;
+                color: #17202A;
+            }
+            td.warning {
+                background-color: #FEF9E7;
+                color: #17202A;
+            }
+            td.data {
+                font-family: consolas, Monaco, monospace;
+                font-size: 13px;
+            }
+            ul {
+                margin: 0px;
+                padding: 15px;
+            }
+            </style>
+            </head>
+            <body>"""
+DOCUMENT_FOOTER = '\n</body></html>'
+TABLE_HEADER = '\n<div><table><tbody>'
+TABLE_FOOTER = '\n</tbody></table></div>'
+
+
+def formatFileId(fileId):
+    # '3F007F10' -> '3F00/7F10'; None if path is not made of 1 to 5 file ids
+    if len(fileId) in [4, 8, 12, 16, 20]:
+        return '/'.join([fileId[i:i + 4] for i in range(0, len(fileId), 4)])
+
+
+def swapIccid(iccid):
+    # EF ICCID content ('98 10 ...') -> ICCID digits
+    return ''.join([''.join(reversed(byteChar)) for byteChar in iccid.split()])
+
+
+def getIccid(fileDetails):
+    # EF ICCID content; None if not read
+    for ef in fileDetails:
+        if ef['filePath'] == EF_ICCID:
+            return ef.get('fileContent')
+
+
+def getHtmlReport(fileDetails, iccid, generationDate):
+    # html dump of file system, as written by scanner
+    lines = [DOCUMENT_HEADER, '\n<div><h1>Card Serial #: ' + swapIccid(iccid) + '</h1></div>']
+    for ef in fileDetails:
+        lines.append('\n<div><h2>' + formatFileId(ef['filePath']) + ': ' + ef['fileName'] + '</h2></div>')
+        lines.append(TABLE_HEADER)
+        for key, label in FILE_ROWS:
+            if key in ef:
+                lines.append('\n<tr><td>' + label + '</td><td>' + unicode(ef[key]) + '</td></tr>')
+        lines.append(TABLE_FOOTER)
+        if 'fileContent' in ef:
+            lines.append('\n<div>File content:</div>')
+            lines.append(TABLE_HEADER)
+            if ef['fileStructure'] == 'transparent':
+                lines.append('\n<tr><td class="data">' + ef['fileContent'] + '</td></tr>')
+            if ef['fileStructure'] == 'linear fixed' or ef['fileStructure'] == 'cyclic':
+                for recordNumber, record in enumerate(ef['fileContent']):
+                    lines.append('\n<tr><td class="data">' + str(recordNumber + 1) + '</td><td class="data">' + record + '</td></tr>')
+            lines.append(TABLE_FOOTER)
+    lines.append('\n<div><i>Generated with CardScanner on ' + generationDate + '</i></div>')
+    lines.append(DOCUMENT_FOOTER)
+    return ''.join(lines)
+
+
+def writeHtmlReport(fileName, fileDetails, iccid, generationDate):
+    with open(fileName, 'w') as htmlFile:
+        htmlFile.write(getHtmlReport(fileDetails, iccid, generationDate).encode('utf-8'))
+
+
+def writeJsonReport(fileName, fileDetails):
+    # file details as dicts
+    with open(fileName, 'w') as json_file:
+        json.dump(fileDetails, json_file, indent=2)
@@ -0,0 +1,374 @@
+from __future__ import print_function
+import os
+import re
+import json
+import sqlite3
+from datetime import datetime
+
+from fileRecord import toHex, fromHex
+from scanStream import readNdjson
+
+EF_ICCID = '3F002FE2'
+
+# file properties stored with each file, as in json dump
+FILE_COLUMNS = [
+    ('fileName', 'fileName'),
+    ('fileType', 'fileType'),
+    ('fileStructure', 'fileStructure'),
+    ('fileSize', 'fileSize'),
+    ('fileRecordSize', 'fileRecordSize'),
+    ('numberOfRecord', 'numberOfRecord'),
+    ('fileStatus', 'fileStatus'),
+    ('sfi', 'sfi'),
+    ('2gAcc', 'acc2g'),
+    ('3gGetResponse', 'fcp')
+]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    iccid TEXT NOT NULL,
+    scanTime TEXT NOT NULL,
+    source TEXT NOT NULL UNIQUE,
+    sourceMtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scansByIccid ON scans (iccid, scanTime);
+CREATE INDEX IF NOT EXISTS scansByTime ON scans (scanTime);
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS properties (
+    id INTEGER PRIMARY KEY,
+    %s
+);
+CREATE TABLE IF NOT EXISTS contents (
+    id INTEGER PRIMARY KEY,
+    recordSize INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contentsByData ON contents (data);
+CREATE TABLE IF NOT EXISTS files (
+    scanId INTEGER NOT NULL,
+    pathId INTEGER NOT NULL,
+    propertiesId INTEGER NOT NULL,
+    contentId INTEGER
+);
+CREATE INDEX IF NOT EXISTS filesByPath ON files (pathId, contentId);
+CREATE INDEX IF NOT EXISTS filesByScan ON files (scanId);
+''' % ',\n    '.join(['%s TEXT' % column for key, column in FILE_COLUMNS])
+
+# <ICCID>__<YYYYmmddHHMM>.json as written by scanner
+DUMP_NAME = re.compile(r'^(?P<iccid>[0-9A-Fa-f]+)__(?P<time>\d{12})\.json$')
+
+
+def swapIccid(content):
+    # EF ICCID content ('98 10 ...') -> ICCID digits
+    return ''.join([byte[1] + byte[0] for byte in content.split()])
+
+
+def getScanInfo(fileName, fileDetails):
+    # ICCID and time of scan, from name of json dump when possible
+    match = DUMP_NAME.match(os.path.basename(fileName))
+    if match:
+        scanTime = datetime.strptime(match.group('time'), '%Y%m%d%H%M')
+        return match.group('iccid'), scanTime.strftime('%Y-%m-%d %H:%M')
+    iccid = ''
+    for fileProperties in fileDetails:
+        if fileProperties['filePath'] == EF_ICCID and isinstance(fileProperties.get('fileContent'), basestring):
+            iccid = swapIccid(fileProperties['fileContent'])
+    return iccid, datetime.fromtimestamp(os.path.getmtime(fileName)).strftime('%Y-%m-%d %H:%M')
+
+
+def loadScan(fileName):
+    # file details of json dump or ndjson stream
+    if fileName.endswith('.ndjson'):
+        fileDetails, summary = readNdjson(fileName)
+        return fileDetails
+    with open(fileName, 'r') as json_file:
+        return json.load(json_file)
+
+
+def listScanFiles(paths):
+    # json dumps and ndjson streams given, or found in folders given
+    fileNames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                fileNames += [os.path.join(root, name) for name in sorted(files)
+                              if DUMP_NAME.match(name) or name.endswith('.ndjson')]
+        else:
+            fileNames.append(path)
+    return fileNames
+
+
+def encodeContent(content):
+    # (recordSize, bytes) of file content: records are stored end to end;
+    # recordSize is 0 for transparent EF, -1 if records differ in size (each
+    # record is then preceded by its length)
+    if not isinstance(content, list):
+        return 0, bytes(fromHex(content))
+    records = [fromHex(record) for record in content]
+    sizes = set([len(record) for record in records])
+    if len(sizes) == 1 and 0 < len(records[0]) < 256:
+        return len(records[0]), b''.join([bytes(record) for record in records])
+    data = bytearray()
+    for record in records:
+        data.append(len(record))
+        data += record
+    return -1, bytes(data)
+
+
+def decodeContent(recordSize, data):
+    # list of (recNum, bytes); recNum is 0 for transparent EF
+    data = bytearray(data)
+    if recordSize == 0:
+        return [(0, data)]
+    records = []
+    if recordSize > 0:
+        for offset in range(0, len(data), recordSize):
+            records.append((len(records) + 1, data[offset:offset + recordSize]))
+        return records
+    offset = 0
+    while offset < len(data):
+        records.append((len(records) + 1, data[offset + 1:offset + 1 + data[offset]]))
+        offset += 1 + data[offset]
+    return records
+
+
+class ScanStore:
+    # json dumps of many cards in one SQLite database: one row per scan and
+    # one per (scan, file). paths, file properties and file contents are stored
+    # once whatever the number of cards having them and rows only hold their
+    # ids, so that a month of production stays small and comparing cards on
+    # one file is comparing ids. records are split from content when queried,
+    # only once per distinct content.
+
+    def __init__(self, fileName):
+        self.connection = sqlite3.connect(fileName)
+        self.connection.text_factory = str
+        self.connection.executescript(SCHEMA)
+        self.loadIds()
+
+    def loadIds(self):
+        # paths and properties are few; contents are looked up when not cached
+        self.pathIds = dict([(path, pathId) for pathId, path in self.connection.execute('SELECT id, path FROM paths')])
+        self.propertiesIds = {}
+        for row in self.connection.execute('SELECT * FROM properties'):
+            self.propertiesIds[tuple(row[1:])] = row[0]
+        self.contentIds = {}
+        self.records = {} # content id -> decoded records
+
+    def close(self):
+        self.connection.close()
+
+    def getPathId(self, path):
+        pathId = self.pathIds.get(path)
+        if pathId is None:
+            pathId = self.pathIds[path] = self.connection.execute('INSERT INTO paths (path) VALUES (?)', (path,)).lastrowid
+        return pathId
+
+    def getPropertiesId(self, fileProperties):
+        properties = tuple([self.toColumn(fileProperties.get(key)) for key, column in FILE_COLUMNS])
+        propertiesId = self.propertiesIds.get(properties)
+        if propertiesId is None:
+            propertiesId = self.propertiesIds[properties] = self.connection.execute('INSERT INTO properties (%s) VALUES (%s)' % (
+                ', '.join([column for key, column in FILE_COLUMNS]), ', '.join(['?'] * len(FILE_COLUMNS))), properties).lastrowid
+        return propertiesId
+
+    def getContentId(self, content):
+        if content is None:
+            return None
+        key = encodeContent(content)
+        contentId = self.contentIds.get(key)
+        if contentId is None:
+            row = self.connection.execute('SELECT id FROM contents WHERE data = ? AND recordSize = ?', (buffer(key[1]), key[0])).fetchone()
+            if row is None:
+                contentId = self.connection.execute('INSERT INTO contents (recordSize, data) VALUES (?, ?)', (key[0], buffer(key[1]))).lastrowid
+            else:
+                contentId = row[0]
+            self.contentIds[key] = contentId
+        return contentId
+
+    def toColumn(self, value):
+        if value is None:
+            return None
+        return unicode(value).encode('utf-8') if isinstance(value, unicode) else str(value)
+
+    def ingest(self, fileName):
+        # returns False if dump is already stored and unchanged since
+        source = os.path.abspath(fileName)
+        sourceMtime = os.path.getmtime(fileName)
+        row = self.connection.execute('SELECT id, sourceMtime FROM scans WHERE source = ?', (source,)).fetchone()
+        if row is not None:
+            if row[1] == sourceMtime:
+                return False
+            self.removeScan(row[0])
+
+        fileDetails = loadScan(fileName)
+        iccid, scanTime = getScanInfo(fileName, fileDetails)
+        scanId = self.connection.execute('INSERT INTO scans (iccid, scanTime, source, sourceMtime) VALUES (?, ?, ?, ?)',
+                                         (iccid, scanTime, source, sourceMtime)).lastrowid
+        self.connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?)', [
+            (scanId, self.getPathId(str(fileProperties['filePath'])), self.getPropertiesId(fileProperties),
+             self.getContentId(fileProperties.get('fileContent'))) for fileProperties in fileDetails])
+        return True
+
+    def removeScan(self, scanId):
+        self.connection.execute('DELETE FROM files WHERE scanId = ?', (scanId,))
+        self.connection.execute('DELETE FROM scans WHERE id = ?', (scanId,))
+
+    def ingestFiles(self, fileNames):
+        # one transaction for all dumps; returns number of dumps stored
+        ingested = 0
+        try:
+            with self.connection:
+                for fileName in fileNames:
+                    if self.ingest(fileName):
+                        ingested += 1
+        except Exception:
+            self.loadIds() # ids inserted are rolled back
+            raise
+        return ingested
+
+    # queries; iccid, since and until ('YYYY-MM-DD[ HH:MM]', until excluded)
+    # restrict scans taken into account
+
+    def getScanFilter(self, iccid=None, since=None, until=None):
+        conditions = []
+        parameters = []
+        if iccid:
+            conditions.append('scans.iccid = ?')
+            parameters.append(iccid)
+        if since:
+            conditions.append('scans.scanTime >= ?')
+            parameters.append(since)
+        if until:
+            conditions.append('scans.scanTime < ?')
+            parameters.append(until)
+        return conditions, parameters
+
+    def getStoredPathId(self, path):
+        # -1 (no row) for path never stored
+        return self.pathIds.get(path, -1)
+
+    def query(self, sql, conditions, parameters):
+        if conditions:
+            sql = sql.replace('%(where)s', 'AND ' + ' AND '.join(conditions))
+        else:
+            sql = sql.replace('%(where)s', '')
+        cursor = self.connection.execute(sql, parameters)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def getRecords(self, contentId):
+        records = self.records.get(contentId)
+        if records is None:
+            recordSize, data = self.connection.execute('SELECT recordSize, data FROM contents WHERE id = ?', (contentId,)).fetchone()
+            records = self.records[contentId] = [(recNum, toHex(record)) for recNum, record in decodeContent(recordSize, data)]
+        return records
+
+    def getScans(self, iccid=None, since=None, until=None):
+        conditions, parameters = self.getScanFilter(iccid, since, until)
+        return self.query('SELECT iccid, scanTime, source FROM scans WHERE 1 %(where)s ORDER BY scanTime, iccid',
+                          conditions, parameters)
+
+    def getFiles(self, path, iccid=None, since=None, until=None):
+        # properties of file in each scan
+        conditions, parameters = self.getScanFilter(iccid, since, until)
+        return self.query('SELECT scans.iccid, scans.scanTime, ' + ', '.join(['properties.' + column for key, column in FILE_COLUMNS]) +
+                          ' FROM files JOIN scans ON scans.id = files.scanId JOIN properties ON properties.id = files.propertiesId' +
+                          ' WHERE files.pathId = ? %(where)s ORDER BY scans.scanTime, scans.iccid',
+                          conditions, [self.getStoredPathId(path)] + parameters)
+
+    def getContents(self, path, recNum=None, content=None, iccid=None, since=None, until=None):
+        # content of file (or of one record) in each scan; with content, only
+        # records having that value
+        conditions, parameters = self.getScanFilter(iccid, since, until)
+        if content is not None:
+            content = toHex(fromHex(content))
+            # distinct contents of file are checked first, then scans having one of them
+            contentIds = [str(contentId) for contentId, in self.connection.execute(
+                'SELECT DISTINCT contentId FROM files WHERE pathId = ? AND contentId IS NOT NULL', (self.getStoredPathId(path),))
+                if content in [record for number, record in self.getRecords(contentId) if recNum is None or number == recNum]]
+            conditions.append('files.contentId IN (%s)' % ', '.join(contentIds))
+        scans = self.query('SELECT scans.iccid, scans.scanTime, files.contentId FROM files JOIN scans ON scans.id = files.scanId' +
+                           ' WHERE files.pathId = ? AND files.contentId IS NOT NULL %(where)s ORDER BY scans.scanTime, scans.iccid',
+                           conditions, [self.getStoredPathId(path)] + parameters)
+        rows = []
+        for scan in scans:
+            for number, record in self.getRecords(scan['contentId']):
+                if (recNum is None or number == recNum) and (content is None or record == content):
+                    rows.append({'iccid': scan['iccid'], 'scanTime': scan['scanTime'], 'recNum': number, 'content': record})
+        return rows
+
+    def getVariants(self, path, recNum=None, iccid=None, since=None, until=None):
+        # distinct contents of each record of file (recNum 0 for transparent EF)
+        # with number of scans having it, most common first: every variant but
+        # the first is a different card
+        conditions, parameters = self.getScanFilter(iccid, since, until)
+        counts = {}
+        for row in self.query('SELECT files.contentId, COUNT(*) AS scans FROM files JOIN scans ON scans.id = files.scanId' +
+                              ' WHERE files.pathId = ? AND files.contentId IS NOT NULL %(where)s GROUP BY files.contentId',
+                              conditions, [self.getStoredPathId(path)] + parameters):
+            for number, record in self.getRecords(row['contentId']):
+                if recNum is None or number == recNum:
+                    counts[(number, record)] = counts.get((number, record), 0) + row['scans']
+        variants = [{'recNum': number, 'content': record, 'scans': count} for (number, record), count in counts.items()]
+        return sorted(variants, key=lambda variant: (variant['recNum'], -variant['scans'], variant['content']))
+
+    def getDifferentScans(self, path, recNum=None, iccid=None, since=None, until=None):
+        # scans where content of file (or record) is not the most common one
+        variants = self.getVariants(path, recNum, iccid, since, until)
+        common = {}
+        for variant in variants:
+            common.setdefault(variant['recNum'], variant['content'])
+        return [row for row in self.getContents(path, recNum, None, iccid, since, until)
+                if row['content'] != common.get(row['recNum'])]
+
+
+def printRows(rows, columns):
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join(['' if row[column] is None else str(row[column]) for column in columns]))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('scanStore')
+    parser.add_argument("--db", default='scans.db', help="SQLite database")
+    parser.add_argument("--iccid", help="only scans of this card")
+    parser.add_argument("--since", help="only scans from this date (YYYY-MM-DD[ HH:MM])")
+    parser.add_argument("--until", help="only scans before this date")
+    parser.add_argument("--record", type=int, help="only this record (0 for transparent EF)")
+    subparsers = parser.add_subparsers(dest='command')
+    ingestParser = subparsers.add_parser('ingest', help="store json dumps (or ndjson streams) of files and folders given")
+    ingestParser.add_argument("paths", nargs='+')
+    subparsers.add_parser('scans', help="list stored scans")
+    fileParser = subparsers.add_parser('file', help="properties of file in each scan")
+    fileParser.add_argument("path")
+    contentParser = subparsers.add_parser('content', help="content of file in each scan")
+    contentParser.add_argument("path")
+    contentParser.add_argument("--value", help="only scans where content is this value (hex)")
+    variantsParser = subparsers.add_parser('variants', help="distinct contents of file and number of scans")
+    variantsParser.add_argument("path")
+    differentParser = subparsers.add_parser('different', help="scans where content of file is not the most common one")
+    differentParser.add_argument("path")
+    args = parser.parse_args()
+
+    store = ScanStore(args.db)
+    scanFilter = {'iccid': args.iccid, 'since': args.since, 'until': args.until}
+    if args.command == 'ingest':
+        fileNames = listScanFiles(args.paths)
+        print('%d of %d scan(s) stored' % (store.ingestFiles(fileNames), len(fileNames)))
+    elif args.command == 'scans':
+        printRows(store.getScans(**scanFilter), ['iccid', 'scanTime', 'source'])
+    elif args.command == 'file':
+        printRows(store.getFiles(args.path, **scanFilter), ['iccid', 'scanTime'] + [column for key, column in FILE_COLUMNS])
+    elif args.command == 'content':
+        printRows(store.getContents(args.path, args.record, args.value, **scanFilter), ['iccid', 'scanTime', 'recNum', 'content'])
+    elif args.command == 'variants':
+        printRows(store.getVariants(args.path, args.record, **scanFilter), ['recNum', 'scans', 'content'])
+    elif args.command == 'different':
+        printRows(store.getDifferentScans(args.path, args.record, **scanFilter), ['iccid', 'scanTime', 'recNum', 'content'])
+    store.close()
@@ -0,0 +1,76 @@
+import json
+from timeit import default_timer
+
+
+class NdjsonWriter:
+    # scan output as newline-delimited json: one compact object per file,
+    # written as soon as the file is scanned, and a summary object
+    # ('summary': true) as last line
+
+    FLUSH_FILES = 20 # files written between flushes
+    FLUSH_SECONDS = 1.0 # at the latest
+
+    def __init__(self, fileName, resumeOffset=None):
+        self.fileName = fileName
+        self.fileCount = 0
+        if resumeOffset is None:
+            self.file = open(fileName, 'w')
+        else:
+            # lines written after last checkpoint are dropped, their files are scanned again
+            try:
+                self.file = open(fileName, 'r+')
+            except IOError:
+                self.file = open(fileName, 'w')
+            self.fileCount = self.file.read(resumeOffset).count('\n')
+            self.file.seek(resumeOffset)
+            self.file.truncate()
+        self.pendingFiles = 0
+        self.lastFlush = default_timer()
+
+    def writeLine(self, data):
+        self.file.write(json.dumps(data, sort_keys=True, separators=(',', ':')) + '\n')
+
+    def writeFile(self, fileProperties):
+        self.writeLine(fileProperties.toDict())
+        self.fileCount += 1
+        self.pendingFiles += 1
+        if self.pendingFiles >= self.FLUSH_FILES or default_timer() - self.lastFlush >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pendingFiles = 0
+        self.lastFlush = default_timer()
+
+    def tell(self):
+        # offset after last complete line, e.g. for checkpoint
+        self.flush()
+        return self.file.tell()
+
+    def writeSummary(self, summary):
+        summary = dict(summary)
+        summary['summary'] = True
+        summary['files'] = self.fileCount
+        self.writeLine(summary)
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def readNdjson(fileName):
+    # file records and summary (None if scan did not finish) of a streamed scan
+    fileDetails = []
+    summary = None
+    with open(fileName, 'r') as ndjson_file:
+        for line in ndjson_file:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get('summary'):
+                summary = data
+            else:
+                fileDetails.append(data)
+    return fileDetails, summary
@@ -1,14 +1,39 @@
 from __future__ import print_function
 from smartcard.Exceptions import NoCardException, CardConnectionException
-from smartcard.System import readers
 from smartcard.util import toHexString, toBytes
 import sys
+import os
 import copy
 import logging
 from datetime import datetime
 from xml.dom.minidom import parse
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
 import json
 import ntpath
+import threading
+from timeit import default_timer
+from fileNavigator import FileNavigator, sortDepthFirst
+from scanMetrics import ScanMetrics
+from contentPolicy import ContentPolicy, ContentRule
+from scanDigest import addDigests, addFileDigests, hashText
+import berTlv
+from fileRecord import FileRecord, toDicts, fromDicts
+from scanStream import NdjsonWriter
+from scanReport import formatFileId, swapIccid, writeHtmlReport, writeJsonReport
+from profileCache import ProfileCache, loadJson
+import osLockAudit
+from apduTrace import ApduTrace, PCOM, TRACE_PCOM, TRACE_LEVELS
+
+try:
+    from smartcard.System import readers
+except ImportError:
+    # no PC/SC stack available; only a simulated card backend can be used
+    def readers():
+        return []
 
 logging.basicConfig(level=logging.INFO,
                     format="[%(asctime)s] [%(levelname)s] %(message)s",
@@ -19,10 +44,22 @@ logger = logging.getLogger(__name__)
 class CardScanner:
     connection = None
     verifcodeLogBuffer = None
+    cardBackend = None # reader-like object (e.g. SimulatedReader) used instead of PC/SC reader
 
     # constants
     READ_RECORD_ABSOLUTE = 0x04
-    MAX_RESPONSE_LEN = 250
+    MAX_RESPONSE_LEN = 250 # used when card does not accept Le '00' (256 bytes)
+    MAX_SHORT_LE = 256
+    MAX_EXTENDED_LE = 4096 # unless card tells its limit in EF.ATR
+    MAX_OFFSET_2G = 0xFFFF
+    MAX_OFFSET_3G = 0x7FFF # beyond, odd INS 'B1' with offset data object is used
+    EF_ATR = '3F002F01'
+
+    # per card, reset for each scan
+    shortLe2g = None # None until probed
+    shortLe3g = None
+    extendedLe = 0 # 0 if extended length is not supported
+    selectCache = None # (path, class) -> responses of SELECT and GET RESPONSE; reset at power on
 
     # initialized by constructor
     runAsModule = False
@@ -37,6 +74,20 @@ class CardScanner:
     opt_use_adm3 = False
     opt_use_adm4 = False
     opt_read_content_3g = False
+    opt_unified_scan = False # 2G and 3G in one traversal when card accepts both classes
+    opt_rescan_reference = '' # json dump of a previous scan; only content is read again
+    contentPolicy = None # ContentPolicy; None reads all content
+    opt_content_digest = False # store content digests and card root digest in json dump
+    opt_resume = False # continue interrupted scan from its checkpoint
+    CHECKPOINT_INTERVAL = 25 # files scanned between checkpoints
+    opt_stream = False # write ndjson line per file as soon as it is scanned
+    opt_stream_only = False # ndjson only: no json/html dump, content released once streamed
+    opt_tree_cache = False # reuse file tree discovered on previous card with same ATR and root files
+    TREE_FINGERPRINT_ENTRIES = 3 # read header entries of MF in fingerprint of file tree
+    treeCacheKey = None # set when file tree of current scan comes from cache
+    streamWriter = None
+    communicationError = False # set when connection to card is lost
+    cardAtr = ''
     adm1 = '4331324131364442'
     adm2 = '933F57845F706921'
     adm3 = '933F57845F706921'
@@ -46,17 +97,24 @@ class CardScanner:
 
     destinationFolder = '.'
 
-    pcomOutFile = None
+    apduTrace = None # ApduTrace writing pcom file
+    traceLevel = TRACE_PCOM
     pcomOutFileName = 'script.pcom'
 
     profileBaseName = 'script'
     
     allowReadHeader = False
     auditOsLocks = False
+    osLockBaseline = '' # os locks json of reference card, compared with each audit
+    osLocks = None # lock values (hex) read in current scan
     fileSystemXml = ''
+    fileSystemList = None # parsed fileSystemXml (absolute path -> name); may be shared by several scanners
+    fileSystemListSource = ''
     fileSystemOutJson = ''
+    profileCacheDir = '.profile-cache' # compiled config, settings and file system xml
+    metricsExportDir = '' # json and prometheus metrics of each run are written there, if set
+    profileCache = None
     fileSystemOutHtml = ''
-    htmlFile = None
 
     # APDU params
     verify2gAdm1p1 = 0x00
@@ -121,27 +179,51 @@ class CardScanner:
     verifyPIN3g = [0x00, 0x20, 0x00, 0x00, 0x00]
     readRecord3g = [0x00, 0xB2, 0x00, 0x00, 0x00]
     readBinary3g = [0x00, 0xB0, 0x00, 0x00, 0x00]
+    readBinaryOdd3g = [0x00, 0xB1, 0x00, 0x00, 0x00]
 
     def __init__(self, runAsModule, fullScript):
         self.runAsModule = runAsModule
         self.fullScript = fullScript
+        self.navigator = FileNavigator()
+        self.metrics = ScanMetrics()
+        self.opt_profile_cache = runAsModule # same profile is scanned again and again from VerifClient
+
+    def cloneForReader(self, readerNumber):
+        # same settings and parsed file system, own card session and output files
+        scanner = copy.copy(self)
+        scanner.readerNumber = readerNumber
+        scanner.navigator = FileNavigator()
+        scanner.metrics = ScanMetrics()
+        scanner.connection = None
+        scanner.apduTrace = None
+        scanner.streamWriter = None
+        pcomBaseName, pcomExtension = os.path.splitext(self.pcomOutFileName)
+        scanner.pcomOutFileName = '%s_reader%d%s' % (pcomBaseName, readerNumber, pcomExtension)
+        return scanner
+
+    def getProfileCache(self, required=False):
+        # None when disabled (unless required); created once and shared with clones of this scanner
+        if not self.opt_profile_cache and not required:
+            return None
+        if self.profileCache is None:
+            self.profileCache = ProfileCache(self.profileCacheDir)
+        return self.profileCache
+
+    def loadFileSystem(self):
+        # parse file system xml only once for all scans using it
+        if self.fileSystemList is not None and self.fileSystemListSource == self.fileSystemXml:
+            return True, 'file system already loaded'
+        if self.getProfileCache() is not None:
+            parseFileSystemOk, parseFileSystemMsg, fileSystemList = self.getProfileCache().load('fileSystem/1', self.fileSystemXml, self.parseFileSystemXml)
+        else:
+            parseFileSystemOk, parseFileSystemMsg, fileSystemList = self.parseFileSystemXml(self.fileSystemXml)
+        if parseFileSystemOk:
+            self.fileSystemList = fileSystemList
+            self.fileSystemListSource = self.fileSystemXml
+        return parseFileSystemOk, parseFileSystemMsg
 
     def formatFileId(self, fileId):
-        if len(fileId) == 4:
-            formatted = fileId
-            return formatted
-        if len(fileId) == 8:
-            formatted = fileId[:4] + '/' + fileId[4:]
-            return formatted
-        if len(fileId) == 12:
-            formatted = fileId[:4] + '/' + fileId[4:8] + '/' + fileId[8:]
-            return formatted
-        if len(fileId) == 16:
-            formatted = fileId[:4] + '/' + fileId[4:8] + '/' + fileId[8:12] + '/' + fileId[12:]
-            return formatted
-        if len(fileId) == 20:
-            formatted = fileId[:4] + '/' + fileId[4:8] + '/' + fileId[8:12] + '/' + fileId[12:16] + '/' + fileId[16:]
-            return formatted
+        return formatFileId(fileId)
 
     def filterHex(self, hexString):
         temp = ''
@@ -174,16 +256,23 @@ class CardScanner:
         return result
 
     def initSCard(self):
-        if len(readers()) == 0:
-            logger.error('No smartcard reader(s) detected.')
-            return -1
-        reader = readers()[self.readerNumber]
+        if self.cardBackend is not None:
+            reader = self.cardBackend
+        else:
+            if len(readers()) == 0:
+                logger.error('No smartcard reader(s) detected.')
+                return -1
+            reader = readers()[self.readerNumber]
         try:
             self.connection = reader.createConnection()
             self.connection.connect()
-            logger.info('%s; ATR: %s' % (reader, toHexString(self.connection.getATR())))
-            self.pcomOutFile.writelines("\n.POWER_ON")
-            self.pcomOutFile.writelines('\n')
+            self.communicationError = False
+            # MF is implicitly selected after ATR
+            self.navigator.reset('3F00')
+            self.selectCache = {}
+            self.cardAtr = toHexString(self.connection.getATR())
+            logger.info('%s; ATR: %s' % (reader, self.cardAtr))
+            self.apduTrace.write('\n.POWER_ON\n')
             return 0
         except NoCardException:
             logger.error('Error initializing card; may be wrong reader or card not inserted.')
@@ -196,34 +285,29 @@ class CardScanner:
             if type(apduData) == str:
                 apduData = self.hexStringToBytes(apduData)
             apdu = apduHeader
-            pcomOutString = toHexString(apdu).replace(' ', '')
             if apduData:
                 apdu = apdu + apduData
-                pcomOutString = pcomOutString + ' ' + toHexString(apduData).replace(' ', '')
             
             if apduHeader[1] == 0x20:
-                apduString = toHexString(apduHeader) + ' ' + self.filterHex(toHexString(apduData))
-                self.verifcodeLogBuffer['apdu_string'] = apduString
+                # formatted only when logged
+                self.verifcodeLogBuffer['apdu'] = (apduHeader, apduData)
             
             if print2screen:
                 print('Command: ' + toHexString(apdu))
             
+            startTime = default_timer()
             response, sw1, sw2 = self.connection.transmit(apdu)
+            self.metrics.countApdu(len(apdu), len(response) + 2, apduHeader[1], default_timer() - startTime)
             
             if apduHeader[1] == 0x20:
                 self.verifcodeLogBuffer['status_word'] = '%.2X %.2X' % (sw1, sw2)
                 if not (sw1 == 0x90 and sw2 == 0x00):
                     self.verifcodeLogBuffer['verifcode_success'] = False
 
-            if response:
-                pcomOutString = pcomOutString + ' [' + toHexString(response).replace(' ', '') + ']'
-                if print2screen:
-                    print('Output : ' + toHexString(response))
+            if response and print2screen:
+                print('Output : ' + toHexString(response))
             
-            pcomOutString = pcomOutString + ' (%.2X%.2X)' % (sw1, sw2)
-            if out2Pcom:
-                self.pcomOutFile.writelines(pcomOutString)
-                self.pcomOutFile.writelines('\n')
+            self.apduTrace.apdu(apduHeader, apduData, response, sw1, sw2, PCOM if out2Pcom else 0)
 
             if print2screen:
                 print('Status : %.2X %.2X' % (sw1, sw2))
@@ -231,6 +315,7 @@ class CardScanner:
             return response, sw1, sw2
         
         except CardConnectionException:
+            self.communicationError = True
             return -1, 'A communications error with the smart card has been detected', None
 
     def cmdReadHeader(self, number, readMode):
@@ -241,13 +326,20 @@ class CardScanner:
         return response, sw1, sw2
 
     def countLockBuffer(self):
-        lockOffsetCount = 0
-        while lockOffsetCount < 256:
-            sw1, sw2 = self.cmdReadOsLock(lockOffsetCount, False)
-            if not (sw1 == 0x90 and sw2 == 0x00):
+        # every offset below buffer size can be read: first failing offset is
+        # found by binary search (9 APDUs instead of one per lock)
+        lowOffset = 0 # offsets below are readable
+        highOffset = osLockAudit.MAX_OS_LOCKS # offsets from there fail
+        while lowOffset < highOffset:
+            offset = (lowOffset + highOffset) / 2
+            response, sw1, sw2 = self.cmdReadOsLock(offset, False)
+            if response == -1:
                 break
-            lockOffsetCount += 1
-        return lockOffsetCount
+            if sw1 == 0x90 and sw2 == 0x00:
+                lowOffset = offset + 1
+            else:
+                highOffset = offset
+        return lowOffset
 
     def cmdReadOsLock(self, offset, printMode):
         apduHeader = copy.deepcopy(self.readOsLock)
@@ -256,88 +348,166 @@ class CardScanner:
             response, sw1, sw2 = self.sendApdu(apduHeader, None, out2Pcom=True)
         else:
             response, sw1, sw2 = self.sendApdu(apduHeader, None, out2Pcom=False)
-        return sw1, sw2
+        return response, sw1, sw2
+
+    def auditOsLockBuffer(self):
+        # read OS locks in current 2G session and keep their values; compared
+        # with baseline if any
+        logger.info('Reading OS locks')
+        self.apduTrace.write('; OS locks\n')
+        osLockBufferCount = self.countLockBuffer()
+        if self.communicationError:
+            return
+        osLocks = []
+        for lockOffset in range(osLockBufferCount):
+            response, sw1, sw2 = self.cmdReadOsLock(lockOffset, True)
+            if response == -1:
+                return
+            osLocks.append(toHexString(response).replace(' ', ''))
+        self.osLocks = osLocks
+        baseline = self.loadOsLockBaseline()
+        if baseline is not None:
+            for difference in osLockAudit.diffOsLocks(baseline, osLocks):
+                logger.warning('OS lock differs from baseline, ' + osLockAudit.formatDifference(difference))
+
+    def loadOsLockBaseline(self):
+        if not self.osLockBaseline:
+            return None
+        try:
+            return osLockAudit.loadOsLocks(self.osLockBaseline)
+        except (IOError, ValueError, KeyError), e:
+            logger.error('Unable to load OS lock baseline: ' + str(e))
+            return None
+
+    def getOsLocksFileName(self):
+        return os.path.join(self.destinationFolder, os.path.splitext(self.pcomOutFileName)[0] + '.oslocks.json')
+
+    def dumpOsLocks(self):
+        baseline = self.loadOsLockBaseline()
+        with open(self.getOsLocksFileName(), 'w') as json_file:
+            json.dump(osLockAudit.getAuditReport(self.cardAtr, self.osLocks, baseline, self.osLockBaseline), json_file, indent=2)
+
+    def selectSucceeded(self, sw1):
+        # 2G SELECT returns 9Fxx, 3G SELECT returns 61xx (or 9000)
+        return sw1 in (0x90, 0x91, 0x9F, 0x61, 0x62)
+
+    def selectPath(self, selectHeader, path, print2screen=False, out2Pcom=True):
+        # send only the SELECTs needed to reach path from currently selected DF;
+        # returns response of the last SELECT and whether it has been sent
+        sequence = self.navigator.getSelectSequence(path, out2Pcom)
+        for fileId in sequence[:-1]:
+            response, sw1, sw2 = self.sendApdu(selectHeader, fileId, print2screen=print2screen, out2Pcom=out2Pcom)
+            if response == -1 or not self.selectSucceeded(sw1):
+                self.navigator.selectFailed(path, False, out2Pcom)
+                return response, sw1, sw2, False
+        response, sw1, sw2 = self.sendApdu(selectHeader, sequence[-1], print2screen=print2screen, out2Pcom=out2Pcom)
+        return response, sw1, sw2, True
 
     def cmdSelect2g(self, path, print2screen=False, out2Pcom=True):
         path = self.filterHex(path)
-        i = 0
-        while i < (len(path) - 4):
-            if not print2screen:
-                if out2Pcom:
-                    self.sendApdu(self.select2g, path[i:i + 4])
-                else:
-                    self.sendApdu(self.select2g, path[i:i + 4], out2Pcom=False)
-            else:
-                self.sendApdu(self.select2g, path[i:i + 4], print2screen=True)
-            i += 4
+        response, sw1, sw2, targetSent = self.selectPath(self.select2g, path, print2screen, out2Pcom) # shall return 9fxx
+        if response == -1 or not targetSent or (sw1 == 0x94 and sw2 == 0x04):
+            self.navigator.selectFailed(path, targetSent, out2Pcom)
+            return response, sw1, sw2
+        selSW1, selSW2 = sw1, sw2
         getResponse2g = copy.deepcopy(self.getResponse2g)
-        if not print2screen:
-            if out2Pcom:
-                response, sw1, sw2 = self.sendApdu(self.select2g, path[i:]) # shall return 9fxx
-            else:
-                response, sw1, sw2 = self.sendApdu(self.select2g, path[i:], out2Pcom=False) # shall return 9fxx
-            if sw1 == 0x94 and sw2 == 0x04:
-                return response, sw1, sw2
-            getResponse2g[4] = sw2
-            if out2Pcom:
-                response, sw1, sw2 = self.sendApdu(getResponse2g, None)
-            else:
-                response, sw1, sw2 = self.sendApdu(getResponse2g, None, out2Pcom=False)
+        getResponse2g[4] = sw2
+        response, sw1, sw2 = self.sendApdu(getResponse2g, None, print2screen=print2screen, out2Pcom=out2Pcom)
+        if response != -1 and sw1 == 0x90 and len(response) > 6:
+            # byte 7 of 2G response is type of file
+            self.navigator.selected(path, response[6] in (0x01, 0x02), out2Pcom)
+            if not out2Pcom:
+                self.cacheSelect2g(path, selSW1, selSW2, (response, sw1, sw2))
         else:
-            response, sw1, sw2 = self.sendApdu(self.select2g, path[i:], print2screen=True) # shall return 9fxx
-            getResponse2g[4] = sw2
-            response, sw1, sw2 = self.sendApdu(getResponse2g, None, print2screen=True)
+            self.navigator.selectFailed(path, True, out2Pcom)
         return response, sw1, sw2
 
+    def cacheSelect2g(self, path, selSW1, selSW2, getResponse=None):
+        # responses to hidden SELECTs (e.g. during read header), reused by replaySelect2g();
+        # a DF entered without GET RESPONSE can still be replayed on the way to its files
+        key = (path, self.select2g[0])
+        if getResponse is None and key in self.selectCache:
+            return
+        self.selectCache[key] = (selSW1, selSW2, getResponse)
+
+    def replaySelect2g(self, path):
+        # write SELECTs of path and its GET RESPONSE to pcom as answered in this
+        # session, without sending them: the card stays where it is and is moved
+        # by the next SELECT sent. only done when nothing is read from the file in
+        # 2G mode; returns None when path has to be selected in card
+        entry = self.selectCache.get((path, self.select2g[0]))
+        if entry is None or entry[2] is None:
+            return None
+        response, sw1, sw2 = entry[2]
+        if response[6] == 0x04 and (len(response) < 15 or self.readsContent2g(response)):
+            return None
+
+        # each file ID of script sequence leads to a prefix of path
+        sequence = self.navigator.getScriptSelectSequence(path)
+        selects = []
+        for i in range(len(sequence)):
+            prefixEntry = self.selectCache.get((path[:len(path) - 4 * (len(sequence) - 1 - i)], self.select2g[0]))
+            if prefixEntry is None:
+                return None
+            selects.append((sequence[i], prefixEntry[0], prefixEntry[1]))
+
+        for fileId, selSW1, selSW2 in selects:
+            self.apduTrace.apdu(self.select2g, self.hexStringToBytes(fileId), None, selSW1, selSW2, PCOM)
+        getResponse2g = copy.deepcopy(self.getResponse2g)
+        getResponse2g[4] = entry[1]
+        self.apduTrace.apdu(getResponse2g, None, response, sw1, sw2, PCOM)
+        self.navigator.scriptSelected(path, response[6] in (0x01, 0x02))
+        self.metrics.replayedApdus += len(selects) + 1
+        return response, sw1, sw2
+
+    def readsContent2g(self, response):
+        # whether content of EF with given 2G response is read in 2G mode
+        if self.opt_read_content_3g:
+            return False
+        fileSize = response[2] * 0x100 + response[3]
+        return not (response[13] == 0x00 and fileSize > self.MAX_OFFSET_2G + 1)
+
     def cmdSelect3g(self, path, print2screen=False):
         path = self.filterHex(path)
-        i = 0
-        while i < (len(path) - 4):
-            if not print2screen:
-                self.sendApdu(self.select3g, path[i:i + 4])
-            else:
-                self.sendApdu(self.select3g, path[i:i + 4], print2screen=True)
-            i += 4
+        response, sw1, sw2, targetSent = self.selectPath(self.select3g, path, print2screen) # shall return 61xx
+        if response == -1 or not targetSent:
+            self.navigator.selectFailed(path, targetSent)
+            return response, sw1, sw2
         getResponse3g = copy.deepcopy(self.getResponse3g)
-        if not print2screen:
-            response, sw1, sw2 = self.sendApdu(self.select3g, path[i:]) # shall return 61xx
-            getResponse3g[4] = sw2
-            response, sw1, sw2 = self.sendApdu(getResponse3g, None)
+        getResponse3g[4] = sw2
+        response, sw1, sw2 = self.sendApdu(getResponse3g, None, print2screen=print2screen)
+        if response != -1 and sw1 == 0x90 and response:
+            self.navigator.selected(path, self.isDfFcp(response))
         else:
-            response, sw1, sw2 = self.sendApdu(self.select3g, path[i:], print2screen=True) # shall return 61xx
-            getResponse3g[4] = sw2
-            response, sw1, sw2 = self.sendApdu(getResponse3g, None, print2screen=True)
+            self.navigator.selectFailed(path, True)
         return response, sw1, sw2
 
+    def supportsBothClasses(self):
+        # some cards fix the command class with the first command after ATR;
+        # both classes are usable if MF can be selected with each of them
+        response, sw1, sw2 = self.sendApdu(self.select3g, '3F00', out2Pcom=False)
+        if response == -1 or not sw1 in (0x61, 0x90):
+            return False
+        self.navigator.setCurrentDf('3F00')
+        response, sw1, sw2 = self.sendApdu(self.select2g, '3F00', out2Pcom=False)
+        if response != -1 and sw1 == 0x9F:
+            return True
+        # card has switched to 3G mode; start 2G session again
+        self.initSCard()
+        if self.fullScript:
+            self.pinVerification2g()
+        return False
+
+    def isDfFcp(self, response):
+        # PIN status template DO (tag 'C6') is mandatory for MF/DF only
+        fcp = berTlv.parseFcp(response)
+        return fcp is not None and berTlv.PIN_STATUS_TEMPLATE in fcp
+
     def getValueByTag(self, tag, tlvObject):
-        for byte in tlvObject:
-            index = tlvObject.index(byte)
-            if byte == tag:
-                index += 1
-                length = tlvObject[index]
-                index += 1
-                value = tlvObject[index:index+length]
-                break
-        return value
+        return berTlv.getValueByTag(tag, tlvObject)
 
     def getTlvObjects(self, tlvBytes):
-        tlvList = []
-        tracker = 0
-        for idx, byte in enumerate(tlvBytes):
-            if idx < tracker:
-                continue
-            index = idx
-            index += 1
-            length = tlvBytes[index]
-            index += 1
-            tlvObject = [byte, length]
-            tlvEnd = index + length
-            value = tlvBytes[index:tlvEnd]
-            for i in value:
-                tlvObject.append(i)
-            tlvList.append(tlvObject)
-            tracker = tlvEnd
-        return tlvList
+        return berTlv.getTlvObjects(tlvBytes)
 
     def cmdReadRecord2g(self, recNumber, mode, recSize, print2screen=False):
         header = copy.deepcopy(self.readRecord2g)
@@ -350,10 +520,13 @@ class CardScanner:
             response, sw1, sw2 = self.sendApdu(header, None, print2screen=True)
         return response, sw1, sw2
 
-    def cmdReadRecord3g(self, recNumber, mode, recSize, print2screen=False):
+    def cmdReadRecord3g(self, recNumber, mode, recSize, print2screen=False, sfi=None):
         header = copy.deepcopy(self.readRecord3g)
         header[2] = recNumber % 0x100
         header[3] = mode % 0x100
+        if sfi is not None:
+            # short file identifier in b8-b4 of P2; EF needs not be selected
+            header[3] += (sfi & 0x1F) << 3
         header[4] = recSize % 0x100
         if not print2screen:
             response, sw1, sw2 = self.sendApdu(header, None)
@@ -361,30 +534,248 @@ class CardScanner:
             response, sw1, sw2 = self.sendApdu(header, None, print2screen=True)
         return response, sw1, sw2
 
-    def cmdReadBinary2g(self, offset, length, print2screen=False):
+    def cmdReadBinary2g(self, offset, length, print2screen=False, out2Pcom=True):
         header = copy.deepcopy(self.readBinary2g)
-        # make sure offset is not longer than 64K-1
-        header[2] = ((int(offset) % 0x10000) >> 8)
-        header[3] = (int(offset) % 0x10000) & 0x00FF
-        # make sure length is not longer than 255
+        header[2] = (int(offset) >> 8) & 0xFF
+        header[3] = int(offset) & 0xFF
+        # length 256 is coded '00'
         header[4] = int(length) % 0x100
-        if not print2screen:
-            response, sw1, sw2 = self.sendApdu(header, None)
-        else:
-            response, sw1, sw2 = self.sendApdu(header, None, print2screen=True)
+        response, sw1, sw2 = self.sendApdu(header, None, print2screen=print2screen, out2Pcom=out2Pcom)
         return response, sw1, sw2
 
-    def cmdReadBinary3g(self, offset, length, print2screen=False):
+    def cmdReadBinary3g(self, offset, length, print2screen=False, out2Pcom=True, sfi=None):
+        if offset > self.MAX_OFFSET_3G:
+            return self.cmdReadBinaryOdd3g(offset, length, print2screen, out2Pcom)
         header = copy.deepcopy(self.readBinary3g)
-        header[2] = ((int(offset) % 0x10000) >> 8)
-        header[3] = (int(offset) % 0x10000) & 0x00FF
-        header[4] = int(length) % 0x100
-        if not print2screen:
-            response, sw1, sw2 = self.sendApdu(header, None)
+        if sfi is not None:
+            # short file identifier in P1 (b8 set), offset up to 255 in P2; EF needs not be selected
+            header[2] = 0x80 + (sfi & 0x1F)
         else:
-            response, sw1, sw2 = self.sendApdu(header, None, print2screen=True)
+            header[2] = (int(offset) >> 8) & 0x7F # b8 of P1 would indicate SFI
+        header[3] = int(offset) & 0xFF
+        if length > self.MAX_SHORT_LE:
+            # extended Le: '00' followed by 2 bytes length
+            header[4] = 0x00
+            header += [(int(length) >> 8) & 0xFF, int(length) & 0xFF]
+        else:
+            header[4] = int(length) % 0x100
+        response, sw1, sw2 = self.sendApdu(header, None, print2screen=print2screen, out2Pcom=out2Pcom)
+        return response, sw1, sw2
+
+    def cmdReadBinaryOdd3g(self, offset, length, print2screen=False, out2Pcom=True):
+        # READ BINARY with odd INS (ISO 7816-4): offset data object '54' in command data,
+        # content returned in discretionary data object '53'; file is current EF (P1-P2 = '0000')
+        offsetBytes = [(int(offset) >> 16) & 0xFF, (int(offset) >> 8) & 0xFF, int(offset) & 0xFF]
+        header = copy.deepcopy(self.readBinaryOdd3g)
+        header[4] = 2 + len(offsetBytes)
+        # response is '53' + length (up to 3 bytes) + content; card returns what fits in Le
+        expectedLen = length + 4
+        if expectedLen > self.MAX_SHORT_LE and not self.extendedLe:
+            expectedLen = self.MAX_SHORT_LE
+        if expectedLen > self.MAX_SHORT_LE:
+            apduData = [0x54, len(offsetBytes)] + offsetBytes + [(expectedLen >> 8) & 0xFF, expectedLen & 0xFF]
+            header[4] = 0x00
+            header += [0x00, 2 + len(offsetBytes)]
+        else:
+            apduData = [0x54, len(offsetBytes)] + offsetBytes + [expectedLen % 0x100]
+        response, sw1, sw2 = self.sendApdu(header, apduData, print2screen=print2screen, out2Pcom=out2Pcom)
+        if response != -1 and sw1 == 0x61:
+            getResponse3g = copy.deepcopy(self.getResponse3g)
+            getResponse3g[4] = sw2
+            response, sw1, sw2 = self.sendApdu(getResponse3g, None, print2screen=print2screen, out2Pcom=out2Pcom)
+        if response != -1 and response:
+            try:
+                response = berTlv.TlvIndex(response).value(0x53, [])
+            except berTlv.TlvError:
+                response = []
         return response, sw1, sw2
 
+    def resetReadCapabilities(self):
+        # read chunk sizes are probed again for each card
+        self.shortLe2g = None
+        self.shortLe3g = None
+        self.extendedLe = 0
+        if self.connection is not None and self.parseCardCapabilities(self.getHistoricalBytes(self.connection.getATR()), True):
+            self.extendedLe = self.MAX_EXTENDED_LE
+
+    def getHistoricalBytes(self, atr):
+        # skip interface bytes (ISO 7816-3); T0 low nibble gives number of historical bytes
+        if len(atr) < 2:
+            return []
+        numberOfHistoricalBytes = atr[1] & 0x0F
+        index = 1
+        while True:
+            indicator = atr[index]
+            index += 1
+            for bit in (0x10, 0x20, 0x40):
+                if indicator & bit:
+                    index += 1
+            if not indicator & 0x80:
+                break
+            # TDi is next indicator
+            if index >= len(atr):
+                return []
+        return list(atr[index:index + numberOfHistoricalBytes])
+
+    def parseCardCapabilities(self, data, compact):
+        # look for card capabilities (compact-TLV '73' in historical bytes, BER-TLV '47'
+        # in EF.ATR); third software function byte, b7: extended Lc and Le fields supported
+        if compact:
+            if not data or data[0] not in (0x00, 0x80):
+                return False
+            index = 1
+            while index < len(data):
+                tag = data[index] >> 4
+                length = data[index] & 0x0F
+                if tag == 0x07 and length >= 3:
+                    return (data[index + 3] & 0x40) == 0x40
+                index += 1 + length
+            return False
+        try:
+            return (berTlv.TlvIndex(data).byte(0x47, 2, 0x00) & 0x40) == 0x40
+        except berTlv.TlvError:
+            return False
+
+    def getMaxExtendedLe(self, data):
+        # '7F66' extended length information: '02' max command length, '02' max response length
+        try:
+            info = berTlv.TlvIndex(data).child(0x7F66)
+            if info is not None and len(info.objects) == 2 and info.objects[1][0] == 0x02:
+                tag, valueStart, valueEnd = info.objects[1]
+                maxLe = 0
+                for byte in data[valueStart:valueEnd]:
+                    maxLe = (maxLe << 8) + byte
+                return maxLe - 2 # room for status word
+        except berTlv.TlvError:
+            pass
+        return self.MAX_EXTENDED_LE
+
+    def updateCardCapabilities(self, efAtrContent):
+        # EF.ATR may advertise extended length when ATR does not; content is either
+        # historical bytes (compact-TLV) or BER-TLV objects
+        if self.extendedLe:
+            return
+        if not self.parseCardCapabilities(efAtrContent, True) and not self.parseCardCapabilities(efAtrContent, False):
+            return
+        self.extendedLe = min(self.getMaxExtendedLe(efAtrContent), 0xFFFF)
+        logger.info('Extended length supported (EF.ATR); reading up to %d bytes per command' % self.extendedLe)
+
+    def probeShortLe(self, is3g, sfi=None):
+        # Le '00' (256 bytes) on a file of at least 256 bytes; not written to pcom
+        if is3g:
+            response, sw1, sw2 = self.cmdReadBinary3g(0, self.MAX_SHORT_LE, out2Pcom=False, sfi=sfi)
+        else:
+            response, sw1, sw2 = self.cmdReadBinary2g(0, self.MAX_SHORT_LE, out2Pcom=False)
+        if response != -1 and sw1 == 0x90 and len(response) == self.MAX_SHORT_LE:
+            return self.MAX_SHORT_LE
+        return self.MAX_RESPONSE_LEN
+
+    def getReadChunkLen(self, fileSize, is3g, sfi=None):
+        if is3g:
+            if self.extendedLe:
+                return self.extendedLe
+            if self.shortLe3g is None and fileSize >= self.MAX_SHORT_LE:
+                self.shortLe3g = self.probeShortLe(True, sfi)
+            return self.shortLe3g or self.MAX_RESPONSE_LEN
+        if self.shortLe2g is None and fileSize >= self.MAX_SHORT_LE:
+            self.shortLe2g = self.probeShortLe(False)
+        return self.shortLe2g or self.MAX_RESPONSE_LEN
+
+    def readTransparent(self, fileSize, is3g, sfi=None, stopOnError=False):
+        # read transparent EF in as few commands as card allows; returns content,
+        # whether all of it could be read and status word of last failed command;
+        # content is -1 on reader communication error (sw1 contains the error).
+        # with sfi (3G), first READ BINARY also selects the EF
+        content = []
+        readableContent = True
+        errorSw1, errorSw2 = 0x90, 0x00
+        if not isinstance(fileSize, (int, long)):
+            return content, False, errorSw1, errorSw2
+        index = 0
+        while index < fileSize:
+            chunkLen = min(self.getReadChunkLen(fileSize, is3g, sfi), fileSize - index)
+            if is3g and sfi is not None and index == 0:
+                response, sw1, sw2 = self.cmdReadBinary3g(index, chunkLen, sfi=sfi)
+            elif is3g:
+                response, sw1, sw2 = self.cmdReadBinary3g(index, chunkLen)
+            else:
+                response, sw1, sw2 = self.cmdReadBinary2g(index, chunkLen)
+            if response == -1: # possible due to reader communication error
+                return -1, False, sw1, sw2
+            if is3g and chunkLen > self.MAX_SHORT_LE and sw1 in (0x67, 0x6C):
+                # extended length refused; go on with short Le
+                logger.info('Extended length refused (%.2X %.2X); using short Le' % (sw1, sw2))
+                self.extendedLe = 0
+                continue
+            if not (sw1 == 0x90 and sw2 == 0x00):
+                # EF may be invalidated and not readable
+                readableContent = False
+                errorSw1, errorSw2 = sw1, sw2
+                if stopOnError or (index == 0 and sfi is not None):
+                    break # EF not reached by SFI; following offsets would address another file
+            content += response
+            if index > self.MAX_OFFSET_3G and response:
+                # odd INS: card decides how much fits in response
+                index += len(response)
+            else:
+                index += chunkLen
+        return content, readableContent, errorSw1, errorSw2
+
+    def readRecords(self, numberOfRecord, recordSize, is3g, sfi=None, stopOnError=False):
+        # same return values as readTransparent(), content being list of records
+        recordList = []
+        readableContent = True
+        errorSw1, errorSw2 = 0x90, 0x00
+        for i in range(numberOfRecord):
+            if is3g:
+                response, sw1, sw2 = self.cmdReadRecord3g(i+1, self.READ_RECORD_ABSOLUTE, recordSize, sfi=sfi)
+            else:
+                response, sw1, sw2 = self.cmdReadRecord2g(i+1, self.READ_RECORD_ABSOLUTE, recordSize)
+            if response == -1: # possible due to reader communication error
+                return -1, False, sw1, sw2
+            if not (sw1 == 0x90 and sw2 == 0x00):
+                # EF may be invalidated and not readable
+                readableContent = False
+                errorSw1, errorSw2 = sw1, sw2
+                if stopOnError:
+                    break
+            recordList.append(response)
+        return recordList, readableContent, errorSw1, errorSw2
+
+    def getContentRule(self, ef):
+        if self.contentPolicy is None:
+            return ContentRule()
+        return self.contentPolicy.getRule(ef)
+
+    def readContent(self, ef, fileProperties, is3g, sfi=None):
+        # read content of current EF as allowed by content policy; content is None
+        # when policy asks for metadata only, -1 on reader communication error
+        rule = self.getContentRule(ef)
+        if not rule.readContent:
+            return None, False, 0x90, 0x00
+        if fileProperties['fileStructure'] == 'transparent':
+            content, readableContent, sw1, sw2 = self.readTransparent(rule.getReadLength(fileProperties['fileSize']), is3g, sfi, rule.stopOnError)
+            if content == -1:
+                return content, readableContent, sw1, sw2
+            if readableContent and ef == self.EF_ATR:
+                self.updateCardCapabilities(content)
+            return content, readableContent, sw1, sw2
+        numberOfRecord = rule.getNumberOfRecord(fileProperties['numberOfRecord'], fileProperties['fileRecordSize'])
+        return self.readRecords(numberOfRecord, fileProperties['fileRecordSize'], is3g, sfi, rule.stopOnError)
+
+    def storeContent(self, fileProperties, content):
+        # raw content into FileRecord; content read in first pass is kept
+        if 'fileContent' in fileProperties:
+            return
+        if fileProperties['fileStructure'] == 'transparent':
+            fileProperties.setContent(content)
+            truncated = isinstance(fileProperties['fileSize'], (int, long)) and len(content) < fileProperties['fileSize']
+        else:
+            fileProperties.setRecords(content)
+            truncated = len(content) < fileProperties['numberOfRecord']
+        if truncated:
+            fileProperties['contentTruncated'] = True
+
     def booleanStrToInt(self, booleanStr):
         if str(booleanStr) == 'true':
             return 1
@@ -393,32 +784,43 @@ class CardScanner:
 
     def parseConfigXml(self):
         config_file = 'config.xml'
+        if self.getProfileCache() is not None:
+            parseConfigOk, parseConfigMsg, settings = self.getProfileCache().load('config/1', config_file, self.compileConfigXml)
+        else:
+            parseConfigOk, parseConfigMsg, settings = self.compileConfigXml(config_file)
+        for name, value in settings.items():
+            setattr(self, name, value)
+        return parseConfigOk, parseConfigMsg
+
+    def compileConfigXml(self, config_file):
+        # scanner attributes set by config.xml
+        settings = {}
         try:
             DOMTree = parse(config_file)
         except IOError, e:
-            return False, 'Error parsing config.xml: ' + str(e.strerror)
+            return False, 'Error parsing config.xml: ' + str(e.strerror), settings
         
         verifConfig = DOMTree.documentElement
 
-        self.readerNumber = int(verifConfig.getElementsByTagName('readerNumber')[0].childNodes[0].data)
-        if self.readerNumber == -1:
-            return False, 'no terminal/reader detected'
+        settings['readerNumber'] = int(verifConfig.getElementsByTagName('readerNumber')[0].childNodes[0].data)
+        if settings['readerNumber'] == -1:
+            return False, 'no terminal/reader detected', settings
         else:
-            self.opt_chv1_disabled = self.booleanStrToInt(verifConfig.getAttribute('chv1Disabled'))
-            self.opt_use_adm2 = self.booleanStrToInt(verifConfig.getAttribute('useAdm2'))
-            self.opt_use_adm3 = self.booleanStrToInt(verifConfig.getAttribute('useAdm3'))
-            self.opt_use_adm4 = self.booleanStrToInt(verifConfig.getAttribute('useAdm4'))
-            self.opt_read_content_3g = self.booleanStrToInt(verifConfig.getAttribute('usimIn3GMode'))
-
-        self.adm1 = str(verifConfig.getElementsByTagName('codeAdm1')[0].childNodes[0].data)
-        if self.opt_use_adm2:
-            self.adm2 = str(verifConfig.getElementsByTagName('codeAdm2')[0].childNodes[0].data)
-        if self.opt_use_adm3:
-            self.adm3 = str(verifConfig.getElementsByTagName('codeAdm3')[0].childNodes[0].data)
-        if self.opt_use_adm4:
-            self.adm4 = str(verifConfig.getElementsByTagName('codeAdm4')[0].childNodes[0].data)
-        self.chv1 = str(verifConfig.getElementsByTagName('codeChv1')[0].childNodes[0].data)
-        self.chv2 = str(verifConfig.getElementsByTagName('codeChv2')[0].childNodes[0].data)
+            settings['opt_chv1_disabled'] = self.booleanStrToInt(verifConfig.getAttribute('chv1Disabled'))
+            settings['opt_use_adm2'] = self.booleanStrToInt(verifConfig.getAttribute('useAdm2'))
+            settings['opt_use_adm3'] = self.booleanStrToInt(verifConfig.getAttribute('useAdm3'))
+            settings['opt_use_adm4'] = self.booleanStrToInt(verifConfig.getAttribute('useAdm4'))
+            settings['opt_read_content_3g'] = self.booleanStrToInt(verifConfig.getAttribute('usimIn3GMode'))
+
+        settings['adm1'] = str(verifConfig.getElementsByTagName('codeAdm1')[0].childNodes[0].data)
+        if settings['opt_use_adm2']:
+            settings['adm2'] = str(verifConfig.getElementsByTagName('codeAdm2')[0].childNodes[0].data)
+        if settings['opt_use_adm3']:
+            settings['adm3'] = str(verifConfig.getElementsByTagName('codeAdm3')[0].childNodes[0].data)
+        if settings['opt_use_adm4']:
+            settings['adm4'] = str(verifConfig.getElementsByTagName('codeAdm4')[0].childNodes[0].data)
+        settings['chv1'] = str(verifConfig.getElementsByTagName('codeChv1')[0].childNodes[0].data)
+        settings['chv2'] = str(verifConfig.getElementsByTagName('codeChv2')[0].childNodes[0].data)
 
         customApdu = verifConfig.getElementsByTagName('customApdu')[0]
         customVerify2g = customApdu.getElementsByTagName('verify2g')[0]
@@ -438,62 +840,65 @@ class CardScanner:
         customVerify3gGlobalPin1 = customVerify3g.getElementsByTagName('verify3gGlobalPin1')[0]
         customVerify3gLocalPin1 = customVerify3g.getElementsByTagName('verify3gLocalPin1')[0]
 
-        self.verify2gAdm1p1 = int(customVerify2gAdm1.getAttribute('p1'), 16)
-        self.verify2gAdm1p2 = int(customVerify2gAdm1.getAttribute('p2'), 16)
-        self.verify2gAdm1p3 = int(customVerify2gAdm1.getAttribute('p3'), 16)
+        settings['verify2gAdm1p1'] = int(customVerify2gAdm1.getAttribute('p1'), 16)
+        settings['verify2gAdm1p2'] = int(customVerify2gAdm1.getAttribute('p2'), 16)
+        settings['verify2gAdm1p3'] = int(customVerify2gAdm1.getAttribute('p3'), 16)
 
-        self.verify2gAdm2p1 = int(customVerify2gAdm2.getAttribute('p1'), 16)
-        self.verify2gAdm2p2 = int(customVerify2gAdm2.getAttribute('p2'), 16)
-        self.verify2gAdm2p3 = int(customVerify2gAdm2.getAttribute('p3'), 16)
+        settings['verify2gAdm2p1'] = int(customVerify2gAdm2.getAttribute('p1'), 16)
+        settings['verify2gAdm2p2'] = int(customVerify2gAdm2.getAttribute('p2'), 16)
+        settings['verify2gAdm2p3'] = int(customVerify2gAdm2.getAttribute('p3'), 16)
 
-        self.verify2gAdm3p1 = int(customVerify2gAdm3.getAttribute('p1'), 16)
-        self.verify2gAdm3p2 = int(customVerify2gAdm3.getAttribute('p2'), 16)
-        self.verify2gAdm3p3 = int(customVerify2gAdm3.getAttribute('p3'), 16)
+        settings['verify2gAdm3p1'] = int(customVerify2gAdm3.getAttribute('p1'), 16)
+        settings['verify2gAdm3p2'] = int(customVerify2gAdm3.getAttribute('p2'), 16)
+        settings['verify2gAdm3p3'] = int(customVerify2gAdm3.getAttribute('p3'), 16)
 
-        self.verify2gAdm4p1 = int(customVerify2gAdm4.getAttribute('p1'), 16)
-        self.verify2gAdm4p2 = int(customVerify2gAdm4.getAttribute('p2'), 16)
-        self.verify2gAdm4p3 = int(customVerify2gAdm4.getAttribute('p3'), 16)
+        settings['verify2gAdm4p1'] = int(customVerify2gAdm4.getAttribute('p1'), 16)
+        settings['verify2gAdm4p2'] = int(customVerify2gAdm4.getAttribute('p2'), 16)
+        settings['verify2gAdm4p3'] = int(customVerify2gAdm4.getAttribute('p3'), 16)
 
-        self.verify2gChv1p1 = int(customVerify2gChv1.getAttribute('p1'), 16)
-        self.verify2gChv1p2 = int(customVerify2gChv1.getAttribute('p2'), 16)
-        self.verify2gChv1p3 = int(customVerify2gChv1.getAttribute('p3'), 16)
+        settings['verify2gChv1p1'] = int(customVerify2gChv1.getAttribute('p1'), 16)
+        settings['verify2gChv1p2'] = int(customVerify2gChv1.getAttribute('p2'), 16)
+        settings['verify2gChv1p3'] = int(customVerify2gChv1.getAttribute('p3'), 16)
 
-        self.verify2gChv2p1 = int(customVerify2gChv2.getAttribute('p1'), 16)
-        self.verify2gChv2p2 = int(customVerify2gChv2.getAttribute('p2'), 16)
-        self.verify2gChv2p3 = int(customVerify2gChv2.getAttribute('p3'), 16)
+        settings['verify2gChv2p1'] = int(customVerify2gChv2.getAttribute('p1'), 16)
+        settings['verify2gChv2p2'] = int(customVerify2gChv2.getAttribute('p2'), 16)
+        settings['verify2gChv2p3'] = int(customVerify2gChv2.getAttribute('p3'), 16)
 
-        self.verify3gAdm1p1 = int(customVerify3gAdm1.getAttribute('p1'), 16)
-        self.verify3gAdm1p2 = int(customVerify3gAdm1.getAttribute('p2'), 16)
-        self.verify3gAdm1p3 = int(customVerify3gAdm1.getAttribute('p3'), 16)
+        settings['verify3gAdm1p1'] = int(customVerify3gAdm1.getAttribute('p1'), 16)
+        settings['verify3gAdm1p2'] = int(customVerify3gAdm1.getAttribute('p2'), 16)
+        settings['verify3gAdm1p3'] = int(customVerify3gAdm1.getAttribute('p3'), 16)
 
-        self.verify3gAdm2p1 = int(customVerify3gAdm2.getAttribute('p1'), 16)
-        self.verify3gAdm2p2 = int(customVerify3gAdm2.getAttribute('p2'), 16)
-        self.verify3gAdm2p3 = int(customVerify3gAdm2.getAttribute('p3'), 16)
+        settings['verify3gAdm2p1'] = int(customVerify3gAdm2.getAttribute('p1'), 16)
+        settings['verify3gAdm2p2'] = int(customVerify3gAdm2.getAttribute('p2'), 16)
+        settings['verify3gAdm2p3'] = int(customVerify3gAdm2.getAttribute('p3'), 16)
 
-        self.verify3gAdm3p1 = int(customVerify3gAdm3.getAttribute('p1'), 16)
-        self.verify3gAdm3p2 = int(customVerify3gAdm3.getAttribute('p2'), 16)
-        self.verify3gAdm3p3 = int(customVerify3gAdm3.getAttribute('p3'), 16)
+        settings['verify3gAdm3p1'] = int(customVerify3gAdm3.getAttribute('p1'), 16)
+        settings['verify3gAdm3p2'] = int(customVerify3gAdm3.getAttribute('p2'), 16)
+        settings['verify3gAdm3p3'] = int(customVerify3gAdm3.getAttribute('p3'), 16)
 
-        self.verify3gAdm4p1 = int(customVerify3gAdm4.getAttribute('p1'), 16)
-        self.verify3gAdm4p2 = int(customVerify3gAdm4.getAttribute('p2'), 16)
-        self.verify3gAdm4p3 = int(customVerify3gAdm4.getAttribute('p3'), 16)
+        settings['verify3gAdm4p1'] = int(customVerify3gAdm4.getAttribute('p1'), 16)
+        settings['verify3gAdm4p2'] = int(customVerify3gAdm4.getAttribute('p2'), 16)
+        settings['verify3gAdm4p3'] = int(customVerify3gAdm4.getAttribute('p3'), 16)
 
-        self.verify3gGlobalPin1p1 = int(customVerify3gGlobalPin1.getAttribute('p1'), 16)
-        self.verify3gGlobalPin1p2 = int(customVerify3gGlobalPin1.getAttribute('p2'), 16)
-        self.verify3gGlobalPin1p3 = int(customVerify3gGlobalPin1.getAttribute('p3'), 16)
+        settings['verify3gGlobalPin1p1'] = int(customVerify3gGlobalPin1.getAttribute('p1'), 16)
+        settings['verify3gGlobalPin1p2'] = int(customVerify3gGlobalPin1.getAttribute('p2'), 16)
+        settings['verify3gGlobalPin1p3'] = int(customVerify3gGlobalPin1.getAttribute('p3'), 16)
 
-        self.verify3gLocalPin1p1 = int(customVerify3gLocalPin1.getAttribute('p1'), 16)
-        self.verify3gLocalPin1p2 = int(customVerify3gLocalPin1.getAttribute('p2'), 16)
-        self.verify3gLocalPin1p3 = int(customVerify3gLocalPin1.getAttribute('p3'), 16)
+        settings['verify3gLocalPin1p1'] = int(customVerify3gLocalPin1.getAttribute('p1'), 16)
+        settings['verify3gLocalPin1p2'] = int(customVerify3gLocalPin1.getAttribute('p2'), 16)
+        settings['verify3gLocalPin1p3'] = int(customVerify3gLocalPin1.getAttribute('p3'), 16)
 
-        return True, 'Parsing config.xml complete'
+        return True, 'Parsing config.xml complete', settings
 
     def parseScriptSettings(self):
         settingsFile = 'script-settings.json'
-        with open(settingsFile, "r") as json_file:
-            settingsData = json.load(json_file)
+        if self.getProfileCache() is not None:
+            settingsData = self.getProfileCache().load('scriptSettings/1', settingsFile, loadJson)
+        else:
+            settingsData = loadJson(settingsFile)
         self.allowReadHeader = settingsData['allowExOtReadHeader']
         self.auditOsLocks = settingsData['auditOsLocks']
+        self.osLockBaseline = settingsData.get('osLockBaseline', '')
         if settingsData['useSaveFS']:
             self.fileSystemXml = settingsData['fileSystemXml']
             saveFsLength = len(ntpath.basename(self.fileSystemXml))
@@ -501,26 +906,41 @@ class CardScanner:
         else:
             self.fileSystemXml = ''
         self.destinationFolder = settingsData['destinationFolder']
+        self.opt_unified_scan = settingsData.get('unifiedScan', False)
+        self.opt_content_digest = settingsData.get('contentDigest', False)
+        self.opt_stream = settingsData.get('streamOutput', False)
+        self.opt_tree_cache = settingsData.get('treeCache', False)
+        self.metricsExportDir = settingsData.get('metricsExportDir', '')
+        if settingsData.get('structureOnly', False):
+            self.contentPolicy = ContentPolicy.structureOnly()
+        elif settingsData.get('contentPolicy'):
+            self.contentPolicy = ContentPolicy.fromFile(settingsData['contentPolicy'])
 
     def initializeVerifcodeLogBuffer(self, verifcodeMsg):
         self.verifcodeLogBuffer = { \
             'verifcode_msg': verifcodeMsg, \
-            'apdu_string': '', \
+            'apdu': None, \
             'verifcode_success': True, \
             'status_word': '' \
         }
 
+    def getVerifCodeApduString(self):
+        if self.verifcodeLogBuffer['apdu'] is None:
+            return ''
+        apduHeader, apduData = self.verifcodeLogBuffer['apdu']
+        return toHexString(apduHeader) + ' ' + self.filterHex(toHexString(apduData))
+
     def printVerifCodeLog(self):
         if self.verifcodeLogBuffer['verifcode_success']:
             logger.info('%s %s <- %s' % ( \
                 self.verifcodeLogBuffer['verifcode_msg'], \
-                self.verifcodeLogBuffer['apdu_string'], \
+                self.getVerifCodeApduString(), \
                 self.verifcodeLogBuffer['status_word'] \
             ))
         else:
             logger.error('%s %s <- %s' % ( \
                 self.verifcodeLogBuffer['verifcode_msg'], \
-                self.verifcodeLogBuffer['apdu_string'], \
+                self.getVerifCodeApduString(), \
                 self.verifcodeLogBuffer['status_word'] \
             ))
 
@@ -570,7 +990,7 @@ class CardScanner:
             self.printVerifCodeLog()
         else:
             logger.info('CHV1 is disabled; verification not required.')
-            self.pcomOutFile.writelines('; CHV1 is disabled. No CHV1 verification required.\n')
+            self.apduTrace.write('; CHV1 is disabled. No CHV1 verification required.\n')
         
         self.initializeVerifcodeLogBuffer('Verify CHV2..')
         header = copy.deepcopy(self.verifyPIN2g)
@@ -626,7 +1046,7 @@ class CardScanner:
             self.printVerifCodeLog()
         else:
             logger.info('GPIN is disabled. No GPIN verification required.')
-            self.pcomOutFile.writelines('; GPIN is disabled. No GPIN verification required.\n')
+            self.apduTrace.write('; GPIN is disabled. No GPIN verification required.\n')
 
         self.initializeVerifcodeLogBuffer('Verify Local PIN..')
         header = copy.deepcopy(self.verifyPIN3g)
@@ -637,139 +1057,504 @@ class CardScanner:
         self.printVerifCodeLog()
 
     def parseFileSystemXml(self, fileSystemXml):
+        # incremental parsing: each DBFile is dropped once indexed, so memory does
+        # not depend on size of xml; first entry of a path wins
+        logger.info('Parsing input xml')
+
+        fileSystemList = OrderedDict()
         try:
-            DOMTree = parse(fileSystemXml)
+            events = ElementTree.iterparse(fileSystemXml, events=('start', 'end'))
+            event, root = next(events)
+            for event, element in events:
+                if event != 'end' or element.tag != 'DBFile':
+                    continue
+                name = element.findtext('NAME') or ''
+                fileId = element.findtext('FILEID') or ''
+                path = element.findtext('PATH') or ''
+                absolutePath = (path.replace('|', '') + fileId).encode('ascii', 'ignore')
+                if not absolutePath in fileSystemList:
+                    fileSystemList[absolutePath] = name.encode('ascii', 'ignore')
+                root.clear()
         except IOError, e:
             return False, 'Error parsing file system xml: ' + str(e.strerror), None
-        
-        logger.info('Parsing input xml')
+        except SyntaxError, e:
+            return False, 'Error parsing file system xml: ' + str(e), None
 
-        arrayOfDBFile = DOMTree.documentElement
-        dbFiles = arrayOfDBFile.getElementsByTagName('DBFile')
+        return True, 'success populating file system', fileSystemList
 
-        fileSystemList = []
+    def getNameByPath(self, fileSystemList, path):
+        return fileSystemList.get(path, '')
 
-        for dbFile in dbFiles:
-            name = dbFile.getElementsByTagName('NAME')[0].childNodes[0].data
-            fileId = dbFile.getElementsByTagName('FILEID')[0].childNodes[0].data
-            try:
-                path = dbFile.getElementsByTagName('PATH')[0].childNodes[0].data
-            except IndexError:
-                path = ''
+    def swapIccid(self, iccid):
+        return swapIccid(iccid)
+
+    def scanFile2g(self, ef, fileProperties):
+        # collect 2G properties (and content) of file into fileProperties;
+        # returns False with error message on reader communication error
+        replayed = self.replaySelect2g(ef)
+        if replayed is not None:
+            sel2gResp, sel2gSW1, sel2gSW2 = replayed
+        else:
+            sel2gResp, sel2gSW1, sel2gSW2 = self.cmdSelect2g(ef)
 
-            dbFileDict = {'name': name.encode('ascii', 'ignore'), 'absolutePath': (path.replace('|', '') + fileId).encode('ascii', 'ignore')}
-            fileSystemList.append(dbFileDict)
+        # application DFs (USIM, ISIM, etc.) may fail to be selected for SIMBIOS in 2G mode;
+        # in that case EF properties will be retrieved in 3G mode
+        if sel2gSW1 == 0x90 and sel2gSW2 == 0x00:
+            # 2G get response (only for debugging)
+            # fileProperties['2gGetResponse'] = toHexString(sel2gResp)
+
+            # type of file
+            if sel2gResp[6] == 0x01:
+                fileTypeStr = 'MF'
+            if sel2gResp[6] == 0x02:
+                fileTypeStr = 'DF'
+            if sel2gResp[6] == 0x04:
+                fileTypeStr = 'EF'
+            fileProperties['fileType'] = fileTypeStr
+
+            if fileProperties['fileType'] == 'EF':
+                # structure of file
+                if sel2gResp[13] == 0x00:
+                    fileStructureStr = 'transparent'
+                if sel2gResp[13] == 0x01:
+                    fileStructureStr = 'linear fixed'
+                if sel2gResp[13] == 0x03:
+                    fileStructureStr = 'cyclic'
+                fileProperties['fileStructure'] = fileStructureStr
+
+                # file size
+                fileProperties['fileSize'] = int("%0.2X" % sel2gResp[2] + "%0.2X" % sel2gResp[3], 16)
+
+                # record size
+                if fileProperties['fileStructure'] == 'linear fixed' or fileProperties['fileStructure'] == 'cyclic':
+                    fileProperties['fileRecordSize'] = sel2gResp[14]
+                    # number of record
+                    fileProperties['numberOfRecord'] = fileProperties['fileSize'] / fileProperties['fileRecordSize']
+
+                # file status
+                invalidated = False
+                fileStatusStr = ''
+                if (sel2gResp[11] & 0x01) == 0x00:
+                    fileStatusStr += 'invalidated'
+                    invalidated = True
+                if invalidated:
+                    if (sel2gResp[11] & 0x04) == 0x00:
+                        fileStatusStr += '; not readable or updatable when invalidated'
+                    if (sel2gResp[11] & 0x04) == 0x04:
+                        fileStatusStr += '; readable or updatable when invalidated'
+                    fileProperties['fileStatus'] = fileStatusStr
+
+                # 2G access conditions
+                fileProperties['2gAcc'] = '%0.2X %0.2X %0.2X' % (sel2gResp[8], sel2gResp[9], sel2gResp[10])
+
+                # file contents
+                if not self.opt_read_content_3g:
+                    if fileProperties['fileStructure'] == 'transparent' and fileProperties['fileSize'] > self.MAX_OFFSET_2G + 1:
+                        # offset cannot be coded in 2G READ BINARY; content is read in 3G mode
+                        logger.info('%s: file too large for 2G READ BINARY' % self.formatFileId(ef))
+                    else:
+                        content, readableContent, rdSW1, rdSW2 = self.readContent(ef, fileProperties, False)
+                        if content == -1:
+                            return False, rdSW1 # rdSW1 contains the error
+                        if readableContent:
+                            self.storeContent(fileProperties, content)
+
+        return True, ''
+
+    def scanFile3g(self, ef, fileProperties):
+        # collect 3G properties (and content) of file into fileProperties;
+        # returns True if FCP (and requested content) could be read
+        scanComplete = True
+        sel3gResp, sel3gSW1, sel3gSW2 = self.cmdSelect3g(ef)
+        if sel3gSW1 in (0x6D, 0x6E):
+            # command (class) not accepted in current session
+            scanComplete = False
+
+        if sel3gSW1 == 0x62 and sel3gSW2 == 0x83:
+            if not 'fileStatus' in fileProperties:
+                fileProperties['fileStatus'] = 'invalidated'
+
+        if sel3gSW1 == 0x90 and sel3gSW2 == 0x00:
+            # 3G get response (only for debugging)
+            fileProperties.fcp = bytearray(sel3gResp)
+
+            # File Control Parameters as per TS 102 221, decoded once
+            fcp = berTlv.parseFcp(sel3gResp)
+            if fcp is None:
+                logger.error('%s: unable to decode FCP' % self.formatFileId(ef))
+                return False
+
+            # type of file
+            if berTlv.PIN_STATUS_TEMPLATE in fcp: # mandatory for MF/DF
+                propInfo = fcp.child(berTlv.PROPRIETARY_INFORMATION)
+                # tag '80' (UICC characteristics) is mandatory for MF
+                if propInfo is not None and 0x80 in propInfo:
+                    fileTypeStr = 'MF'
+                else:
+                    fileTypeStr = 'DF'
+            else:
+                fileTypeStr = 'EF'
 
-        return True, 'success populating file system', fileSystemList
+            if not 'fileType' in fileProperties:
+                fileProperties['fileType'] = fileTypeStr
 
-    def getNameByPath(self, fileSystemList, path):
-        efName = ''
-        for fsDict in fileSystemList:
-            if fsDict['absolutePath'] == path:
-                efName = fsDict['name']
-                break
-        return efName
+            if fileProperties['fileType'] == 'EF':
+                # structure of file
+                # FCP tag '82' (File Descriptor)
+                fileDescriptorValue = fcp.value(0x82, [])
+                fileDescriptorByte = fcp.byte(0x82, 0, 0x00)
+                if (fileDescriptorByte & 0x01) == 0x01:
+                    fileStructureStr = 'transparent'
+                if (fileDescriptorByte & 0x02) == 0x02:
+                    fileStructureStr = 'linear fixed'
+                if (fileDescriptorByte & 0x06) == 0x06:
+                    fileStructureStr = 'cyclic'
+                if not 'fileStructure' in fileProperties:
+                    fileProperties['fileStructure'] = fileStructureStr
 
-    def swapIccid(self, iccid):
-        charList = iccid.split()
-        swappedIccid = ''
-        for byteChar in charList:
-            byteChar = list(byteChar)
-            byteChar[0], byteChar[1] = byteChar[1], byteChar[0]
-            swappedIccid += ''.join(byteChar)
-        
-        return swappedIccid
-
-    def createDocumentHeader(self):
-        self.htmlFile.writelines("""<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">
-            <html>
-            <head>
-            <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-            <meta http-equiv="X-UA-Compatible" content="IE=edge,chrome=1" />
-            <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0">
-            <title>Card Report</title>
-            <style type="text/css">
-            html,
-            body {
-                height: 100%;
-            }
-            html {
-                font-size: 16px;
-            }
-            body {
-                margin: 0px;
-                padding: 0px;
-                overflow-x: hidden;
-                min-width: 320px;
-                background: #F9F9F9;
-                font-family: Arial, Helvetica, sans-serif;
-                font-size: 13px;
-                line-height: 1.33;
-                color: #212121;
-                font-smoothing: antialiased;
-            }
-            div {
-                margin-top: 10px;
-                margin-left: 40px;
-                margin-right: 40px;
-            }
-            h1,
-            h2,
-            h3,
-            h4,
-            h5 {
-                font-family: Arial, Helvetica, sans-serif;
-                line-height: 1.33em;
-                margin: calc(2rem -  0.165em ) 0em 1rem;
-                font-weight: 400;
-                padding: 0em;
-            }
-            table {
-                border-collapse: collapse;
-            }
-            th,
-            td {
-                border: 2px solid black;
-                padding: 4px;
-            }
-            th.error {
-                background-color: firebrick;
-                color: #F9F9F9;
-            }
-            th.warning {
-                background-color: darkorange;
-                color: #F9F9F9;
-            }
-            td.error {
-                background-color: #FDEDEC;
-                color: #17202A;
-            }
-            td.warning {
-                background-color: #FEF9E7;
-                color: #17202A;
-            }
-            td.data {
-                font-family: consolas, Monaco, monospace;
-                font-size: 13px;
-            }
-            ul {
-                margin: 0px;
-                padding: 15px;
-            }
-            </style>
-            </head>
-            <body>""")
-
-    def createDocumentFooter(self):
-        self.htmlFile.writelines('\n</body></html>')
-
-    def createTableHeader(self):
-        self.htmlFile.writelines('\n<div><table><tbody>')
-
-    def createTableFooter(self):
-        self.htmlFile.writelines('\n</tbody></table></div>')
+                # file size
+                if 0x80 in fcp and fcp.length(0x80) in (2, 3):
+                    fileSize = fcp.integer(0x80)
+                else:
+                    fileSize = 'UNDEFINED' # somehow unable to parse
+
+                if not 'fileSize' in fileProperties:
+                    fileProperties['fileSize'] = fileSize
+                elif isinstance(fileSize, (int, long)) and fileSize > self.MAX_OFFSET_2G + 1 and fileProperties['fileSize'] != fileSize:
+                    # 2G response only codes size on 2 bytes; content read in 2G mode is incomplete
+                    fileProperties['fileSize'] = fileSize
+                    fileProperties.pop('fileContent', None)
+
+                # record size & number of record
+                if fileProperties['fileStructure'] == 'linear fixed' or fileProperties['fileStructure'] == 'cyclic':
+                    recordSize = (fileDescriptorValue[2] << 8) + fileDescriptorValue[3]
+                    numberOfRecord = fileDescriptorValue[4]
+                    if not 'fileRecordSize' in fileProperties:
+                        fileProperties['fileRecordSize'] = recordSize
+                    if not 'numberOfRecord' in fileProperties:
+                        fileProperties['numberOfRecord'] = numberOfRecord
+
+                # SFI
+                sfiValue = fcp.byte(0x88)
+                if sfiValue is not None:
+                    fileProperties['sfi'] = '%0.2X' % (sfiValue >> 3)
+
+                # access condition
+
+                # file contents; content of files too large for 2G is always read in 3G mode
+                tooLargeFor2g = fileProperties['fileStructure'] == 'transparent' and isinstance(fileProperties['fileSize'], (int, long)) \
+                    and fileProperties['fileSize'] > self.MAX_OFFSET_2G + 1
+                if self.opt_read_content_3g or (tooLargeFor2g and not 'fileContent' in fileProperties):
+                    content, readableContent, rdSW1, rdSW2 = self.readContent(ef, fileProperties, True)
+                    if content == -1 or (rdSW1 == 0x69 and rdSW2 == 0x82):
+                        scanComplete = False # security status not satisfied
+                    elif readableContent:
+                        self.storeContent(fileProperties, content)
+
+        return scanComplete
+
+    def dumpFileDetails(self, fileDetails, dateTimeNow):
+        generation_date = dateTimeNow.strftime("%Y-%m-%d %H:%M")
+        if self.fullScript:
+            for ef in fileDetails:
+                if ef['filePath'] == '3F002FE2':
+                    iccid = ef['fileContent']
+                    break
+            if self.opt_content_digest:
+                logger.info('Card digest: ' + addDigests(fileDetails))
+            outTimeStamp = dateTimeNow.strftime("%Y%m%d%H%M")
+            self.fileSystemOutJson = os.path.join(self.destinationFolder, self.swapIccid(iccid) + '__' + outTimeStamp + '.json')
+            writeJsonReport(self.fileSystemOutJson, toDicts(fileDetails))
+            self.fileSystemOutHtml = os.path.join(self.destinationFolder, self.swapIccid(iccid) + '__' + outTimeStamp + '.html')
+            writeHtmlReport(self.fileSystemOutHtml, fileDetails, iccid, generation_date)
+
+    def rescanFile(self, ef, fileProperties):
+        # content only; EF with SFI is read without SELECT, otherwise it is
+        # selected and read as in scanFile3g()
+        df = ef[:-4]
+        if self.navigator.currentDf != df:
+            response, sw1, sw2, targetSent = self.selectPath(self.select3g, df)
+            if response == -1 or not targetSent or not self.selectSucceeded(sw1):
+                self.navigator.selectFailed(df, targetSent)
+                return False
+            self.navigator.selected(df, True)
+
+        sfi = None
+        if 'sfi' in fileProperties:
+            sfi = int(fileProperties['sfi'], 16)
+        else:
+            response, sw1, sw2 = self.cmdSelect3g(ef)
+            if response == -1 or sw1 != 0x90:
+                return False
+
+        content, readableContent, rdSW1, rdSW2 = self.readContent(ef, fileProperties, True, sfi)
+        if content == -1 or (rdSW1 == 0x69 and rdSW2 == 0x82):
+            return False # security status not satisfied
+        if readableContent:
+            self.storeContent(fileProperties, content)
+        return True
+
+    def rescan(self, dateTimeNow):
+        # read content again for files listed in a previous scan; FCP and file list
+        # are taken from the reference, so EFs with SFI need no SELECT
+        try:
+            with open(self.opt_rescan_reference, 'r') as json_file:
+                fileDetails = fromDicts(json.load(json_file))
+        except (IOError, ValueError), e:
+            logger.error('Unable to load rescan reference: ' + str(e))
+            if self.runAsModule:
+                return False, 'Unable to load rescan reference'
+            sys.exit(-1)
+
+        self.metrics.startPhase('rescan')
+        if self.fullScript:
+            self.pinVerification3g()
+        logger.info('Reading content of %d file(s) in 3G mode' % len(fileDetails))
+        numberOfSfiRead = 0
+        for fileProperties in fileDetails:
+            fileProperties.pop('fileContent', None)
+            fileProperties.pop('contentTruncated', None)
+            if fileProperties.get('fileType') != 'EF' or not 'fileStructure' in fileProperties:
+                continue
+            if not self.getContentRule(str(fileProperties['filePath'])).readContent:
+                continue
+            ef = str(fileProperties['filePath']) # json strings are unicode
+            self.apduTrace.write('\n; ' + self.formatFileId(ef) + ': ' + fileProperties.get('fileName', '') + '\n')
+            if not self.rescanFile(ef, fileProperties):
+                logger.error('%s: content not read completely' % self.formatFileId(ef))
+            if 'sfi' in fileProperties:
+                numberOfSfiRead += 1
+        logger.info('%d file(s) read by SFI' % numberOfSfiRead)
+
+        self.metrics.startPhase('dump')
+        self.dumpFileDetails(fileDetails, dateTimeNow)
+        self.apduTrace.close()
+        self.metrics.endPhase()
+        return True, "Scanning success"
+
+    def getCheckpointFileName(self):
+        return os.path.join(self.destinationFolder, self.pcomOutFileName + '.checkpoint')
+
+    def saveCheckpoint(self, scanPass, nextIndex, cardFileList, fileDetails, unifiedScan, retry3gIndexes):
+        # whole state needed to continue scan; written to temporary file first,
+        # so that an interruption while saving keeps previous checkpoint
+        checkpoint = {
+            'pass': scanPass,
+            'nextIndex': nextIndex,
+            'atr': self.cardAtr,
+            'unifiedScan': unifiedScan,
+            'cardFileList': cardFileList,
+            'retry3gIndexes': retry3gIndexes,
+            'fileDetails': toDicts(fileDetails)
+        }
+        if self.streamWriter is not None:
+            checkpoint['streamOffset'] = self.streamWriter.tell()
+        if self.osLocks is not None:
+            checkpoint['osLocks'] = self.osLocks
+        self.apduTrace.flush() # script up to checkpoint
+        checkpointFileName = self.getCheckpointFileName()
+        with open(checkpointFileName + '.tmp', 'w') as json_file:
+            json.dump(checkpoint, json_file)
+        if os.name == 'nt' and os.path.exists(checkpointFileName):
+            os.remove(checkpointFileName) # rename does not replace on Windows
+        os.rename(checkpointFileName + '.tmp', checkpointFileName)
+
+    def loadCheckpoint(self):
+        try:
+            with open(self.getCheckpointFileName(), 'r') as json_file:
+                checkpoint = json.load(json_file)
+        except (IOError, ValueError):
+            return None
+        # json strings are unicode
+        checkpoint['cardFileList'] = [str(path) for path in checkpoint['cardFileList']]
+        checkpoint['atr'] = str(checkpoint['atr'])
+        checkpoint['fileDetails'] = fromDicts(checkpoint['fileDetails'])
+        return checkpoint
+
+    def getStreamFileName(self):
+        return os.path.join(self.destinationFolder, os.path.splitext(self.pcomOutFileName)[0] + '.ndjson')
+
+    def openStream(self, checkpoint):
+        resumeOffset = None
+        if checkpoint is not None:
+            resumeOffset = checkpoint.get('streamOffset', 0)
+        self.streamWriter = NdjsonWriter(self.getStreamFileName(), resumeOffset)
+
+    def streamFile(self, fileProperties):
+        # file is done with both passes
+        if self.streamWriter is None:
+            return
+        if self.opt_content_digest:
+            addFileDigests(fileProperties)
+        self.streamWriter.writeFile(fileProperties)
+        if self.opt_stream_only:
+            fileProperties.releaseContent()
+
+    def closeStream(self, scanOk, scanMsg):
+        if self.streamWriter is None:
+            return
+        summary = {'success': scanOk, 'message': scanMsg, 'atr': self.cardAtr}
+        summary.update(self.metrics.summary())
+        if self.fileSystemOutJson:
+            summary['json'] = self.fileSystemOutJson
+        if self.osLocks is not None:
+            summary['osLocks'] = self.osLocks
+        self.streamWriter.writeSummary(summary)
+        self.streamWriter = None
+
+    def removeCheckpoint(self):
+        if os.path.exists(self.getCheckpointFileName()):
+            os.remove(self.getCheckpointFileName())
+
+    def getHeaderFileType(self, header):
+        # type of file (as in byte 7 of 2G response) when given by read header
+        # after file ID, None if card does not provide it
+        if len(header) > 2 and header[2] in (0x01, 0x02, 0x04):
+            return header[2]
+        return None
+
+    def getTreeFingerprint(self):
+        # 2G response of MF and its first read header entries; None on
+        # communication error
+        parts = [self.cardAtr]
+        sel2gResp, sel2gSW1, sel2gSW2 = self.cmdSelect2g('3F00', out2Pcom=False)
+        if sel2gResp == -1:
+            return None
+        parts.append('%s %.2X%.2X' % (toHexString(sel2gResp), sel2gSW1, sel2gSW2))
+        for readIndex in range(1, self.TREE_FINGERPRINT_ENTRIES + 1):
+            rdHdrResp, rdHdrSW1, rdHdrSW2 = self.cmdReadHeader(readIndex, 0x04)
+            if rdHdrResp == -1:
+                return None
+            parts.append('%s %.2X%.2X' % (toHexString(rdHdrResp), rdHdrSW1, rdHdrSW2))
+        return hashText(parts)
+
+    def discoverFiles(self):
+        # read header, unless file tree of a card with same fingerprint has
+        # been discovered before; every card of a batch has the same tree
+        self.treeCacheKey = None
+        if not self.opt_tree_cache:
+            return self.readHeaderFileList()
+        self.metrics.startPhase('tree cache')
+        fingerprint = self.getTreeFingerprint()
+        if fingerprint is None:
+            return False, []
+        cardFileList = self.getProfileCache(True).get('fileTree/1', fingerprint)
+        if cardFileList is not None:
+            logger.info('File tree of %d files taken from cache' % len(cardFileList))
+            self.treeCacheKey = fingerprint
+            return True, cardFileList
+
+        supportReadHeader, cardFileList = self.readHeaderFileList()
+        if supportReadHeader and not self.communicationError:
+            self.getProfileCache(True).put('fileTree/1', fingerprint, cardFileList)
+        return supportReadHeader, cardFileList
+
+    def checkCachedTree(self, fileDetails):
+        # a file of cached tree not found in card means tree has changed with
+        # same fingerprint; next card is discovered again
+        if self.treeCacheKey is None:
+            return
+        missing = [fileProperties['filePath'] for fileProperties in fileDetails if not 'fileType' in fileProperties]
+        if missing:
+            logger.warning('%d file(s) of cached file tree not found (%s); cache entry removed' % (len(missing), self.formatFileId(missing[0])))
+            self.getProfileCache(True).remove('fileTree/1', self.treeCacheKey)
+
+    def readHeaderFileList(self):
+        # execute ex-OT read header proprietary command; returns whether card
+        # supports it and list of files found. entries are read from current DF,
+        # a DF is only selected when it is entered or left
+        supportReadHeader = True
+        cardFileList = ['3F00'] # initiate file list with MF
+        curCardFilePath = ''
+
+        logger.info('Performing read header..')
+        self.metrics.startPhase('discovery')
+        curCardDF = '3F00'
+        dfStack = [] # (parent DF, read index of current DF in parent) of DFs entered
+        readIndex = 1
+        while readIndex < 256:
+            rdHdrResp, rdHdrSW1, rdHdrSW2 = self.cmdReadHeader(readIndex, 0x04)
+            if rdHdrResp == -1: # possible due to reader communication error
+                break
+            if rdHdrSW1 == 0x90 and rdHdrSW2 == 0x00:
+                curCardFileID = toHexString(rdHdrResp[0:2])
+                curCardFileID = curCardFileID.replace(" ", "")
+                curCardFilePath = curCardDF + curCardFileID
+                cardFileList.append(curCardFilePath)
+                curCardFileType = self.getHeaderFileType(rdHdrResp)
+                if curCardFileType is None:
+                    # type of file is only known by selecting it
+                    sel2gResp, sel2gSW1, sel2gSW2 = self.cmdSelect2g(curCardFilePath, out2Pcom=False)
+                    if sel2gResp == -1:
+                        break
+                    curCardFileType = sel2gResp[6]
+                    if curCardFileType == 0x04:
+                        self.cmdSelect2g(curCardDF, out2Pcom=False)
+                elif curCardFileType != 0x04:
+                    # enter DF
+                    selResp, selSW1, selSW2, targetSent = self.selectPath(self.select2g, curCardFilePath, out2Pcom=False)
+                    if selResp == -1:
+                        break
+                    self.navigator.selected(curCardFilePath, True, False)
+                    if selSW1 == 0x9F:
+                        self.cacheSelect2g(curCardFilePath, selSW1, selSW2)
+                if curCardFileType != 0x04:
+                    dfStack.append((curCardDF, readIndex))
+                    curCardDF = curCardFilePath
+                    readIndex = 0
+            else:
+                if (rdHdrSW1 == 0x94 and rdHdrSW2 == 0x02) or (rdHdrSW1 == 0x6A and rdHdrSW2 == 0x83):
+                    # no more entries in current DF
+                    if not dfStack:
+                        break
+                    # back to parent, no need to check result
+                    curCardDF, readIndex = dfStack.pop()
+                    selResp, selSW1, selSW2, targetSent = self.selectPath(self.select2g, curCardDF, out2Pcom=False)
+                    if selResp == -1:
+                        break
+                    self.navigator.setCurrentDf(curCardDF)
+                else:
+                    # read header is not supported by the card
+                    supportReadHeader = False
+                    logger.error('Error reading header at ' + curCardFilePath) # indicate where it fails reading header and exit
+                    break
+            readIndex += 1
+        return supportReadHeader, cardFileList
 
     def proceed(self):
+        # script is written completely and metrics are exported whatever way scan
+        # ends (including sys.exit())
+        scanOk = False
+        try:
+            scanOk, scanMsg = self.scanCard()
+            return scanOk, scanMsg
+        finally:
+            if self.apduTrace is not None:
+                self.apduTrace.close()
+            if self.metricsExportDir:
+                self.exportMetrics(scanOk)
+
+    def exportMetrics(self, scanOk):
+        # <dir>/cardscanner_reader<n>.json and .prom, replaced at each run
+        self.metrics.endPhase()
+        labels = {'reader': self.readerNumber}
+        baseName = os.path.join(self.metricsExportDir, 'cardscanner_reader%d' % self.readerNumber)
+        try:
+            if not os.path.isdir(self.metricsExportDir):
+                os.makedirs(self.metricsExportDir)
+            for extension, content in (
+                    ('.json', json.dumps(self.metrics.toJson(labels, scanOk), indent=2)),
+                    ('.prom', self.metrics.toPrometheus(labels, scanOk))):
+                # collector shall never read a partial file
+                with open(baseName + extension + '.tmp', 'w') as metrics_file:
+                    metrics_file.write(content)
+                if os.name == 'nt' and os.path.exists(baseName + extension):
+                    os.remove(baseName + extension) # rename does not replace on Windows
+                os.rename(baseName + extension + '.tmp', baseName + extension)
+        except (IOError, OSError), e:
+            logger.error('Unable to export metrics: ' + str(e))
+
+    def scanCard(self):
         # when using VerifClient, go with user configuration
         if self.runAsModule:
             self.parseConfigXml()
@@ -779,95 +1564,80 @@ class CardScanner:
             else:
                 self.pcomOutFileName = self.profileBaseName + '__light.pcom'
         
-        self.pcomOutFile = open(self.destinationFolder + '\\' + self.pcomOutFileName, 'w')
-        
+        checkpoint = None
+        if self.opt_resume:
+            checkpoint = self.loadCheckpoint()
+            if checkpoint is None:
+                logger.error('No checkpoint to resume from')
+                if self.runAsModule:
+                    return False, 'No checkpoint to resume from'
+                sys.exit(-1)
+
+        # script of interrupted scan is continued
+        self.apduTrace = ApduTrace(os.path.join(self.destinationFolder, self.pcomOutFileName), self.traceLevel, checkpoint is not None)
+        self.metrics.reset()
+        self.metrics.startPhase('init')
+
         # power on
         if not self.initSCard() == 0:
             if self.runAsModule:
                 return False, 'Error initializing card'
             sys.exit(-1)
+        self.resetReadCapabilities()
 
         dateTimeNow = datetime.now()
         generation_date = dateTimeNow.strftime("%Y-%m-%d %H:%M")
-        self.pcomOutFile.writelines('; Generated with CardScanner on ' + generation_date + '\n')
+        if checkpoint is not None:
+            if checkpoint['atr'] != self.cardAtr:
+                logger.error('Card does not match checkpoint (ATR %s)' % checkpoint['atr'])
+                if self.runAsModule:
+                    return False, 'Card does not match checkpoint'
+                sys.exit(-1)
+            logger.info('Resuming %s scan at file %d' % (checkpoint['pass'], checkpoint['nextIndex'] + 1))
+            self.apduTrace.write('\n; Resumed with CardScanner on ' + generation_date + '\n')
+        else:
+            self.apduTrace.write('; Generated with CardScanner on ' + generation_date + '\n')
+
+        if self.opt_rescan_reference:
+            # content only, files and their FCP known from a previous scan
+            return self.rescan(dateTimeNow)
 
         # verify security codes (2G) for 'full' script
-        if self.fullScript:
+        if self.fullScript and (checkpoint is None or checkpoint['pass'] != '3g'):
             self.pinVerification2g()
 
         # execute ex-OT read header proprietary command
-        supportReadHeader = True
-        cardFileList = ['3F00'] # initiate file list with MF
-        curCardFilePath = ''
-
-        if self.allowReadHeader:
-            logger.info('Performing read header..')
-            curCardFileType = ''
-            curCardDF = '3F00'
-            curCardFileID = ''
-            curCardIndex = 0
-            prevCardIndex = 0
-            prevCardMFIndex = 0
-            readIndex = 1
-            while readIndex < 256:
-                rdHdrResp, rdHdrSW1, rdHdrSW2 = self.cmdReadHeader(readIndex, 0x04)
-                if rdHdrSW1 == 0x90 and rdHdrSW2 == 0x00:
-                    curCardFileID = toHexString(rdHdrResp[0:2])
-                    curCardFileID = curCardFileID.replace(" ", "")
-                    curCardFilePath = curCardDF + curCardFileID
-                    cardFileList.append(curCardFilePath)
-                    sel2gResp, sel2gSW1, sel2gSW2 = self.cmdSelect2g(curCardFilePath, out2Pcom=False)
-                    curCardFileType = sel2gResp[6]
-                    if curCardFileType == 0x04:
-                        self.cmdSelect2g(curCardDF, out2Pcom=False)
-                    else:
-                        if curCardDF == '3F00':
-                            curCardDF = curCardDF + curCardFileID
-                            prevCardMFIndex = curCardIndex
-                            readIndex = 0
-                        else:
-                            curCardDF = curCardDF + curCardFileID
-                            prevCardIndex = curCardIndex
-                            readIndex = 0
-                else:
-                    if (rdHdrSW1 == 0x94 and rdHdrSW2 == 0x02) or (rdHdrSW1 == 0x6A and rdHdrSW2 == 0x83):
-                        # select parents, no need to check result
-                        path = self.filterHex(curCardDF)
-                        i = 0
-                        while i < (len(path) - 4):
-                            self.sendApdu(self.select2g, path[i:i + 4], out2Pcom=False)
-                            i += 4
-                            curCardDF = path[0:i]
-                            if curCardDF == '3F00':
-                                readIndex = prevCardMFIndex + 1
-                            else:
-                                readIndex = prevCardIndex + 1
-                    else:
-                        # read header is not supported by the card
-                        supportReadHeader = False
-                        logger.error('Error reading header at ' + curCardFilePath) # indicate where it fails reading header and exit
-                        break
-                curCardIndex = readIndex
-                readIndex += 1
-        else:
-            supportReadHeader = False
+        supportReadHeader = False
+        if checkpoint is not None:
+            # files of interrupted scan
+            cardFileList = checkpoint['cardFileList']
+        elif self.allowReadHeader:
+            supportReadHeader, cardFileList = self.discoverFiles()
+            if self.communicationError:
+                logger.error('A communications error with the smart card has been detected')
+                if self.runAsModule:
+                    return False, 'A communications error with the smart card has been detected'
+                sys.exit(-1)
 
         fileSystemXmlAvailable = False
         if self.fileSystemXml != '':
             fileSystemXmlAvailable = True
-            parseFileSystemOk, parseFileSystemMsg, fileSystemList = self.parseFileSystemXml(self.fileSystemXml)
+            parseFileSystemOk, parseFileSystemMsg = self.loadFileSystem()
             if not parseFileSystemOk:
                 logger.error(parseFileSystemMsg)
                 if self.runAsModule:
                     return False, parseFileSystemMsg
                 sys.exit(-1) # or return with message
-        if not supportReadHeader:
+            fileSystemList = self.fileSystemList
+        if not supportReadHeader and checkpoint is None:
             # populate cardFileList from input xml for USIM 1.x or SIMBIOS cards
             cardFileList = [] # reset list
             logger.info('Populating file system from input xml')
             if fileSystemXmlAvailable:
-                for ef in fileSystemList:
-                    cardFileList.append(ef['absolutePath'])
+                cardFileList = list(fileSystemList)
+
+        # depth-first order, so that consecutive files share their parent DF
+        cardFileList = sortDepthFirst(cardFileList)
 
         if len(cardFileList) == 0:
             logger.error('Please provide correct file system xml')
@@ -877,12 +1647,48 @@ class CardScanner:
 
         # initialize list that contains all files in card and their parameters
         fileDetails = []
-
-        # scan card in 2G mode
-        logger.info('Scanning in 2G mode')
-        for ef in cardFileList:
-            # create dictionary of file properties; this is done only once
-            fileProperties = {'filePath': ef}
+        retry3gIndexes = []
+        startIndex = 0
+        scanPass = '2g'
+        self.osLocks = None
+        if checkpoint is not None:
+            fileDetails = checkpoint['fileDetails']
+            retry3gIndexes = checkpoint['retry3gIndexes']
+            startIndex = checkpoint['nextIndex']
+            scanPass = checkpoint['pass']
+            self.osLocks = checkpoint.get('osLocks')
+        if self.opt_stream or self.opt_stream_only:
+            self.openStream(checkpoint)
+
+        unifiedScan = False
+        if checkpoint is not None and scanPass != '3g':
+            unifiedScan = checkpoint['unifiedScan'] and self.supportsBothClasses()
+            if checkpoint['unifiedScan'] and not unifiedScan:
+                logger.error('Card does not accept 2G and 3G commands in one session anymore; scan again')
+                if self.runAsModule:
+                    return False, 'Unified scan cannot be resumed'
+                sys.exit(-1)
+        elif checkpoint is not None:
+            unifiedScan = checkpoint['unifiedScan']
+        elif self.opt_unified_scan:
+            unifiedScan = self.supportsBothClasses()
+            if not unifiedScan:
+                logger.info('Card does not accept 2G and 3G commands in one session; scanning in two passes')
+
+        # scan card in 2G mode; in unified scan, each file is also scanned in 3G mode
+        # and only files failing in this session are scanned again after power cycle
+        if scanPass != '3g':
+            if unifiedScan:
+                scanPass = 'unified'
+                logger.info('Scanning in 2G and 3G mode')
+                self.metrics.startPhase('unified')
+            else:
+                logger.info('Scanning in 2G mode')
+                self.metrics.startPhase('2g')
+        for efIndex in range(startIndex if scanPass != '3g' else len(cardFileList), len(cardFileList)):
+            ef = cardFileList[efIndex]
+            # create record of file properties; this is done only once
+            fileProperties = FileRecord(ef)
             if fileSystemXmlAvailable:
                 # look-up dictionary for file names
                 fileProperties['fileName'] = self.getNameByPath(fileSystemList, ef)
@@ -890,352 +1696,157 @@ class CardScanner:
                 fileProperties['fileName'] = ''
 
             if self.formatFileId(ef):
-                self.pcomOutFile.writelines('\n; ' + self.formatFileId(ef) + ': ' + fileProperties['fileName'] + '\n')
+                self.apduTrace.write('\n; ' + self.formatFileId(ef) + ': ' + fileProperties['fileName'] + '\n')
             else:
                 logger.error('TypeError: probably found AID instead of DF (or path is too long)')
                 if self.runAsModule:
                     return False, 'TypeError: probably found AID instead of DF (or path is too long)'
                 sys.exit(-1) # or return with message
-            sel2gResp, sel2gSW1, sel2gSW2 = self.cmdSelect2g(ef)
-            
-            # application DFs (USIM, ISIM, etc.) may fail to be selected for SIMBIOS in 2G mode;
-            # in that case EF properties will be retrieved in 3G mode
-            if sel2gSW1 == 0x90 and sel2gSW2 == 0x00:
-                # 2G get response (only for debugging)
-                # fileProperties['2gGetResponse'] = toHexString(sel2gResp)
-
-                # type of file
-                if sel2gResp[6] == 0x01:
-                    fileTypeStr = 'MF'
-                if sel2gResp[6] == 0x02:
-                    fileTypeStr = 'DF'
-                if sel2gResp[6] == 0x04:
-                    fileTypeStr = 'EF'
-                fileProperties['fileType'] = fileTypeStr
-                
-                if fileProperties['fileType'] == 'EF':
-                    # structure of file
-                    if sel2gResp[13] == 0x00:
-                        fileStructureStr = 'transparent'
-                    if sel2gResp[13] == 0x01:
-                        fileStructureStr = 'linear fixed'
-                    if sel2gResp[13] == 0x03:
-                        fileStructureStr = 'cyclic'
-                    fileProperties['fileStructure'] = fileStructureStr
-
-                    # file size
-                    fileProperties['fileSize'] = int("%0.2X" % sel2gResp[2] + "%0.2X" % sel2gResp[3], 16)
-
-                    # record size
-                    if fileProperties['fileStructure'] == 'linear fixed' or fileProperties['fileStructure'] == 'cyclic':
-                        fileProperties['fileRecordSize'] = sel2gResp[14]
-                        # number of record
-                        fileProperties['numberOfRecord'] = fileProperties['fileSize'] / fileProperties['fileRecordSize']
-                    
-                    # file status
-                    invalidated = False
-                    fileStatusStr = ''
-                    if (sel2gResp[11] & 0x01) == 0x00:
-                        fileStatusStr += 'invalidated'
-                        invalidated = True
-                    if invalidated:
-                        if (sel2gResp[11] & 0x04) == 0x00:
-                            fileStatusStr += '; not readable or updatable when invalidated'
-                        if (sel2gResp[11] & 0x04) == 0x04:
-                            fileStatusStr += '; readable or updatable when invalidated'
-                        fileProperties['fileStatus'] = fileStatusStr
-
-                    # 2G access conditions
-                    fileProperties['2gAcc'] = '%0.2X %0.2X %0.2X' % (sel2gResp[8], sel2gResp[9], sel2gResp[10])
-
-                    # file contents
-                    if not self.opt_read_content_3g:
-                        if fileProperties['fileStructure'] == 'linear fixed' or fileProperties['fileStructure'] == 'cyclic':
-                            recordList = []
-                            readableContent = True
-                            for i in range(fileProperties['numberOfRecord']):
-                                rdRec2gResp, rdRec2gSW1, rdRec2gSW2 = self.cmdReadRecord2g(i+1, self.READ_RECORD_ABSOLUTE, fileProperties['fileRecordSize'])
-                                if rdRec2gResp == -1: # possible due to reader communication error
-                                    logger.error(rdRec2gSW1) # rdRec2gSW1 contains the error
-                                    if self.runAsModule:
-                                        return False, rdRec2gSW1
-                                    sys.exit(-1) # or return with message
-                                else:
-                                    if rdRec2gSW1 != 0x90 and rdRec2gSW2 != 00:
-                                        # stop reading record, as EF may be invalidated and not readable
-                                        readableContent = False
-                                        # break
-                                    recordList.append(toHexString(rdRec2gResp))
-                            if readableContent:
-                                fileProperties['fileContent'] = recordList
-                        
-                        if fileProperties['fileStructure'] == 'transparent':
-                            transparentContentBuffer = ''
-                            readableContent = True
-                            # handle length more than one APDU
-                            index = 0
-                            while index < fileProperties['fileSize']:
-                                if (index + self.MAX_RESPONSE_LEN) > fileProperties['fileSize']:
-                                    tmpLen = fileProperties['fileSize'] - index
-                                else:
-                                    tmpLen = self.MAX_RESPONSE_LEN
-                                rdBin2gResp, rdBin2gSW1, rdBin2gSW2 = self.cmdReadBinary2g(index, tmpLen)
-                                if rdBin2gResp == -1: # possible due to reader communication error
-                                    logger.error(rdBin2gSW1) # rdBin2gSW1 contains the error
-                                    if self.runAsModule:
-                                        return False, rdBin2gSW1
-                                    sys.exit(-1) # or return with message
-                                else:
-                                    if rdBin2gSW1 != 0x90 and rdBin2gSW2 != 00:
-                                        # stop reading binary content, as EF may be invalidated and not readable
-                                        readableContent = False
-                                if transparentContentBuffer == '':
-                                    transparentContentBuffer = toHexString(rdBin2gResp)
-                                else:
-                                    transparentContentBuffer = transparentContentBuffer + ' ' + toHexString(rdBin2gResp)
-                                index += tmpLen
-                            if readableContent:
-                                fileProperties['fileContent'] = transparentContentBuffer
+            scanOk, scanMsg = self.scanFile2g(ef, fileProperties)
+            if scanOk and unifiedScan and not self.scanFile3g(ef, fileProperties):
+                retry3gIndexes.append(efIndex)
+            if not scanOk or self.communicationError:
+                # file is scanned again when resuming
+                if efIndex in retry3gIndexes:
+                    retry3gIndexes.remove(efIndex)
+                self.saveCheckpoint(scanPass, efIndex, cardFileList, fileDetails, unifiedScan, retry3gIndexes)
+                scanMsg = scanMsg or 'A communications error with the smart card has been detected'
+                logger.error(scanMsg + '; scan can be resumed')
+                self.closeStream(False, scanMsg)
+                if self.runAsModule:
+                    return False, scanMsg
+                sys.exit(-1) # or return with message
 
             fileDetails.append(fileProperties)
+            if unifiedScan and not efIndex in retry3gIndexes:
+                self.streamFile(fileProperties)
+            if (efIndex + 1) % self.CHECKPOINT_INTERVAL == 0:
+                self.saveCheckpoint(scanPass, efIndex + 1, cardFileList, fileDetails, unifiedScan, retry3gIndexes)
+
+        if self.auditOsLocks and self.osLocks is None:
+            # still in 2G session, before card is cycled for 3G mode
+            self.metrics.startPhase('os locks')
+            self.auditOsLockBuffer()
+            if self.communicationError:
+                # OS locks are read again when resuming
+                self.saveCheckpoint('3g', startIndex if scanPass == '3g' else 0, cardFileList, fileDetails, unifiedScan, retry3gIndexes)
+                logger.error('A communications error with the smart card has been detected; scan can be resumed')
+                self.closeStream(False, 'A communications error with the smart card has been detected')
+                if self.runAsModule:
+                    return False, 'A communications error with the smart card has been detected'
+                sys.exit(-1)
 
-        # cycle card
-        self.initSCard()
-
-        # verify security codes (3G) for 'full' script
-        if self.fullScript:
-            self.pinVerification3g()
-
-        # scan card in 3G mode
-        logger.info('Scanning in 3G mode')
-        efIndex = 0
-        for ef in cardFileList:
-            self.pcomOutFile.writelines('\n; ' + self.formatFileId(ef) + ': ' + fileDetails[efIndex]['fileName'] + '\n')
-            sel3gResp, sel3gSW1, sel3gSW2 = self.cmdSelect3g(ef)
+        if unifiedScan:
+            scan3gIndexes = retry3gIndexes
+        else:
+            scan3gIndexes = range(len(cardFileList))
+        if scanPass == '3g':
+            # files done before interruption are skipped
+            scan3gIndexes = [efIndex for efIndex in scan3gIndexes if efIndex >= startIndex]
+        scanPass = '3g'
 
-            if sel3gSW1 == 0x62 and sel3gSW2 == 0x83:
-                if not 'fileStatus' in fileDetails[efIndex]:
-                    fileDetails[efIndex]['fileStatus'] = 'invalidated'
+        if scan3gIndexes:
+            # cycle card
+            self.metrics.startPhase('power cycle')
+            self.initSCard()
 
-            if sel3gSW1 == 0x90 and sel3gSW2 == 0x00:
-                # 3G get response (only for debugging)
-                fileDetails[efIndex]['3gGetResponse'] = toHexString(sel3gResp)
+            # verify security codes (3G) for 'full' script
+            if self.fullScript:
+                self.pinVerification3g()
 
-                # File Control Parameters as per TS 102 221
-                fcp = self.getValueByTag(0x62, sel3gResp)
-                fcpObjects = self.getTlvObjects(fcp)
+            # scan card in 3G mode
+            if unifiedScan:
+                logger.info('Scanning %d file(s) again in 3G mode' % len(scan3gIndexes))
+            else:
+                logger.info('Scanning in 3G mode')
+            self.metrics.startPhase('3g')
+            for efIndex in scan3gIndexes:
+                ef = cardFileList[efIndex]
+                self.apduTrace.write('\n; ' + self.formatFileId(ef) + ': ' + fileDetails[efIndex]['fileName'] + '\n')
+                self.scanFile3g(ef, fileDetails[efIndex])
+                if self.communicationError:
+                    # 3G properties are only added to file, it can be scanned again
+                    self.saveCheckpoint(scanPass, efIndex, cardFileList, fileDetails, unifiedScan, retry3gIndexes)
+                    logger.error('A communications error with the smart card has been detected; scan can be resumed')
+                    self.closeStream(False, 'A communications error with the smart card has been detected')
+                    if self.runAsModule:
+                        return False, 'A communications error with the smart card has been detected'
+                    sys.exit(-1)
+                self.streamFile(fileDetails[efIndex])
+                if (efIndex + 1) % self.CHECKPOINT_INTERVAL == 0:
+                    self.saveCheckpoint(scanPass, efIndex + 1, cardFileList, fileDetails, unifiedScan, retry3gIndexes)
+
+        self.checkCachedTree(fileDetails)
 
-                # type of file
-                # FCP tag '82' (File Descriptor)
-                propInfo = []
-                pinStatusTemplateDO = []
-                for i in fcpObjects:
-                    if i[0] == 0xA5:
-                        propInfo = i
-                        break
-                for i in fcpObjects:
-                    if i[0] == 0xC6:
-                        pinStatusTemplateDO = i # mandatory for MF/DF
-                        break
-                if pinStatusTemplateDO:
-                    if propInfo:
-                        typeIsMf = False
-                        propInfoValue = self.getValueByTag(0xA5, propInfo)
-                        propInfoObjects = self.getTlvObjects(propInfoValue)
-                        for i in propInfoObjects:
-                            if i[0] == 0x80:
-                                # tag '80' (UICC characteristics) is mandatory for MF
-                                typeIsMf = True
-                                break
-                        if typeIsMf:
-                            fileTypeStr = 'MF'
-                        else:
-                            fileTypeStr = 'DF'
-                else:
-                    fileTypeStr = 'EF'
-                
-                if not 'fileType' in fileDetails[efIndex]:
-                    fileDetails[efIndex]['fileType'] = fileTypeStr
-
-                if fileDetails[efIndex]['fileType'] == 'EF':
-                    # structure of file
-                    fileDescriptor = []
-                    for i in fcpObjects:
-                        if i[0] == 0x82:
-                            fileDescriptor = i
-                            break
-                    fileDescriptorValue = self.getValueByTag(0x82, fileDescriptor)
-                    fileDescriptorByte = fileDescriptorValue[0]
-                    if (fileDescriptorByte & 0x01) == 0x01:
-                        fileStructureStr = 'transparent'
-                    if (fileDescriptorByte & 0x02) == 0x02:
-                        fileStructureStr = 'linear fixed'
-                    if (fileDescriptorByte & 0x06) == 0x06:
-                        fileStructureStr = 'cyclic'
-                    if not 'fileStructure' in fileDetails[efIndex]:
-                        fileDetails[efIndex]['fileStructure'] = fileStructureStr
-
-                    # file size
-                    fileSizeObj = []
-                    for i in fcpObjects:
-                        if i[0] == 0x80:
-                            fileSizeObj = i
-                            break
-
-                    if fileSizeObj:
-                        fileSizeValue = self.getValueByTag(0x80, fileSizeObj)
-                        if len(fileSizeValue) == 2:
-                            fileSize = int("%0.2X" % fileSizeValue[0] + "%0.2X" % fileSizeValue[1], 16)
-                        if len(fileSizeValue) == 3:
-                            fileSize = int("%0.2X" % fileSizeValue[0] + "%0.2X" % fileSizeValue[1] + "%0.2X" % fileSizeValue[2], 16)
-                    else:
-                        fileSize = 'UNDEFINED' # somehow unable to parse
-                    
-                    if not 'fileSize' in fileDetails[efIndex]:
-                        fileDetails[efIndex]['fileSize'] = fileSize
-                    
-                    # record size & number of record
-                    if fileDetails[efIndex]['fileStructure'] == 'linear fixed' or fileDetails[efIndex]['fileStructure'] == 'cyclic':
-                        recordSize = int("%0.2X" % fileDescriptorValue[2] + "%0.2X" % fileDescriptorValue[3], 16)
-                        numberOfRecord = fileDescriptorValue[4]
-                        if not 'fileRecordSize' in fileDetails[efIndex]:
-                            fileDetails[efIndex]['fileRecordSize'] = recordSize
-                        if not 'numberOfRecord' in fileDetails[efIndex]:
-                            fileDetails[efIndex]['numberOfRecord'] = numberOfRecord
-                        
-                    # SFI
-                    sfiObj = []
-                    for i in fcpObjects:
-                        if i[0] == 0x88:
-                            sfiObj = i
-                            break
-                    if sfiObj:
-                        sfiValue = self.getValueByTag(0x88, sfiObj)
-                        if sfiValue:
-                            sfiValueShifted = sfiValue[0] >> 3
-                            fileDetails[efIndex]['sfi'] = '%0.2X' % (sfiValueShifted)
-
-                    # access condition
-
-                    # file contents
-                    if self.opt_read_content_3g:
-                        if fileDetails[efIndex]['fileStructure'] == 'linear fixed' or fileDetails[efIndex]['fileStructure'] == 'cyclic':
-                            recordList = []
-                            readableContent = True
-                            for i in range(fileDetails[efIndex]['numberOfRecord']):
-                                rdRec3gResp, rdRec3gSW1, rdRec3gSW2 = self.cmdReadRecord3g(i+1, self.READ_RECORD_ABSOLUTE, fileDetails[efIndex]['fileRecordSize'])
-                                if rdRec3gSW1 != 0x90 and rdRec3gSW2 != 00:
-                                    # stop reading record, as EF may be invalidated and not readable
-                                    readableContent = False
-                                    # break
-                                recordList.append(toHexString(rdRec3gResp))
-                            if readableContent:
-                                if not 'fileContent' in fileDetails[efIndex]:
-                                    fileDetails[efIndex]['fileContent'] = recordList
-
-                        if fileDetails[efIndex]['fileStructure'] == 'transparent':
-                            transparentContentBuffer = ''
-                            readableContent = True
-                            # handle length more than one APDU
-                            index = 0
-                            while index < fileDetails[efIndex]['fileSize']:
-                                if (index + self.MAX_RESPONSE_LEN) > fileDetails[efIndex]['fileSize']:
-                                    tmpLen = fileDetails[efIndex]['fileSize'] - index
-                                else:
-                                    tmpLen = self.MAX_RESPONSE_LEN
-                                rdBin3gResp, rdBin3gSW1, rdBin3gSW2 = self.cmdReadBinary3g(index, tmpLen)
-                                if rdBin3gSW1 != 0x90 and rdBin3gSW2 != 00:
-                                    # stop reading binary content, as EF may be invalidated and not readable
-                                    readableContent = False
-                                if transparentContentBuffer == '':
-                                    transparentContentBuffer = toHexString(rdBin3gResp)
-                                else:
-                                    transparentContentBuffer = transparentContentBuffer + ' ' + toHexString(rdBin3gResp)
-                                index += tmpLen
-                            if readableContent:
-                                if not 'fileContent' in fileDetails[efIndex]:
-                                    fileDetails[efIndex]['fileContent'] = transparentContentBuffer
-
-            efIndex += 1
-
-        if self.auditOsLocks:
-            # read OS locks
-            # cycle card
-            self.initSCard()
-            logger.info('Reading OS locks')
-            self.pcomOutFile.writelines('; OS locks\n')
-
-            osLockBufferCount = self.countLockBuffer()
-            lockOffset = 0
-            while lockOffset < osLockBufferCount:
-                self.cmdReadOsLock(lockOffset, True)
-                lockOffset += 1
-        
         # print('DEBUG -- fileDetails:')
         # print(fileDetails)
         
         # dump file system to json
-        if self.fullScript:
-            for ef in fileDetails:
-                if ef['filePath'] == '3F002FE2':
-                    iccid = ef['fileContent']
-                    break
-            outTimeStamp = dateTimeNow.strftime("%Y%m%d%H%M")
-            self.fileSystemOutJson = self.destinationFolder + '\\' + self.swapIccid(iccid) + '__' + outTimeStamp + '.json'
-            with open(self.fileSystemOutJson, 'w') as json_file:
-                json.dump(fileDetails, json_file, indent=2)
-
-            # dump file system to html
-            self.fileSystemOutHtml = self.destinationFolder + '\\' + self.swapIccid(iccid) + '__' + outTimeStamp + '.html'
-            with open(self.fileSystemOutHtml, 'w') as self.htmlFile:
-                self.createDocumentHeader()
-                self.htmlFile.writelines('\n<div><h1>Card Serial #: ' + self.swapIccid(iccid) + '</h1></div>')
-                for ef in fileDetails:
-                    self.htmlFile.writelines('\n<div><h2>' + self.formatFileId(ef['filePath']) + ': ' + ef['fileName'] + '</h2></div>')
-                    self.createTableHeader()
-                    if ef.has_key('fileType'):
-                        self.htmlFile.writelines('\n<tr><td>File type</td>')
-                        self.htmlFile.writelines('<td>' + ef['fileType'] + '</td></tr>')
-                    if ef.has_key('sfi'):
-                        self.htmlFile.writelines('\n<tr><td>SFI</td>')
-                        self.htmlFile.writelines('<td>' + ef['sfi'] + '</td></tr>')
-                    if ef.has_key('fileStructure'):
-                        self.htmlFile.writelines('\n<tr><td>File structure</td>')
-                        self.htmlFile.writelines('<td>' + ef['fileStructure'] + '</td></tr>')
-                    if ef.has_key('2gAcc'):
-                        self.htmlFile.writelines('\n<tr><td>2G access condition</td>')
-                        self.htmlFile.writelines('<td>' + ef['2gAcc'] + '</td></tr>')
-                    if ef.has_key('3gGetResponse'):
-                        self.htmlFile.writelines('\n<tr><td>File control parameter</td>')
-                        self.htmlFile.writelines('<td>' + ef['3gGetResponse'] + '</td></tr>')
-                    if ef.has_key('fileSize'):
-                        self.htmlFile.writelines('\n<tr><td>File size</td>')
-                        self.htmlFile.writelines('<td>' + str(ef['fileSize']) + '</td></tr>')
-                    if ef.has_key('fileRecordSize'):
-                        self.htmlFile.writelines('\n<tr><td>Record size</td>')
-                        self.htmlFile.writelines('<td>' + str(ef['fileRecordSize']) + '</td></tr>')
-                    if ef.has_key('numberOfRecord'):
-                        self.htmlFile.writelines('\n<tr><td>Number of record</td>')
-                        self.htmlFile.writelines('<td>' + str(ef['numberOfRecord']) + '</td></tr>')
-                    self.createTableFooter()
-                    if ef.has_key('fileContent'):
-                        self.htmlFile.writelines('\n<div>File content:</div>')
-                        self.createTableHeader()
-                        if ef['fileStructure'] == 'transparent':
-                            self.htmlFile.writelines('\n<tr><td class="data">' + ef['fileContent'] + '</td></tr>')
-                        if ef['fileStructure'] == 'linear fixed' or ef['fileStructure'] == 'cyclic':
-                            recordNumber = 0
-                            for record in ef['fileContent']:
-                                recordNumber += 1
-                                self.htmlFile.writelines('\n<tr><td class="data">' + str(recordNumber) + '</td>')
-                                self.htmlFile.writelines('<td class="data">' + record + '</td></tr>')
-                        self.createTableFooter()
-                    
-                self.htmlFile.writelines('\n<div><i>Generated with CardScanner on ' + generation_date + '</i></div>')
-                self.createDocumentFooter()
-
+        self.metrics.startPhase('dump')
+        if not self.opt_stream_only:
+            self.dumpFileDetails(fileDetails, dateTimeNow)
+        if self.osLocks is not None:
+            self.dumpOsLocks()
+
+        self.apduTrace.close()
+        self.removeCheckpoint()
+        self.metrics.endPhase()
+        self.closeStream(True, 'Scanning success')
         return True, "Scanning success"
 
+def scanReader(scanner, summary):
+    startTime = default_timer()
+    try:
+        scanOk, scanMsg = scanner.proceed()
+    except SystemExit:
+        scanOk, scanMsg = False, 'Scanning aborted'
+    except Exception as e:
+        logger.exception('reader %d: unexpected error' % scanner.readerNumber)
+        scanOk, scanMsg = False, str(e)
+    summary.update({
+        'success': scanOk,
+        'message': scanMsg,
+        'pcom': os.path.join(scanner.destinationFolder, scanner.pcomOutFileName),
+        'json': scanner.fileSystemOutJson,
+        'html': scanner.fileSystemOutHtml,
+        'elapsed': default_timer() - startTime,
+        'apdus': scanner.metrics.apduCount
+    })
+
+def scanMultipleReaders(template, readerNumbers):
+    # one card per reader, scanned concurrently; card I/O releases the GIL
+    if template.fileSystemXml != '':
+        parseFileSystemOk, parseFileSystemMsg = template.loadFileSystem()
+        if not parseFileSystemOk:
+            logger.error(parseFileSystemMsg)
+            return False, parseFileSystemMsg
+
+    summaries = []
+    threads = []
+    for readerNumber in readerNumbers:
+        scanner = template.cloneForReader(readerNumber)
+        summary = {'readerNumber': readerNumber}
+        summaries.append(summary)
+        thread = threading.Thread(target=scanReader, args=(scanner, summary), name='reader%d' % readerNumber)
+        threads.append(thread)
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = 0
+    for summary in summaries:
+        if summary['success']:
+            logger.info('reader %d: %s (%.1f s, %d APDUs)' % (summary['readerNumber'], summary['message'], summary['elapsed'], summary['apdus']))
+        else:
+            failed += 1
+            logger.error('reader %d: %s' % (summary['readerNumber'], summary['message']))
+
+    summaryFileName = os.path.join(template.destinationFolder, 'scan-summary__' + datetime.now().strftime("%Y%m%d%H%M%S") + '.json')
+    with open(summaryFileName, 'w') as json_file:
+        json.dump(summaries, json_file, indent=2)
+    logger.info('%d of %d card(s) scanned; summary: %s' % (len(summaries) - failed, len(summaries), summaryFileName))
+    return failed == 0, summaryFileName
+
 # main program
 if __name__ == '__main__':
     readerNumber = 0
@@ -1249,8 +1860,8 @@ if __name__ == '__main__':
 
     import argparse
     parser = argparse.ArgumentParser('scanner')
-    parser.add_argument("--readers", action="store_true", help="display list of available readers")
-    parser.add_argument("--reader", type=int, default=0, help="reader number")
+    parser.add_argument("--readers", nargs='?', const='list', help="display list of available readers; 'all' scans every reader")
+    parser.add_argument("--reader", default='0', help="reader number, or comma separated reader numbers to scan concurrently")
     parser.add_argument("--adm1", help="issuer security code 1 (initiate full script operation)")
     parser.add_argument("--adm2", help="issuer security code 2")
     parser.add_argument("--adm3", help="issuer security code 3")
@@ -1258,16 +1869,31 @@ if __name__ == '__main__':
     parser.add_argument("--chv1", help="pin 1")
     parser.add_argument("--chv2", help="pin 2")
     parser.add_argument("--content3g", action="store_true", help="read content in 3G mode")
+    parser.add_argument("--unified", action="store_true", help="scan 2G and 3G in one session if card allows it")
+    parser.add_argument("--policy", help="json content policy: which EFs to read and how much of them")
+    parser.add_argument("--structure-only", action="store_true", help="read file list and FCP only, no content")
+    parser.add_argument("--digest", action="store_true", help="store content digests in json dump (see scanDigest.py)")
+    parser.add_argument("--resume", action="store_true", help="continue interrupted scan from its checkpoint")
+    parser.add_argument("--stream", action="store_true", help="also write ndjson (one line per file) while scanning")
+    parser.add_argument("--stream-only", action="store_true", help="write ndjson only, no json/html dump")
+    parser.add_argument("--rescan", help="json dump of a previous scan; read content again (3G, by SFI when available)")
     parser.add_argument("-i", "--input", help="file system xml")
+    parser.add_argument("--trace", choices=TRACE_LEVELS, default=TRACE_PCOM, help="script output: none, pcom (default) or debug (every APDU)")
+    parser.add_argument("--lock-baseline", help="os locks json of reference card; OS locks are audited and compared with it")
+    parser.add_argument("--metrics", help="folder where json and prometheus (.prom) metrics of the run are written")
+    parser.add_argument("--cache", action="store_true", help="keep compiled file system xml in " + CardScanner.profileCacheDir)
+    parser.add_argument("--tree-cache", action="store_true", help="reuse file tree found by read header on cards with same ATR and root files")
     parser.add_argument("-o", "--output", help="script output name")
     parser.add_argument("--adm1p2", help="custom P2 for ADM1 (2G mode)")
     parser.add_argument("--adm2p2", help="custom P2 for ADM2 (2G mode)")
     parser.add_argument("--adm3p2", help="custom P2 for ADM3 (2G mode)")
     parser.add_argument("--adm4p2", help="custom P2 for ADM4 (2G mode)")
+    parser.add_argument("--simulate", help="scan simulated card built from json dump or pcom trace instead of reader")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated card latency per APDU (ms)")
     
     args = parser.parse_args()
 
-    if args.readers:
+    if args.readers == 'list':
         if not len(readers()) == 0:
             readerIndex = 0
             for reader in readers():
@@ -1277,7 +1903,17 @@ if __name__ == '__main__':
             logger.error('No smartcard reader(s) detected.')
         sys.exit()
     
-    readerNumber = args.reader
+    if args.readers == 'all':
+        readerNumbers = range(len(readers()))
+        if len(readerNumbers) == 0:
+            logger.error('No smartcard reader(s) detected.')
+            sys.exit(-1)
+    elif args.readers:
+        parser.error("--readers accepts no value or 'all'")
+    else:
+        readerNumbers = [int(number) for number in args.reader.split(',')]
+
+    readerNumber = readerNumbers[0]
     adm1 = args.adm1
     adm2 = args.adm2
     adm3 = args.adm3
@@ -1328,7 +1964,57 @@ if __name__ == '__main__':
     if fileSystemXml:
         scanner.fileSystemXml = fileSystemXml
 
+    if args.cache:
+        scanner.opt_profile_cache = True
+
+    if args.tree_cache:
+        scanner.opt_tree_cache = True
+
+    scanner.traceLevel = args.trace
+
+    if args.lock_baseline:
+        scanner.auditOsLocks = True
+        scanner.osLockBaseline = args.lock_baseline
+
+    if args.metrics:
+        scanner.metricsExportDir = args.metrics
+
     if args.content3g:
         scanner.opt_read_content_3g = True
 
+    if args.unified:
+        scanner.opt_unified_scan = True
+
+    if args.rescan:
+        scanner.opt_rescan_reference = args.rescan
+
+    if args.digest:
+        scanner.opt_content_digest = True
+
+    if args.resume:
+        scanner.opt_resume = True
+
+    if args.stream:
+        scanner.opt_stream = True
+
+    if args.stream_only:
+        scanner.opt_stream_only = True
+
+    if args.structure_only:
+        scanner.contentPolicy = ContentPolicy.structureOnly()
+    elif args.policy:
+        scanner.contentPolicy = ContentPolicy.fromFile(args.policy)
+
+    if args.simulate:
+        from cardSimulator import SimulatedCard, SimulatedReader
+        simulatedCard = SimulatedCard.fromFile(args.simulate)
+        simulatedCard.latency = args.latency / 1000.0
+        scanner.cardBackend = SimulatedReader(simulatedCard)
+
+    if len(readerNumbers) > 1:
+        if args.simulate:
+            sys.exit('--simulate scans a single card; use one reader')
+        multiScanOk, summaryFileName = scanMultipleReaders(scanner, readerNumbers)
+        sys.exit(0 if multiScanOk else -1)
+
     scanner.proceed()